@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+paho MQTT บน asyncio event loop (ไม่มี loop_start thread)
+
+- socket ของ paho ถูกผูกกับ loop ด้วย add_reader / add_writer (on_socket_* callbacks)
+  -> publish / on_message ทำงานบน thread เดียวกับ WebSocket server
+- loop_misc() ทุก 1 วินาที (keepalive / retry)
+- wait_published(info): รอ PUBACK ของ qos 1 (resolve จาก on_publish ตาม mid)
+- หลุด -> reconnect แบบ backoff (1, 2, 4 ... สูงสุด MQTT_RECONNECT_MAX วินาที)
+
+ใช้:
+    aio = AsyncMqtt(asyncio.get_running_loop(), "ws-bridge-server")
+    setup_amr_status_subscriptions(aio.client, on_event=...)   # on_connect / on_message เดิม
+    await aio.connect()
+    info = publish_job_topics(aio.client, ...)
+    acked, secs = await aio.wait_published(info)
+"""
+
+import os, time, asyncio
+from typing import Dict, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+
+from fn_server import MQTT_HOST, MQTT_PORT, mqtt_client
+
+MQTT_ACK_TIMEOUT   = float(os.getenv("MQTT_ACK_TIMEOUT", "2.0"))
+MQTT_RECONNECT_MAX = float(os.getenv("MQTT_RECONNECT_MAX", "30"))
+
+class AsyncMqtt:
+    def __init__(self, loop: asyncio.AbstractEventLoop, client_id: str,
+                 host: str = MQTT_HOST, port: int = MQTT_PORT, keepalive: int = 60):
+        self.loop = loop
+        self.host, self.port, self.keepalive = host, port, keepalive
+        self.client = mqtt_client(client_id)
+        c = self.client
+        c.on_socket_open = self._on_socket_open
+        c.on_socket_close = self._on_socket_close
+        c.on_socket_register_write = self._on_register_write
+        c.on_socket_unregister_write = self._on_unregister_write
+        c.on_publish = self._on_publish
+        c.on_disconnect = self._on_disconnect
+
+        self._acks: Dict[int, asyncio.Future] = {}
+        self._early: Dict[int, float] = {}    # PUBACK ที่มาก่อน wait_published (mid -> เวลา)
+        self._misc: Optional[asyncio.Task] = None
+        self._reconnect: Optional[asyncio.Task] = None
+        self._closing = False
+        # stats
+        self.acked = 0
+        self.ack_timeouts = 0
+        self.reconnects = 0
+
+    # ---------- socket <-> loop ----------
+    def _on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        if self._misc is None or self._misc.done():
+            self._misc = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+
+    def _on_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def _on_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    async def _misc_loop(self):
+        while not self._closing:
+            if self.client.loop_misc() != mqtt.MQTT_ERR_SUCCESS and not self.client.is_connected():
+                break
+            await asyncio.sleep(1.0)
+
+    # ---------- connect / reconnect ----------
+    async def connect(self):
+        """connect ครั้งแรก (ถ้าไม่ได้ -> retry เบื้องหลัง แล้วคืนทันที)"""
+        try:
+            self.client.connect(self.host, self.port, self.keepalive)
+        except Exception as e:
+            print(f"[MQTT] connect {self.host}:{self.port} failed: {e} (retry in background)")
+            self._schedule_reconnect()
+
+    def _on_disconnect(self, client, userdata, rc):
+        if self._closing:
+            return
+        print(f"[MQTT] disconnected rc={rc}")
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        if self._reconnect is None or self._reconnect.done():
+            self._reconnect = self.loop.create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self):
+        delay = 1.0
+        while not self._closing and not self.client.is_connected():
+            await asyncio.sleep(delay)
+            try:
+                self.client.reconnect()
+                self.reconnects += 1
+                print("[MQTT] reconnected")
+                return
+            except Exception as e:
+                print(f"[MQTT] reconnect failed: {e} (next in {min(delay * 2, MQTT_RECONNECT_MAX):.0f}s)")
+                delay = min(delay * 2, MQTT_RECONNECT_MAX)
+
+    def is_connected(self) -> bool:
+        return self.client.is_connected()
+
+    # ---------- PUBACK ----------
+    def _on_publish(self, client, userdata, mid, *args):
+        fut = self._acks.pop(mid, None)
+        if fut is None:
+            self._early[mid] = time.perf_counter()
+            if len(self._early) > 1024:
+                self._early.clear()
+        elif not fut.done():
+            fut.set_result(time.perf_counter())
+
+    async def wait_published(self, info: Optional[mqtt.MQTTMessageInfo],
+                             timeout: float = MQTT_ACK_TIMEOUT) -> Tuple[bool, float]:
+        """คืน (acked, วินาทีตั้งแต่เรียก publish จนได้ PUBACK/ส่งออก) ; ไม่ได้ภายใน timeout -> (False, timeout)"""
+        if info is None or info.rc != mqtt.MQTT_ERR_SUCCESS:
+            return False, 0.0
+        t0 = time.perf_counter()
+        if info.mid in self._early:
+            self._early.pop(info.mid)
+            self.acked += 1
+            return True, 0.0
+        fut = self.loop.create_future()
+        self._acks[info.mid] = fut
+        try:
+            t1 = await asyncio.wait_for(fut, timeout)
+            self.acked += 1
+            return True, t1 - t0
+        except asyncio.TimeoutError:
+            self._acks.pop(info.mid, None)
+            self.ack_timeouts += 1
+            return False, timeout
+
+    async def close(self):
+        self._closing = True
+        for t in (self._misc, self._reconnect):
+            if t is not None:
+                t.cancel()
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
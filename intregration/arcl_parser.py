@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ARCL status parser (single pass)
+
+- แยกประเภทบรรทัดจาก keyword ตัวแรก (dict lookup) แล้วรันเฉพาะ extractor ของประเภทนั้น
+- บรรทัดที่ไม่รู้จักและไม่มี ':' '=' '%' -> คืน record ว่างทันที (ไม่รัน regex เลย)
+  เช่นบรรทัด help ของ ARCL ("dock          Sends the robot to the dock")
+- บรรทัดแบบ key/value (Status: .. StateOfCharge: .. Location: ..) แยกด้วย regex เดียว
+- รูปแบบเดิม (state=.., task state=.., battery 80%, x=.. y=..) ใช้ grammar รวมอันเดียว (finditer ครั้งเดียว)
+
+parse(line) -> ArclStatus (NamedTuple) ; ArclStatus.as_dict() = shape ของ dict เดิมของ fn_server.parse_arcl_line
+แต่ผลต่างจาก parser เดิมโดยตั้งใจ (ดู python bench_arcl.py --diff N):
+- บรรทัด help ("dock ...", "queryDockStatus ...") ไม่ถูกนับเป็น battery.charging อีก -> {}
+- event เปล่า ("Parking", "Docked", "Going to X", "Arrived at X") ได้ state (+ goal) ; เดิมได้ {}
+- บรรทัด "Status: .. StateOfCharge: .. Location: .. LocalizationScore: .." ได้ state / battery / pose /
+  localization_score ; เดิมได้ {}
+"""
+
+import re
+from typing import Any, Dict, NamedTuple, Optional
+
+class ArclStatus(NamedTuple):
+    kind: str                           # status | arrived | going | event | legacy | none
+    state: Optional[str] = None
+    task_state: Optional[str] = None
+    goal: Optional[str] = None
+    battery_pct: Optional[float] = None
+    charging: Optional[bool] = None
+    localization: Optional[str] = None
+    localization_score: Optional[float] = None
+    x: Optional[float] = None
+    y: Optional[float] = None
+    theta: Optional[float] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """shape ของ dict เดิม (เฉพาะ field ที่มีค่า) ; ค่าต่างจาก parser เดิมสำหรับบรรทัด help, event เปล่า และ Status: (ดูหัวไฟล์)"""
+        out: Dict[str, Any] = {}
+        if self.kind == "none":
+            return out
+        if self.state is not None:        out["state"] = self.state
+        if self.task_state is not None:   out["task_state"] = self.task_state
+        if self.goal is not None:         out["goal"] = self.goal
+        batt = {}
+        if self.battery_pct is not None:  batt["percent"] = self.battery_pct
+        if self.charging is not None:     batt["charging"] = self.charging
+        if batt:                          out["battery"] = batt
+        if self.localization is not None: out["localization"] = self.localization
+        if self.localization_score is not None: out["localization_score"] = self.localization_score
+        pose = {k: v for k, v in (("x", self.x), ("y", self.y), ("theta", self.theta)) if v is not None}
+        if pose:                          out["pose"] = pose
+        return out
+
+EMPTY = ArclStatus("none")
+
+def _num(s: str) -> Optional[float]:
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+def _pct(s: str) -> Optional[Any]:
+    v = _num(s.rstrip("%"))
+    if v is None:
+        return None
+    return int(v) if v.is_integer() else v
+
+# ---------- ARCL "Key: value Key: value" ----------
+_re_kv = re.compile(r"([A-Za-z]+):\s*")
+
+def _state_of(text: str):
+    """'Going to Goal1' -> ('GOING', 'Goal1') ; 'Parking' -> ('PARKING', None)"""
+    low = text.lower()
+    for prefix, st in (("arrived at ", "ARRIVED"), ("going to ", "GOING"), ("docking to ", "DOCKING")):
+        if low.startswith(prefix):
+            return st, text[len(prefix):].strip() or None
+    return text.strip().upper().replace(" ", "_") or None, None
+
+def _parse_kv(line: str) -> ArclStatus:
+    parts = _re_kv.split(line)     # ['', key, value, key, value, ...]
+    f: Dict[str, Any] = {}
+    for i in range(1, len(parts) - 1, 2):
+        key, val = parts[i].lower(), parts[i + 1].strip()
+        if key == "status":
+            f["state"], goal = _state_of(val)
+            if goal:
+                f["goal"] = goal
+        elif key == "stateofcharge":
+            f["battery_pct"] = _pct(val)
+        elif key == "location":
+            xyz = val.split()
+            if len(xyz) >= 3:
+                f["x"], f["y"], f["theta"] = _num(xyz[0]), _num(xyz[1]), _num(xyz[2])
+        elif key == "localizationscore":
+            f["localization_score"] = _num(val)
+        elif key == "dockingstate":
+            dv = val.split()[0].lower() if val else ""
+            if dv:
+                f["charging"] = dv == "docked"
+        elif key == "chargestate":
+            if val:
+                f["charging"] = val.split()[0].lower() not in ("not", "notcharging", "none")
+    return ArclStatus("status", **{k: v for k, v in f.items() if v is not None})
+
+# ---------- event lines (ขึ้นต้นด้วยคำ ไม่มี key:) ----------
+def _parse_arrived(s: str) -> ArclStatus:
+    return ArclStatus("arrived", state="ARRIVED", goal=s[len("arrived at"):].strip() or None)
+
+def _parse_going(s: str) -> ArclStatus:
+    return ArclStatus("going", state="GOING", goal=s[len("going to"):].strip() or None)
+
+_EVENTS = {
+    "parking":    ArclStatus("event", state="PARKING"),
+    "parked":     ArclStatus("event", state="PARKED"),
+    "docking":    ArclStatus("event", state="DOCKING"),
+    "docked":     ArclStatus("event", state="DOCKED", charging=True),
+    "undocking":  ArclStatus("event", state="UNDOCKING", charging=False),
+    "undocked":   ArclStatus("event", state="UNDOCKED", charging=False),
+    "charging":   ArclStatus("event", state="CHARGING", charging=True),
+}
+
+# ---------- รูปแบบเดิม (grammar เดียว) ----------
+_re_legacy = re.compile(
+    r"\btask\s*state\s*[:=]\s*(?P<task>[A-Za-z_]+)"
+    r"|\bstate\s*[:=]\s*(?P<state>[A-Za-z_]+)"
+    r"|\b(?:batt|battery).{0,10}?(?P<pct>\d{1,3})\s*%"
+    r"|\b(?P<chg>charging|discharging|dock(?:ed)?|undock(?:ed)?)"
+    r"|\b(?:localization|loc)\s*[:=]\s*(?P<loc>[A-Za-z_]+)"
+    r"|\b(?P<axis>x|y|theta)\s*[:=]\s*(?P<val>-?\d+(?:\.\d+)?)",
+    re.I)
+
+def _parse_legacy(line: str) -> ArclStatus:
+    f: Dict[str, Any] = {}
+    for m in _re_legacy.finditer(line):
+        g = m.lastgroup
+        if g == "task":
+            f.setdefault("task_state", m.group("task").upper())
+            f.setdefault("state", m.group("task").upper())      # เดิม regex state ก็ match ใน "task state" ด้วย
+        elif g == "state":
+            f.setdefault("state", m.group("state").upper())
+        elif g == "pct":
+            f.setdefault("battery_pct", int(m.group("pct")))
+        elif g == "chg":
+            kw = m.group("chg").lower()
+            f.setdefault("charging", kw == "charging" or kw.startswith("dock"))
+        elif g == "loc":
+            f.setdefault("localization", m.group("loc").upper())
+        elif g == "val":
+            f[m.group("axis").lower()] = float(m.group("val"))
+    return ArclStatus("legacy", **f) if f else EMPTY
+
+_KV_KEYS = frozenset(("status", "stateofcharge", "location", "localizationscore",
+                      "dockingstate", "extendedstatusforhumans", "temperature"))
+
+def parse(line: str) -> ArclStatus:
+    s = line.strip()
+    if not s:
+        return EMPTY
+    head = s.split(None, 1)[0]
+    key = head.rstrip(":").lower()
+    if head.endswith(":") and key in _KV_KEYS:
+        return _parse_kv(s)
+    if key == "arrived" and s[:10].lower() == "arrived at":
+        return _parse_arrived(s)
+    if key == "going" and s[:8].lower() == "going to":
+        return _parse_going(s)
+    ev = _EVENTS.get(key)
+    if ev is not None and len(head) == len(s):
+        return ev
+    if ":" not in s and "=" not in s and "%" not in s:
+        return EMPTY      # ข้อความอิสระ / help ของ ARCL
+    return _parse_legacy(s)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark: arcl_parser.parse เทียบกับ parse_arcl_line แบบเดิม (regex 6 ตัว/บรรทัด)
+
+    python bench_arcl.py                              # logs/server.log
+    python bench_arcl.py logs/server.log -n 20 --diff 10
+
+บรรทัดที่มี "raw: ..." (log ของ main_server) จะใช้เฉพาะข้อความ ARCL ส่วนนั้น
+(logs/communicate_AMR.log มีแต่ traceback ไม่มีบรรทัด ARCL -> วัดได้แค่ทาง early exit ของบรรทัดที่ไม่รู้จัก)
+"""
+
+import os, re, time, argparse
+from typing import Any, Dict, List
+
+from arcl_parser import parse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# ---------- parser เดิม (คัดลอกจาก fn_server ก่อนเปลี่ยน) ----------
+_re_state        = re.compile(r"\bstate\s*[:=]\s*([A-Za-z_]+)", re.I)
+_re_task_state   = re.compile(r"\btask\s*state\s*[:=]\s*([A-Za-z_]+)", re.I)
+_re_batt_pct     = re.compile(r"\b(batt|battery).{0,10}?(\d{1,3})\s*%")
+_re_batt_chg     = re.compile(r"\b(charging|discharging|dock(ed)?|undock(ed)?)", re.I)
+_re_loc          = re.compile(r"\b(localization|loc)\s*[:=]\s*([A-Za-z_]+)", re.I)
+_re_pose         = re.compile(r"\b(x|y|theta)\s*[:=]\s*(-?\d+(\.\d+)?)", re.I)
+
+def legacy_parse_arcl_line(line: str) -> Dict[str, Any]:
+    out = {}
+    m = _re_state.search(line);       out["state"] = m.group(1).upper() if m else None
+    m = _re_task_state.search(line);  out["task_state"] = m.group(1).upper() if m else None
+
+    batt = {}
+    p = _re_batt_pct.search(line)
+    if p:
+        try: batt["percent"] = int(p.group(2))
+        except: pass
+    c = _re_batt_chg.search(line)
+    if c:
+        kw = c.group(1).lower()
+        batt["charging"] = ("charg" in kw) or ("dock" in kw)
+    out["battery"] = batt if batt else None
+
+    m = _re_loc.search(line);         out["localization"] = m.group(2).upper() if m else None
+
+    pose = {}
+    for k, v, _ in _re_pose.findall(line):
+        try: pose[k.lower()] = float(v)
+        except: pass
+    out["pose"] = pose if pose else None
+
+    return {k: v for k, v in out.items() if v is not None}
+
+# ---------- input ----------
+_RAW = re.compile(r"raw: (.*?)(?: \(unparsed\))?(?:\s+raw_ts=\S+)?$")
+
+def load_lines(paths: List[str]) -> List[str]:
+    out = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                m = _RAW.search(line)
+                out.append(m.group(1) if m else line)
+    return out
+
+def _time(fn, lines: List[str], rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        for ln in lines:
+            fn(ln)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main():
+    ap = argparse.ArgumentParser(description="ARCL parser benchmark")
+    ap.add_argument("logs", nargs="*", default=[os.path.join(HERE, "logs", "server.log")])
+    ap.add_argument("-n", "--rounds", type=int, default=5, help="จำนวนรอบ (ใช้รอบที่เร็วที่สุด)")
+    ap.add_argument("--diff", type=int, default=0, help="แสดงบรรทัดที่ผลต่างจากเดิม N บรรทัด")
+    args = ap.parse_args()
+
+    lines = load_lines(args.logs)
+    if not lines:
+        print("no lines"); return
+    t_old = _time(legacy_parse_arcl_line, lines, args.rounds)
+    t_new = _time(lambda ln: parse(ln).as_dict(), lines, args.rounds)
+    t_rec = _time(parse, lines, args.rounds)
+
+    n = len(lines)
+    kinds: Dict[str, int] = {}
+    diffs = []
+    for ln in lines:
+        rec = parse(ln)
+        kinds[rec.kind] = kinds.get(rec.kind, 0) + 1
+        a, b = legacy_parse_arcl_line(ln), rec.as_dict()
+        if a != b:
+            diffs.append((ln, a, b))
+
+    print(f"lines={n}  rounds={args.rounds}")
+    print(f"legacy  : {t_old*1e6/n:8.2f} us/line")
+    print(f"as_dict : {t_new*1e6/n:8.2f} us/line  ({t_old/t_new:5.1f}x)")
+    print(f"record  : {t_rec*1e6/n:8.2f} us/line  ({t_old/t_rec:5.1f}x)")
+    print("kinds   : " + ", ".join(f"{k}={v}" for k, v in sorted(kinds.items(), key=lambda kv: -kv[1])))
+    print(f"differs : {len(diffs)} lines ({len(diffs)*100.0/n:.2f}%)")
+    for ln, a, b in diffs[:args.diff]:
+        print(f"  {ln[:70]!r}\n    legacy={a}\n    new   ={b}")
+
+if __name__ == "__main__":
+    main()
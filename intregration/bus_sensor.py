@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json
+import json, time, itertools
 import paho.mqtt.client as mqtt
 
 class MqttBus:
     def __init__(self, host="127.0.0.1", port=1883, base="smartcart",
-                 user=None, password=None, client_id="sensor-node", keepalive=30):
+                 user=None, password=None, client_id="sensor-node", keepalive=30,
+                 cart_id=None):
         self.base = base.rstrip("/")
+        # cart_id -> publish ที่ <base>/sensor/<cart_id> (ให้ match_id แบ่ง worker ตาม cart ได้)
+        self.sensor_topic = f"{self.base}/sensor/{cart_id}" if cart_id else f"{self.base}/sensor"
         # ใช้ API v1 เพื่อให้เข้ากับโค้ดเดิมของคุณ
+        self._seq = itertools.count(1)    # seq + ts ใน payload = key กันซ้ำของ match_id
         self.cli = mqtt.Client(client_id=client_id, clean_session=True)
         if user and password:
             self.cli.username_pw_set(user, password)
@@ -17,7 +21,8 @@ class MqttBus:
         print(f"[MQTT] connected to {host}:{port}, base='{self.base}'")
 
     def publish_sensor(self, payload: dict, qos=0, retain=False):
-        topic = f"{self.base}/sensor"  # ให้ match_id รับจากที่นี่
+        topic = self.sensor_topic  # ให้ match_id รับจากที่นี่
+        payload = {**payload, "seq": next(self._seq), "ts": time.time()}
         self.cli.publish(topic, json.dumps(payload, ensure_ascii=False), qos=qos, retain=retain)
         print(f"[PUB] {topic}: {payload}")
 
@@ -4,21 +4,27 @@
 import os, json, time, telnetlib, signal, threading, queue, traceback, re
 from collections import deque
 import paho.mqtt.client as mqtt
+from goals_registry import get_registry, install_reload_signal
+from fleet import amr_topics
+from supervisor import mark_ready
 
 VERSION = "seq-2.2-return-match-at-destination"
 
 # ================= CONFIG =================
-STATE_PATH      = os.path.expanduser("~/cart_ws/intregration/data/state.json")
-GOALS_MAP_PATH  = os.path.expanduser("~/cart_ws/intregration/data/goals_map.json")
+GOALS_MAP_PATH  = get_registry().path
 
 MQTT_HOST  = os.getenv("MQTT_HOST", "127.0.0.1")
 MQTT_PORT  = int(os.getenv("MQTT_PORT", "1883"))
 BASE       = os.getenv("MQTT_BASE", "smartcart")
 
-SUB_TOPIC       = f"{BASE}/toggle_omron"        # trigger จาก FSM/run_all
+# fleet: run_all ตั้ง AMR_ID ต่อหุ่น -> topic แยก {BASE}/amr/<id>/... (ว่าง = topic เดิม)
+AMR_ID          = os.getenv("AMR_ID", "").strip()
+_TOPICS         = amr_topics(AMR_ID, BASE)
+
+SUB_TOPIC       = _TOPICS["toggle"]             # trigger จาก FSM/run_all
 MATCH_TOPIC     = f"{BASE}/match"               # ผลจาก match_id (complete true/false)
-STATUS_TOPIC    = f"{BASE}/amr/status"          # publish สถานะบรรทัดดิบจาก ARCL
-CONNECTED_TOPIC = f"{BASE}/amr/connected"       # publish true/false
+STATUS_TOPIC    = _TOPICS["status"]             # publish สถานะบรรทัดดิบจาก ARCL
+CONNECTED_TOPIC = _TOPICS["connected"]          # publish true/false
 
 AMR_HOST   = os.getenv("AMR_HOST", "192.168.0.3")
 AMR_PORT   = int(os.getenv("AMR_PORT", "7171"))
@@ -42,28 +48,6 @@ SAY_DONE_PATTERNS = (
     "TTS finished",
 )
 
-# ================ helpers ================
-def _load_json(path: str):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"[LOAD] {path} failed: {e}")
-        return {}
-
-def _resolve_goal(goal_id: str, goals_map: dict):
-    
-    if not goal_id or not isinstance(goals_map, dict):
-        return None
-    entry = goals_map.get(goal_id)
-    if entry is None:
-        return None
-    if isinstance(entry, str):
-        return entry
-    if isinstance(entry, dict):
-        return entry.get("goal") or entry.get("destination_goal") or entry.get("arcl_goal") or entry.get("name")
-    return None
-
 # ========== Telnet Manager ==========
 class TelnetAMR:
     def __init__(self, host, port, password, mqtt_client):
@@ -406,10 +390,11 @@ class TelnetAMR:
 
 # ============== MQTT glue ==============
 def on_connect(client, userdata, flags, rc):
-    print(f"[MAIN] starting communicate_AMR ({VERSION})")
+    print(f"[MAIN] starting communicate_AMR ({VERSION}) amr_id={AMR_ID or '-'}")
     print(f"[MQTT] sub {SUB_TOPIC} , {MATCH_TOPIC}")
     client.subscribe(SUB_TOPIC, qos=1)
     client.subscribe(MATCH_TOPIC, qos=1)
+    mark_ready(client)
 
 def on_message(client, userdata, msg):
     amr: TelnetAMR = userdata["amr"]
@@ -421,6 +406,9 @@ def on_message(client, userdata, msg):
         except Exception:
             return
         complete = bool(m.get("complete"))
+        goal = (m.get("latest_job_ids") or {}).get("goal_id") or m.get("goal_id")
+        if AMR_ID and goal and amr._current_goal_id and goal != amr._current_goal_id:
+            return      # fleet: match ของงานหุ่นตัวอื่น
         amr._last_match_complete = complete
         amr._last_match_ts = time.time()
         print(f"[MATCH] update complete={complete} ts={amr._last_match_ts}")
@@ -439,8 +427,7 @@ def on_message(client, userdata, msg):
 
         print(f"[TRIGGER] received. op={op} goal_id={goal_id}")
 
-        goals_map = _load_json(GOALS_MAP_PATH)
-        destination_goal = _resolve_goal(goal_id, goals_map)
+        destination_goal = get_registry().resolve(goal_id)
         if not destination_goal:
             print(f"[MAP] goal_id '{goal_id}' not found in {GOALS_MAP_PATH}")
             return
@@ -461,7 +448,7 @@ def on_message(client, userdata, msg):
 
 # ================ main ================
 def main():
-    cli = mqtt.Client(client_id="communicate_AMR", userdata={})
+    cli = mqtt.Client(client_id=f"communicate_AMR-{AMR_ID}" if AMR_ID else "communicate_AMR", userdata={})
     amr = TelnetAMR(AMR_HOST, AMR_PORT, AMR_PASS, cli)
     cli.user_data_set({"amr": amr})
 
@@ -481,6 +468,7 @@ def main():
 
     signal.signal(signal.SIGINT, _exit)
     signal.signal(signal.SIGTERM, _exit)
+    install_reload_signal()
 
     cli.loop_start()
     print("[MAIN] running. Press Ctrl+C to quit.")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+AMR fleet config + topic namespace + assignment policy (ไม่มี dependency ของ MQTT)
+
+    AMR_FLEET="amr1=192.168.0.3:7171,amr2=192.168.0.4"    # id=host[:port]
+    FLEET_POLICY=fifo | least_loaded | nearest
+
+- ไม่ตั้ง AMR_FLEET -> หุ่น 1 ตัว id "" ใช้ topic เดิม (AMR_HOST / AMR_PORT)
+- หุ่นที่มี id ใช้ topic แยก:
+      {BASE}/amr/<id>/toggle      (แทน {BASE}/toggle_omron)
+      {BASE}/amr/<id>/status      (แทน {BASE}/amr/status)
+      {BASE}/amr/<id>/connected   (แทน {BASE}/amr/connected)
+- policy(job, lanes, goal_xy) เลือกหุ่นจาก lanes ที่ว่าง ; lane ต้องมี
+  amr_id, idle_since, jobs_done, busy_secs, pose (x, y) หรือ None
+"""
+
+import os, math
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+MQTT_BASE    = os.getenv("MQTT_BASE", "smartcart")
+AMR_FLEET    = os.getenv("AMR_FLEET", "").strip()
+FLEET_POLICY = os.getenv("FLEET_POLICY", "fifo").strip().lower()
+AMR_HOST     = os.getenv("AMR_HOST", "192.168.0.3")
+AMR_PORT     = int(os.getenv("AMR_PORT", "7171"))
+
+_RESERVED_IDS = ("status", "connected", "+", "#")
+
+class AmrEndpoint(NamedTuple):
+    id: str             # "" = หุ่นเดี่ยว (topic เดิม)
+    host: str
+    port: int
+
+def parse_fleet(spec: str = AMR_FLEET) -> List[AmrEndpoint]:
+    if not spec:
+        return [AmrEndpoint("", AMR_HOST, AMR_PORT)]
+    out: List[AmrEndpoint] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        amr_id, _, addr = part.partition("=")
+        amr_id = amr_id.strip()
+        if not amr_id or not addr or amr_id in _RESERVED_IDS or "/" in amr_id:
+            raise ValueError(f"bad AMR_FLEET entry '{part}' (expect id=host[:port])")
+        host, _, port = addr.strip().partition(":")
+        out.append(AmrEndpoint(amr_id, host, int(port) if port else AMR_PORT))
+    if len({e.id for e in out}) != len(out):
+        raise ValueError(f"duplicate AMR id in AMR_FLEET '{spec}'")
+    return out
+
+# ---------- topics ----------
+def amr_topics(amr_id: str, base: str = MQTT_BASE) -> Dict[str, str]:
+    if not amr_id:
+        return {"toggle": f"{base}/toggle_omron", "status": f"{base}/amr/status",
+                "connected": f"{base}/amr/connected"}
+    return {"toggle": f"{base}/amr/{amr_id}/toggle", "status": f"{base}/amr/{amr_id}/status",
+            "connected": f"{base}/amr/{amr_id}/connected"}
+
+def amr_wildcards(base: str = MQTT_BASE) -> Tuple[str, str]:
+    """(status, connected) ของหุ่นทุกตัวที่มี id"""
+    return f"{base}/amr/+/status", f"{base}/amr/+/connected"
+
+def parse_amr_topic(topic: str, base: str = MQTT_BASE) -> Optional[Tuple[str, str]]:
+    """'<base>/amr/status' -> ('', 'status') ; '<base>/amr/r2/status' -> ('r2', 'status')"""
+    prefix = base + "/amr/"
+    if not topic.startswith(prefix):
+        return None
+    rest = topic[len(prefix):].split("/")
+    if len(rest) == 1 and rest[0] in ("status", "connected"):
+        return "", rest[0]
+    if len(rest) == 2 and rest[1] in ("status", "connected"):
+        return rest[0], rest[1]
+    return None
+
+# ---------- policies ----------
+GoalXY = Callable[[Optional[str]], Optional[Tuple[float, float]]]
+
+def pick_fifo(job: Dict[str, Any], lanes: Sequence[Any], goal_xy: GoalXY) -> Any:
+    """หุ่นที่ว่างนานที่สุด"""
+    return min(lanes, key=lambda l: l.idle_since)
+
+def pick_least_loaded(job: Dict[str, Any], lanes: Sequence[Any], goal_xy: GoalXY) -> Any:
+    """หุ่นที่ทำงานมาน้อยที่สุด (จำนวนงาน แล้วเวลาวิ่ง)"""
+    return min(lanes, key=lambda l: (l.jobs_done, l.busy_secs, l.idle_since))
+
+def pick_nearest(job: Dict[str, Any], lanes: Sequence[Any], goal_xy: GoalXY) -> Any:
+    """หุ่นที่อยู่ใกล้ goal ที่สุด (ไม่รู้ตำแหน่ง goal/หุ่น -> fifo)"""
+    xy = goal_xy(job.get("goal_id"))
+    if xy is None:
+        return pick_fifo(job, lanes, goal_xy)
+    def _key(l):
+        if l.pose is None:
+            return (1, 0.0, l.idle_since)
+        return (0, math.hypot(l.pose[0] - xy[0], l.pose[1] - xy[1]), l.idle_since)
+    return min(lanes, key=_key)
+
+POLICIES: Dict[str, Callable[[Dict[str, Any], Sequence[Any], GoalXY], Any]] = {
+    "fifo": pick_fifo,
+    "least_loaded": pick_least_loaded,
+    "nearest": pick_nearest,
+}
+
+def get_policy(name: str = FLEET_POLICY):
+    fn = POLICIES.get(name)
+    if fn is None:
+        print(f"[FLEET] unknown FLEET_POLICY '{name}', use fifo")
+        return pick_fifo
+    return fn
+
+def goal_xy_from_entry(entry: Optional[Dict[str, Any]]) -> Optional[Tuple[float, float]]:
+    """entry ของ goals_map ที่มี x / y (หน่วยเดียวกับ pose ของ ARCL)"""
+    if not isinstance(entry, dict):
+        return None
+    try:
+        return float(entry["x"]), float(entry["y"])
+    except (KeyError, TypeError, ValueError):
+        return None
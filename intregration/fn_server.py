@@ -1,15 +1,16 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, json, time, unicodedata, re, tempfile
+import os, json, time, unicodedata
 from typing import Dict, Any, List, Optional, Tuple
 import paho.mqtt.client as mqtt
+from arcl_parser import parse as arcl_parse
+from fleet import amr_wildcards, parse_amr_topic
+from goals_registry import get_registry   # env GOALS_MAP_PATH หรือ data/goals_map.json
+from job_schema import DOT_RE
 
 # ========= PATHS =========
-DATA_DIR   = os.path.expanduser("~/cart_ws/intregration/data")
-STATE_PATH = os.path.join(DATA_DIR, "state.json")
-LOG_PATH   = os.path.join(DATA_DIR, "job_ids.jsonl")
-GOALS_MAP_PATH = os.getenv("GOALS_MAP_PATH", os.path.join(DATA_DIR, "goals_map.json"))
+from state_store import DATA_DIR
 os.makedirs(DATA_DIR, exist_ok=True)
 
 # ========= ENV / CONFIG =========
@@ -22,12 +23,18 @@ STATION_ID = os.getenv("STATION_ID", "slot1")
 
 TOPIC_JOB_LATEST     = f"{MQTT_BASE}/job/latest"
 TOPIC_JOB_EVENT      = f"{MQTT_BASE}/job/event"
+TOPIC_JOB_BATCH      = f"{MQTT_BASE}/job/batch"
 TOPIC_DETECT_DESIRED = f"{MQTT_BASE}/detect/{STATION_ID}/desired"
 TOPIC_DETECT_MODE    = f"{MQTT_BASE}/detect/{STATION_ID}/mode"
 
-# AMR topics (input from communicate_AMR)
+# AMR topics (input from communicate_AMR) ; fleet: {BASE}/amr/<id>/status|connected
 TOPIC_AMR_STATUS_IN = f"{MQTT_BASE}/amr/status"
 TOPIC_AMR_CONN_IN   = f"{MQTT_BASE}/amr/connected"
+TOPIC_AMR_FLEET_IN  = amr_wildcards(MQTT_BASE)
+
+# progress (input from run_all FSM / match_id) -> push ให้ WebSocket client
+TOPIC_FSM_STATE_IN  = f"{MQTT_BASE}/fsm/state"
+TOPIC_MATCH_IN      = f"{MQTT_BASE}/match"
 
 # ========= Utils: time / string =========
 def now_fields():
@@ -67,29 +74,27 @@ def _fill_two_slots(vals: List[str]) -> List[Optional[str]]:
     return v  # len == 2
 
 # ========= Goal map (STRICT: key ต้องเป็น DOTxxxxxx) =========
-_DOT_RE = re.compile(r"^DOT\d{6,}$", re.I)
+_DOT_RE = DOT_RE   # job_schema
 
 def _load_goals_map() -> Dict[str, str]:
-    try:
-        with open(GOALS_MAP_PATH, "r", encoding="utf-8") as f:
-            m = json.load(f)
-        # key = DOT..., value = goal_name
-        return {str(k).strip().upper(): str(v).strip() for k, v in m.items()}
-    except Exception:
-        return {}
+    # key = DOT..., value = goal_name (cache ใน goals_registry, reload เมื่อไฟล์เปลี่ยน)
+    return get_registry().snapshot()
 
-def validate_and_map_goal(dot_id: Optional[str]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+def validate_and_map_goal(dot_id: Optional[str], goals_map: Optional[Dict[str, str]] = None) -> Tuple[Optional[str], Optional[str], Optional[str]]:
     """
     รับ dot_id (อะไรก็ได้) -> (goal_id(DOT...), goal_name, error_msg)
     - goal_id ต้อง match ^DOT\d{6,}$ (case-insensitive) และอยู่ใน goals_map.json
+    - goals_map: snapshot จาก _load_goals_map() (ใช้ตอน validate หลายงานในรอบเดียว)
     """
     if not dot_id:
         return None, None, "missing DOT"
     s = str(dot_id).strip().upper()
     if not _DOT_RE.match(s):
         return None, None, f"invalid DOT format '{dot_id}'"
-    goals_map = _load_goals_map()  # hot-reload ทุกครั้ง
-    goal_name = goals_map.get(s)
+    if goals_map is not None:
+        goal_name = goals_map.get(s)
+    else:
+        goal_name = get_registry().resolve(s)  # cached, reload เมื่อ mtime/inode เปลี่ยน
     if not goal_name:
         return None, None, f"unknown DOT '{s}' (not found in goals_map.json)"
     return s, goal_name, None
@@ -104,29 +109,17 @@ def map_status_to_op(status: Any) -> Optional[str]:
         return s.capitalize()
     return None
 
-# ========= Safe write =========
-def _atomic_write(path: str, text: str):
-    d = os.path.dirname(path)
-    os.makedirs(d, exist_ok=True)
-    with tempfile.NamedTemporaryFile("w", dir=d, delete=False, encoding="utf-8") as tmp:
-        tmp.write(text); tmp.flush(); os.fsync(tmp.fileno())
-        tmp_path = tmp.name
-    os.replace(tmp_path, path)
-
-def persist_state_and_log(
+# ========= Persist =========
+def build_job_record(
     cuh_ids: List[str],
     kit_ids: List[str],
-    goal_id: str,              # DOT...
+    goal_id: str,
     ts, d, t, iso,
     op: Optional[str] = None,
-    goal_name: Optional[str] = None
-):
-    """
-    บันทึก state.json และ log (.jsonl)
-    - goal_id = DOTxxx
-    - goal_name = ชื่อ waypoint (จาก goals_map.json)
-    - op = 'Request'/'Return'
-    """
+    goal_name: Optional[str] = None,
+    job_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """payload ของงาน 1 รายการ (ใช้ทั้ง state.json และ log)"""
     cuh2 = _fill_two_slots(cuh_ids)
     kit2 = _fill_two_slots(kit_ids)
 
@@ -143,58 +136,29 @@ def persist_state_and_log(
         payload["kit_id"] = kit2[0]
     if op in ("Request", "Return"):
         payload["op"] = op
-
-    state = {"latest_job_ids": payload}
-    _atomic_write(STATE_PATH, json.dumps(state, ensure_ascii=False, indent=2))
-    with open(LOG_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(payload, ensure_ascii=False) + "\n")
-    print(f"[STATE] latest_job_ids: {payload}")
+    if job_id:
+        payload["job_id"] = job_id
+    return payload
 
 # ========= MQTT =========
-def mqtt_init(client_id: str = "ws-bridge-server") -> mqtt.Client:
+def mqtt_client(client_id: str = "ws-bridge-server") -> mqtt.Client:
+    """สร้าง client (ยังไม่ connect) — ใช้ร่วมกับ aio_mqtt ที่ต้องติด socket callback ก่อน connect"""
     cli = mqtt.Client(client_id=client_id, clean_session=True)
     if MQTT_USER:
         cli.username_pw_set(MQTT_USER, MQTT_PASS or "")
-    cli.connect(MQTT_HOST, MQTT_PORT, 60)
-    cli.loop_start()
     return cli
 
-def mqtt_pub(cli: mqtt.Client, topic: str, obj: Dict[str, Any], qos=0, retain=False):
-    cli.publish(topic, json.dumps(obj, ensure_ascii=False), qos=qos, retain=retain)
-
-# ========= ARCL parse (ย่อ) =========
-_re_state        = re.compile(r"\bstate\s*[:=]\s*([A-Za-z_]+)", re.I)
-_re_task_state   = re.compile(r"\btask\s*state\s*[:=]\s*([A-Za-z_]+)", re.I)
-_re_batt_pct     = re.compile(r"\b(batt|battery).{0,10}?(\d{1,3})\s*%")
-_re_batt_chg     = re.compile(r"\b(charging|discharging|dock(ed)?|undock(ed)?)", re.I)
-_re_loc          = re.compile(r"\b(localization|loc)\s*[:=]\s*([A-Za-z_]+)", re.I)
-_re_pose         = re.compile(r"\b(x|y|theta)\s*[:=]\s*(-?\d+(\.\d+)?)", re.I)
+def mqtt_pub(cli: mqtt.Client, topic: str, obj: Dict[str, Any], qos=0, retain=False) -> mqtt.MQTTMessageInfo:
+    return cli.publish(topic, json.dumps(obj, ensure_ascii=False), qos=qos, retain=retain)
 
+# ========= ARCL parse =========
 def parse_arcl_line(line: str) -> Dict[str, Any]:
-    out = {}
-    m = _re_state.search(line);       out["state"] = m.group(1).upper() if m else None
-    m = _re_task_state.search(line);  out["task_state"] = m.group(1).upper() if m else None
-
-    batt = {}
-    p = _re_batt_pct.search(line)
-    if p:
-        try: batt["percent"] = int(p.group(2))
-        except: pass
-    c = _re_batt_chg.search(line)
-    if c:
-        kw = c.group(1).lower()
-        batt["charging"] = ("charg" in kw) or ("dock" in kw)
-    out["battery"] = batt if batt else None
-
-    m = _re_loc.search(line);         out["localization"] = m.group(2).upper() if m else None
-
-    pose = {}
-    for k, v, _ in _re_pose.findall(line):
-        try: pose[k.lower()] = float(v)
-        except: pass
-    out["pose"] = pose if pose else None
-
-    return {k: v for k, v in out.items() if v is not None}
+    """
+    dict shape เดิม (state/task_state/battery/localization/pose) — ดู arcl_parser.parse สำหรับ record แบบ typed
+    ผลเปลี่ยนจาก regex เดิม: บรรทัด help (dock/undock ...) ไม่ใช่ charging แล้ว, event เปล่า ("Parking",
+    "Arrived at X") ได้ state, บรรทัด key/value "Status: .. StateOfCharge: .." ได้ state/battery/pose
+    """
+    return arcl_parse(line).as_dict()
 
 # ========= Mode / Publish =========
 def detect_mode_any(cuh_ids: List[str], kit_ids: List[str], goal: Optional[str]) -> Optional[str]:
@@ -206,7 +170,7 @@ def detect_mode_any(cuh_ids: List[str], kit_ids: List[str], goal: Optional[str])
     if has_kit and not has_cuh: return "KIT_ONLY"
     return None
 
-def publish_job_topics(cli: mqtt.Client, cuh_ids: List[str], kit_ids: List[str], goal: str, ts, d, t, iso, goal_name: Optional[str] = None):
+def publish_job_topics(cli: mqtt.Client, cuh_ids: List[str], kit_ids: List[str], goal: str, ts, d, t, iso, goal_name: Optional[str] = None, op: Optional[str] = None, job_id: Optional[str] = None):
     cuh2 = _fill_two_slots(cuh_ids)
     kit2 = _fill_two_slots(kit_ids)
     payload = {
@@ -218,8 +182,19 @@ def publish_job_topics(cli: mqtt.Client, cuh_ids: List[str], kit_ids: List[str],
         "cuh_id": cuh2[0],
         "kit_id": kit2[0]
     }
-    mqtt_pub(cli, TOPIC_JOB_LATEST, payload, qos=1, retain=True)
+    if op in ("Request", "Return"):
+        payload["op"] = op   # FSM ไม่ต้องรอ/อ่าน state.json
+    if job_id:
+        payload["job_id"] = job_id
+    info = mqtt_pub(cli, TOPIC_JOB_LATEST, payload, qos=1, retain=True)
     mqtt_pub(cli, TOPIC_JOB_EVENT,  payload, qos=0, retain=False)
+    return info   # qos 1 ของ job/latest (ใช้รอ PUBACK ได้)
+
+def publish_job_batch(cli: mqtt.Client, records: List[Dict[str, Any]]):
+    """หลายงานใน message เดียว (FSM enqueue ตามลำดับ)"""
+    if not records:
+        return None
+    return mqtt_pub(cli, TOPIC_JOB_BATCH, {"jobs": records, "count": len(records), "ts": records[-1].get("ts")}, qos=1, retain=False)
 
 def publish_detect_config(cli: mqtt.Client, cuh_ids: List[str], kit_ids: List[str], goal: str, ts, d, t, iso):
     mode = detect_mode_any(cuh_ids, kit_ids, goal)
@@ -242,11 +217,17 @@ def publish_detect_config(cli: mqtt.Client, cuh_ids: List[str], kit_ids: List[st
     mqtt_pub(cli, TOPIC_DETECT_MODE, {"mode": mode, "ts": ts}, qos=0, retain=False)
 
 # ========= MQTT subscription (AMR) =========
-def setup_amr_status_subscriptions(cli: mqtt.Client):
+def setup_amr_status_subscriptions(cli: mqtt.Client, on_event=None):
+    """
+    on_event(topic, data): ถ้าระบุ จะ subscribe FSM state / match เพิ่ม
+    และส่งทุก message ที่ decode แล้วให้ (ใช้ทำ progress push)
+    """
     def _on_connect(c, u, f, rc):
-        print(f"[MQTT] connected rc={rc}; sub {TOPIC_AMR_CONN_IN}, {TOPIC_AMR_STATUS_IN}")
-        c.subscribe(TOPIC_AMR_CONN_IN, qos=1)
-        c.subscribe(TOPIC_AMR_STATUS_IN, qos=0)
+        print(f"[MQTT] connected rc={rc}; sub {TOPIC_AMR_CONN_IN}, {TOPIC_AMR_STATUS_IN} (+ fleet)")
+        c.subscribe([(TOPIC_AMR_CONN_IN, 1), (TOPIC_AMR_STATUS_IN, 0),
+                     (TOPIC_AMR_FLEET_IN[1], 1), (TOPIC_AMR_FLEET_IN[0], 0)])
+        if on_event is not None:
+            c.subscribe([(TOPIC_FSM_STATE_IN, 1), (TOPIC_MATCH_IN, 0)])
 
     def _on_message(c, u, msg):
         topic = msg.topic
@@ -257,27 +238,41 @@ def setup_amr_status_subscriptions(cli: mqtt.Client):
             return
         ts, d, t, iso = now_fields()
 
-        if topic == TOPIC_AMR_CONN_IN:
+        if on_event is not None:
+            try:
+                on_event(topic, data)
+            except Exception as e:
+                print(f"[MQTT] on_event error ({topic}): {e}")
+            if topic in (TOPIC_FSM_STATE_IN, TOPIC_MATCH_IN):
+                return
+
+        amr = parse_amr_topic(topic, MQTT_BASE)
+        if amr is None:
+            return
+        tag = f"[AMR:{amr[0]}]" if amr[0] else "[AMR]"
+
+        if amr[1] == "connected":
             connected = bool(data.get("connected"))
-            print(f"[AMR][{iso}] CONNECTED = {connected}")
+            print(f"{tag}[{iso}] CONNECTED = {connected}")
             return
 
-        if topic == TOPIC_AMR_STATUS_IN:
+        if amr[1] == "status":
             raw_ts = data.get("ts")
             line = data.get("line", "")
-            parsed = parse_arcl_line(line)
+            rec = arcl_parse(line)
+            if rec.kind == "none":
+                print(f"{tag}[{iso}] raw: {line} (unparsed)  raw_ts={raw_ts}")
+                return
             pretty = []
-            if "state" in parsed:        pretty.append(f"state={parsed['state']}")
-            if "task_state" in parsed:   pretty.append(f"task={parsed['task_state']}")
-            if "battery" in parsed:
-                b = parsed["battery"]; pretty.append("battery=" + ",".join([f"{k}:{v}" for k,v in b.items()]))
-            if "localization" in parsed: pretty.append(f"loc={parsed['localization']}")
-            if "pose" in parsed:
-                p = parsed["pose"]; pretty.append("pose=" + ",".join([f"{k}:{v:.3f}" for k,v in p.items()]))
-            if pretty:
-                print(f"[AMR][{iso}] " + " | ".join(pretty) + f"  || raw: {line}")
-            else:
-                print(f"[AMR][{iso}] raw: {line} (unparsed)  raw_ts={raw_ts}")
+            if rec.state:                  pretty.append(f"state={rec.state}")
+            if rec.goal:                   pretty.append(f"goal={rec.goal}")
+            if rec.task_state:             pretty.append(f"task={rec.task_state}")
+            if rec.battery_pct is not None: pretty.append(f"battery={rec.battery_pct}%")
+            if rec.charging is not None:   pretty.append(f"charging={rec.charging}")
+            if rec.localization:           pretty.append(f"loc={rec.localization}")
+            if rec.x is not None or rec.y is not None:
+                pretty.append(f"pose=x:{rec.x},y:{rec.y},theta:{rec.theta}")
+            print(f"{tag}[{iso}] " + " | ".join(pretty) + f"  || raw: {line}")
 
     cli.on_connect = _on_connect
     cli.on_message = _on_message
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ขับ OrchestratorFleet ด้วยลำดับ event สังเคราะห์ (ไม่มี broker / AMR / ดิสก์) เพื่อวัดความเร็ว FSM
+
+    python fsm_harness.py -n 2000 --amrs 2 --returns 0.5
+    python fsm_harness.py -n 500 --profile               # cProfile (cumulative)
+    python fsm_harness.py --journal /tmp/fsm_journal.jsonl   # รวมเวลาเขียน journal
+
+ต่องาน: job/latest -> (Request) match complete | (Return) photo บัง -> โล่ง -> arrived x2 -> DONE -> IDLE
+- scheduler แบบ inline (timer ที่ถึงเวลาแล้วรันใน loop เดียวกัน) ; photo_clear = 0 s ; FSM_SETTLE_SECS = --settle
+- MQTT client ปลอม (เก็บ fsm/state ไว้คำนวณ dwell / phases) ; state backend ว่าง (SnapshotWriter ไม่แตะดิสก์)
+- รายงาน: jobs/s, เวลาต่อ transition แยก event (fleet.m_fire), dwell ต่อ state, phases ต่องาน
+"""
+
+import os, sys, json, time, heapq, random, argparse, itertools, contextlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import run_all
+from run_all import OrchestratorFleet, TOPIC_FSM_STATE
+from fleet import AmrEndpoint
+from fsm_journal import FsmJournal
+from scheduler import Timer
+from snapshot_writer import SnapshotWriter
+from state_store import StateBackend
+
+PHOTO_NAMES = ("barcode1", "barcode2", "rfidA", "rfidB")
+
+class _InlineScheduler:
+    """API เดียวกับ Scheduler แต่ไม่มี thread: run_due() รัน timer ที่ถึงเวลาแล้ว"""
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Timer]] = []
+        self._seq = itertools.count()
+        self.fired = 0
+
+    def call_at(self, when: float, fn: Callable[[], None], name: str = "") -> Timer:
+        t = Timer(when, fn, name)
+        heapq.heappush(self._heap, (when, next(self._seq), t))
+        return t
+
+    def call_later(self, delay: float, fn: Callable[[], None], name: str = "") -> Timer:
+        return self.call_at(time.monotonic() + max(0.0, delay), fn, name)
+
+    def call_every(self, interval: float, fn: Callable[[], None], name: str = "") -> Timer:
+        def _tick():
+            fn()
+            self.call_later(interval, _tick, name)
+        return self.call_later(interval, _tick, name)
+
+    def pending(self) -> int:
+        return sum(1 for _, _, t in self._heap if not t.cancelled)
+
+    def next_due(self) -> Optional[float]:
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def run_due(self) -> int:
+        n = 0
+        while True:
+            when = self.next_due()
+            if when is None or when > time.monotonic():
+                return n
+            t = heapq.heappop(self._heap)[2]
+            t.cancelled = True
+            t.fn()
+            self.fired += 1
+            n += 1
+
+class _FakeClient:
+    def __init__(self):
+        self.published = 0
+        self.states: List[str] = []     # payload ของ fsm/state (parse ทีหลัง)
+
+    def publish(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False):
+        self.published += 1
+        if topic == TOPIC_FSM_STATE:
+            self.states.append(payload)
+
+class _NullBackend(StateBackend):
+    def commit_jobs(self, records): pass
+    def set_current_job(self, job): pass
+    def get_current_job(self): return {}
+    def clear_current_job(self): pass
+    def save_fsm_snapshot(self, text): pass
+    def load_fsm_snapshot(self): return {}
+    def clear_fsm_snapshot(self): pass
+    def query_jobs(self, goal_id=None, op=None, since_ts=None, until_ts=None): return iter(())
+    def record_match(self, result): pass
+    def latest_match(self): return {}
+
+def make_jobs(n: int, returns: float, seed: int = 1) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    ts = time.time()
+    return [{"op": "Return" if rng.random() < returns else "Request", "goal_id": f"DOT{i % 8 + 1}",
+             "cuh_ids": [f"C{i}", None], "kit_ids": [f"K{i}", None], "job_id": f"h{i}", "ts": ts}
+            for i in range(n)]
+
+def drive(fleet: OrchestratorFleet, sched: _InlineScheduler, jobs: List[Dict[str, Any]]) -> int:
+    """รันจนงานหมด ; คืนจำนวน event ที่ป้อนเข้า fleet"""
+    events = 0
+    with fleet.lock:
+        for job in jobs:
+            fleet.on_job_latest(job)
+            events += 1
+    target = len(jobs)
+    while sum(l.jobs_done for l in fleet.lanes) < target:
+        with fleet.lock:
+            lane = fleet.station_lane()
+            if lane is not None and lane.state == "WAIT_MATCH":
+                goal = lane.current["goal_id"]
+                fleet.on_match({"op": "Request", "complete": True, "required": 2, "matched": 2,
+                                "latest_job_ids": {"op": "Request", "goal_id": goal}})
+                events += 1
+            elif lane is not None and lane.state == "WAIT_PHOTO_CLEAR" and lane.photo_clear_since is None:
+                for state in (0, 1):        # รถเข็นออกจากสถานี: บัง -> โล่ง
+                    for name in PHOTO_NAMES:
+                        fleet.on_sensor({"sensor": "photo", "value": {"name": name, "state": state}})
+                        events += 1
+            for l in fleet.lanes:
+                if l.state in ("EN_ROUTE", "AT_DEST"):
+                    fleet.on_amr_topic(l.amr_id, "status", {"line": f"Arrived at {l.current['goal_id']}"})
+                    events += 1
+        if sched.run_due() == 0 and fleet.station_lane() is None and not any(l.current for l in fleet.lanes):
+            when = sched.next_due()
+            if when is None:
+                break           # ไม่มีอะไรค้าง (งานถูก ignore)
+            time.sleep(max(0.0, min(0.01, when - time.monotonic())))
+    return events
+
+def _pct(vals: List[float], p: float) -> float:
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(p * len(vals)))] if vals else 0.0
+
+def report(fleet: OrchestratorFleet, cli: _FakeClient, n_jobs: int, events: int, secs: float):
+    done = sum(l.jobs_done for l in fleet.lanes)
+    print(f"jobs={done}/{n_jobs}  amrs={len(fleet.lanes)}  events={events}  publishes={cli.published}")
+    print(f"wall    : {secs*1000:.1f} ms  ({done/secs if secs else 0:.0f} jobs/s, {secs*1e6/max(1, events):.1f} us/event)")
+
+    print("transitions (fleet.m_fire):")
+    for (event,), (n, total) in sorted(fleet.m_fire.totals().items(), key=lambda kv: -kv[1][1]):
+        print(f"  {event:<16} n={n:<7} mean={total*1e6/max(1, n):7.1f} us  total={total*1000:8.1f} ms")
+
+    dwell: Dict[str, List[float]] = {}
+    phases: Dict[str, List[float]] = {}
+    for raw in cli.states:
+        evt = json.loads(raw)
+        if evt["prev"] != evt["state"]:
+            dwell.setdefault(evt["prev"], []).append(evt["dwell_s"])
+        for k, v in (evt.get("phases") or {}).items():
+            phases.setdefault(k, []).append(v)
+    for title, table in (("state dwell", dwell), ("job phases", phases)):
+        print(f"{title} (ms):")
+        for k, vals in sorted(table.items(), key=lambda kv: -sum(kv[1])):
+            print(f"  {k:<16} n={len(vals):<7} mean={sum(vals)*1000/len(vals):8.3f}  p95={_pct(vals, 0.95)*1000:8.3f}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Orchestrator FSM event-sequence harness")
+    ap.add_argument("-n", "--jobs", type=int, default=1000, help="จำนวนงาน")
+    ap.add_argument("--amrs", type=int, default=1, help="จำนวนหุ่นใน fleet (1 = หุ่นเดี่ยว topic เดิม)")
+    ap.add_argument("--returns", type=float, default=0.5, help="สัดส่วนงาน Return")
+    ap.add_argument("--settle", type=float, default=0.0, help="FSM_SETTLE_SECS ระหว่าง harness")
+    ap.add_argument("--policy", default="fifo")
+    ap.add_argument("--journal", help="เขียน FsmJournal ที่ path นี้ (เริ่มใหม่ทุกครั้ง)")
+    ap.add_argument("--profile", action="store_true", help="cProfile ตอน drive (top 25 cumulative)")
+    ap.add_argument("-v", "--verbose", action="store_true", help="แสดง log ของ FSM")
+    args = ap.parse_args()
+
+    run_all.FSM_SETTLE_SECS = args.settle
+    if args.amrs <= 1:
+        endpoints = [AmrEndpoint("", "127.0.0.1", 7171)]
+    else:
+        endpoints = [AmrEndpoint(f"amr{i + 1}", "127.0.0.1", 7171) for i in range(args.amrs)]
+    journal = None
+    if args.journal:
+        journal = FsmJournal(args.journal)
+        journal.reset()
+
+    cli, sched, backend = _FakeClient(), _InlineScheduler(), _NullBackend()
+    snap = SnapshotWriter(backend).start()
+    jobs = make_jobs(args.jobs, args.returns)
+
+    out = sys.stdout if args.verbose else open(os.devnull, "w")
+    prof = None
+    if args.profile:
+        import cProfile
+        prof = cProfile.Profile()
+    with contextlib.redirect_stdout(out):
+        fleet = OrchestratorFleet(cli, endpoints, snap=snap, journal=journal, sched=sched,
+                                  policy=args.policy, backend=backend)
+        for lane in fleet.lanes:
+            lane.photo_clear_secs_required = 0.0
+        t0 = time.perf_counter()
+        if prof is not None:
+            prof.enable()
+        events = drive(fleet, sched, jobs)
+        if prof is not None:
+            prof.disable()
+        secs = time.perf_counter() - t0
+    snap.close()
+    if journal is not None:
+        fleet.flush_journal()
+        journal.close()
+
+    report(fleet, cli, len(jobs), events, secs)
+    if journal is not None:
+        print(f"journal : {journal.stats()}")
+    if prof is not None:
+        import pstats
+        pstats.Stats(prof).sort_stats("cumulative").print_stats(25)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Journal ของ OrchestratorFSM (event-sourced) สำหรับกู้ queue/current/state หลัง run_all restart
+
+    data/fsm_journal.jsonl   1 บรรทัด/record (compact JSON)
+
+record:
+    {"k":"snap", ...state ทั้งหมด...}        snapshot (บรรทัดแรกหลัง compact)
+    {"k":"enq",  "job":{...}, "key":"..."}   งานเข้า queue (+ key กันซ้ำ)
+    {"k":"take", "qid":3}                    งาน qid ออกจาก queue -> current ของหุ่น
+    {"k":"state","s":"EN_ROUTE"}             state transition
+    {"k":"requeue","attempts":1,"parked":false}  current กลับเข้า queue / parked (dispatch error / watchdog)
+    {"k":"unpark","qid":3}                   parked -> queue (qid null = ทั้งหมด)
+    {"k":"done", "fp":"...", "ts":...}       current เสร็จ
+    {"k":"match","m":{...}}                  match_info ล่าสุด
+record ของหุ่นใน fleet มี "amr":"<id>" (ไม่มี = หุ่นเดี่ยว id "")
+
+- append ต่อท้าย + flush (fsync เมื่อ FSM_JOURNAL_FSYNC=1)
+- encode() แยกจากการเขียน: FSM แปลงเป็นบรรทัดบน callback thread แล้วให้ thread อื่นเรียก append_line() /
+  write_snapshot() (ไม่แตะดิสก์ใน MQTT callback)
+- ครบ FSM_JOURNAL_COMPACT records -> เขียน snapshot ไฟล์ใหม่ (tmp + os.replace) แล้ว append ต่อ
+- recover(): snapshot ล่าสุด + replay ส่วนท้าย -> dict state (ไม่ publish / ไม่มี side effect)
+  บรรทัดท้ายที่เสีย (crash กลางการเขียน) ถูกข้าม
+"""
+
+import os, json, time, threading
+from typing import Any, Dict, Optional
+
+from state_store import DATA_DIR
+
+FSM_JOURNAL_PATH    = os.getenv("FSM_JOURNAL", os.path.join(DATA_DIR, "fsm_journal.jsonl"))
+FSM_JOURNAL_COMPACT = int(os.getenv("FSM_JOURNAL_COMPACT", "500"))
+FSM_JOURNAL_FSYNC   = os.getenv("FSM_JOURNAL_FSYNC", "0") == "1"
+FSM_SEEN_MAX        = int(os.getenv("FSM_SEEN_MAX", "1000"))       # key กันซ้ำของงานที่จำไว้ (จำนวน)
+FSM_SEEN_SECS       = float(os.getenv("FSM_SEEN_SECS", "21600"))   # ... และอายุ (วินาที)
+
+def empty_state() -> Dict[str, Any]:
+    return {"queue": [], "parked": [], "lanes": {}, "seen": [], "last_done_fp": None, "last_done_ts": 0.0}
+
+def _lane(st: Dict[str, Any], amr_id: str) -> Dict[str, Any]:
+    lane = st["lanes"].get(amr_id)
+    if lane is None:
+        lane = st["lanes"][amr_id] = {"current": None, "state": "IDLE", "match": None}
+    return lane
+
+def apply(st: Dict[str, Any], rec: Dict[str, Any]):
+    """ใช้ 1 record กับ state dict (ลำดับเดียวกับที่ FSM ทำตอน runtime)"""
+    k = rec.get("k")
+    if k == "snap":
+        st.clear()
+        st.update(empty_state())
+        st.update({x: rec[x] for x in st if x in rec})
+        if "lanes" not in rec and ("current" in rec or "state" in rec):
+            # snapshot แบบหุ่นเดี่ยว (ก่อนมี fleet)
+            st["lanes"] = {"": {"current": rec.get("current"), "state": rec.get("state") or "IDLE",
+                                "match": rec.get("match")}}
+        return
+    lane = _lane(st, rec.get("amr", "")) if k in ("take", "state", "requeue", "done", "match") else None
+    if k == "enq":
+        st["queue"].append(rec["job"])
+        if rec.get("key"):
+            st["seen"].append(rec["key"])
+            if len(st["seen"]) > FSM_SEEN_MAX:
+                del st["seen"][:-FSM_SEEN_MAX]
+    elif k == "take":
+        q, qid = st["queue"], rec.get("qid")
+        i = next((i for i, j in enumerate(q) if j.get("qid") == qid), 0) if qid is not None else 0
+        if q:
+            lane["current"] = q.pop(i)
+    elif k == "state":
+        lane["state"] = rec.get("s") or "IDLE"
+    elif k == "requeue":
+        job = lane["current"]
+        if job is not None:
+            if "attempts" in rec:
+                job["attempts"] = rec["attempts"]
+            st["parked" if rec.get("parked") else "queue"].append(job)
+        lane["current"] = None
+    elif k == "unpark":
+        qid = rec.get("qid")
+        back = [j for j in st["parked"] if qid is None or j.get("qid") == qid]
+        st["parked"] = [j for j in st["parked"] if not (qid is None or j.get("qid") == qid)]
+        for job in back:
+            job["attempts"] = 0
+        st["queue"].extend(back)
+    elif k == "done":
+        lane["current"] = None
+        st["last_done_fp"] = rec.get("fp")
+        st["last_done_ts"] = rec.get("ts") or 0.0
+    elif k == "match":
+        lane["match"] = rec.get("m")
+
+class FsmJournal:
+    def __init__(self, path: str = FSM_JOURNAL_PATH, compact_every: int = FSM_JOURNAL_COMPACT,
+                 fsync: bool = FSM_JOURNAL_FSYNC):
+        self.path = path
+        self.compact_every = max(10, compact_every)
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._f = None
+        self._since_snap = 0
+        # stats
+        self.appends = 0
+        self.compactions = 0
+
+    # ---------- recovery ----------
+    def recover(self) -> Optional[Dict[str, Any]]:
+        """อ่าน journal -> state dict ; ไม่มีไฟล์/ว่าง -> None"""
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        t0 = time.perf_counter()
+        st, n, bad = empty_state(), 0, 0
+        with f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    bad += 1
+                    continue
+                apply(st, rec)
+                n += 1
+        if n == 0:
+            return None
+        self._since_snap = n
+        lanes = {k or "-": (v["state"], (v["current"] or {}).get("job_id")) for k, v in st["lanes"].items()}
+        print(f"[FSM-J] recovered lanes={lanes} queue={len(st['queue'])} parked={len(st['parked'])} "
+              f"from {n} records ({bad} bad) in {(time.perf_counter()-t0)*1000:.1f} ms")
+        return st
+
+    # ---------- write ----------
+    def _open(self):
+        if self._f is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._f = open(self.path, "a", encoding="utf-8")
+        return self._f
+
+    @staticmethod
+    def encode(kind: str, **fields) -> str:
+        """record -> บรรทัด JSON (ทำตอนเกิด event: dict ของงานถูกแก้ต่อได้หลังจากนี้)"""
+        return json.dumps({"k": kind, **fields}, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+    def append(self, kind: str, **fields):
+        self.append_line(self.encode(kind, **fields))
+
+    def append_line(self, line: str):
+        with self._lock:
+            f = self._open()
+            f.write(line)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            self.appends += 1
+            self._since_snap += 1
+
+    def due(self) -> bool:
+        return self._since_snap >= self.compact_every
+
+    def snapshot(self, st: Dict[str, Any]):
+        self.write_snapshot(self.encode("snap", **st))
+
+    def write_snapshot(self, line: str):
+        """เขียนไฟล์ใหม่ที่มีแค่ snapshot (ตัด record เก่าทิ้ง)"""
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(line); f.flush(); os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self._since_snap = 1
+            self.compactions += 1
+
+    def reset(self):
+        """เริ่มใหม่ (ไม่กู้ state)"""
+        self.snapshot(empty_state())
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"appends": self.appends, "compactions": self.compactions, "since_snap": self._since_snap}
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Goals map registry (ใช้ร่วมกันระหว่าง main_server/fn_server และ communicate_AMR)
+
+- parse + normalize goals_map.json ครั้งเดียว แล้ว cache ไว้
+- reload เมื่อ (inode, mtime, size) ของไฟล์เปลี่ยน (stat ไม่เกิน 1 ครั้ง / GOALS_CHECK_SECS)
+  หรือเมื่อสั่ง reload() / ได้รับ SIGHUP
+- รองรับ value ทั้งแบบ string และ dict (goal / destination_goal / arcl_goal / name)
+"""
+
+import os, json, time, signal, threading
+from typing import Any, Dict, Optional, Tuple
+
+GOALS_MAP_PATH   = os.getenv("GOALS_MAP_PATH", os.path.expanduser("~/cart_ws/intregration/data/goals_map.json"))
+GOALS_CHECK_SECS = float(os.getenv("GOALS_CHECK_SECS", "1.0"))
+
+def normalize_entry(entry: Any) -> Optional[str]:
+    """value ใน goals_map -> ชื่อ goal ของ ARCL (หรือ None)"""
+    if isinstance(entry, str):
+        return entry.strip() or None
+    if isinstance(entry, dict):
+        v = entry.get("goal") or entry.get("destination_goal") or entry.get("arcl_goal") or entry.get("name")
+        return str(v).strip() if v else None
+    return None
+
+class GoalsRegistry:
+    def __init__(self, path: str = GOALS_MAP_PATH, check_secs: float = GOALS_CHECK_SECS):
+        self.path = path
+        self.check_secs = check_secs
+        self._lock = threading.Lock()
+        self._goals: Dict[str, str] = {}             # DOT... -> goal name
+        self._entries: Dict[str, Dict[str, Any]] = {} # DOT... -> entry เดิม (dict) สำหรับ field เสริม
+        self._stat_key: Optional[Tuple[int, int, int]] = None
+        self._next_check = 0.0
+        self._force = True
+        self.loads = 0
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _load(self, key):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            raw = {}
+        except Exception as e:
+            # ไฟล์เสีย/เขียนค้างครึ่ง -> ใช้ map เดิมต่อ แล้วลองใหม่รอบหน้า
+            print(f"[GOALS] load {self.path} failed: {e} (keep previous map)")
+            return
+        goals, entries = {}, {}
+        for k, v in (raw.items() if isinstance(raw, dict) else []):
+            dot = str(k).strip().upper()
+            name = normalize_entry(v)
+            if name:
+                goals[dot] = name
+                entries[dot] = v if isinstance(v, dict) else {"goal": name}
+        self._goals, self._entries = goals, entries
+        self._stat_key = key
+        self.loads += 1
+        print(f"[GOALS] loaded {len(goals)} goals from {self.path}")
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if not self._force and now < self._next_check:
+            return
+        with self._lock:
+            if not self._force and now < self._next_check:
+                return
+            self._next_check = now + self.check_secs
+            key = self._stat()
+            if self._force or key != self._stat_key:
+                self._force = False
+                self._load(key)
+
+    def reload(self):
+        """บังคับ reload ในการเรียกครั้งถัดไป"""
+        self._force = True
+
+    def resolve(self, dot_id: Optional[str]) -> Optional[str]:
+        if not dot_id:
+            return None
+        self._maybe_reload()
+        return self._goals.get(str(dot_id).strip().upper())
+
+    def entry(self, dot_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not dot_id:
+            return None
+        self._maybe_reload()
+        return self._entries.get(str(dot_id).strip().upper())
+
+    def snapshot(self) -> Dict[str, str]:
+        """map ปัจจุบัน (อ่านอย่างเดียว ห้ามแก้)"""
+        self._maybe_reload()
+        return self._goals
+
+_registry: Optional[GoalsRegistry] = None
+
+def get_registry() -> GoalsRegistry:
+    global _registry
+    if _registry is None:
+        _registry = GoalsRegistry()
+    return _registry
+
+def install_reload_signal(sig=signal.SIGHUP):
+    """kill -HUP <pid> -> reload goals_map (เรียกจาก main thread เท่านั้น)"""
+    def _on_sig(*_):
+        print("[GOALS] reload signal received")
+        get_registry().reload()
+    signal.signal(sig, _on_sig)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Job journal แบบแบ่ง segment รายวัน (แทน job_ids.jsonl ที่โตไม่สิ้นสุด)
+
+    data/journal/jobs-YYYY-MM-DD.jsonl      segment ของวันที่ยังเปิดอยู่
+    data/journal/jobs-YYYY-MM-DD.jsonl.gz   segment ที่ปิดแล้ว (บีบอัด)
+    data/journal/jobs-YYYY-MM-DD.idx        index: goal_id \\t op \\t offset \\t length \\t ts
+
+- append เป็น O(1): เปิดไฟล์ค้างไว้ เขียนต่อท้าย + index 1 บรรทัด/งาน
+- query ตาม goal/op/ช่วงวัน อ่าน index ก่อน -> เปิด segment เฉพาะวันที่มีงานตรงเงื่อนไข
+  แล้ว seek ตาม offset (segment .gz จะถูก decompress ทั้งไฟล์ครั้งเดียว)
+
+CLI:
+    python job_journal.py query --goal DOT400002 --since 2025-11-12 [--until 2025-11-19] [--op Request]
+    python job_journal.py import data/job_ids.jsonl
+    python job_journal.py stats
+"""
+
+import os, re, json, gzip, time, shutil, argparse, threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", os.path.expanduser("~/cart_ws/intregration/data/journal"))
+
+_SEG_RE = re.compile(r"^jobs-(\d{4}-\d{2}-\d{2})\.(jsonl|jsonl\.gz|idx)$")
+
+def _record_date(rec: Dict[str, Any]) -> str:
+    d = rec.get("date")
+    if isinstance(d, str) and len(d) == 10:
+        return d
+    ts = rec.get("ts")
+    if not isinstance(ts, (int, float)):
+        ts = time.time()
+    return time.strftime("%Y-%m-%d", time.localtime(ts))
+
+def _tsv(x: Any) -> str:
+    return "" if x is None else str(x).replace("\t", " ").replace("\n", " ")
+
+class JobJournal:
+    def __init__(self, root: str = JOURNAL_DIR, writer: bool = False):
+        """writer=True เฉพาะ process ที่เขียน journal (บีบอัด segment ค้างของวันก่อนตอนเริ่ม)"""
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._date: Optional[str] = None
+        self._seg_f = None
+        self._idx_f = None
+        self._pos = 0
+        self.appended = 0
+        self._bg_compress = True
+        if writer:
+            self._compress_stale()
+
+    # ---------- paths ----------
+    def _path(self, date: str, ext: str) -> str:
+        return os.path.join(self.root, f"jobs-{date}.{ext}")
+
+    def dates(self) -> List[str]:
+        out = set()
+        for name in os.listdir(self.root):
+            m = _SEG_RE.match(name)
+            if m and m.group(2) != "idx":
+                out.add(m.group(1))
+        return sorted(out)
+
+    # ---------- write ----------
+    def _open(self, date: str):
+        self._close_current(compress=(self._date is not None and self._date != date))
+        seg = self._path(date, "jsonl")
+        gz = seg + ".gz"
+        if os.path.exists(gz) and not os.path.exists(seg):
+            # เขียนย้อนหลังลง segment ที่ปิดไปแล้ว (เช่นตอน import) -> เปิดกลับมาก่อน
+            with gzip.open(gz, "rb") as src, open(seg, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(gz)
+        self._seg_f = open(seg, "ab")
+        self._idx_f = open(self._path(date, "idx"), "a", encoding="utf-8")
+        self._pos = self._seg_f.tell()
+        self._date = date
+
+    def _close_current(self, compress: bool):
+        if self._seg_f is None:
+            return
+        old = self._date
+        for f in (self._seg_f, self._idx_f):
+            try: f.close()
+            except Exception: pass
+        self._seg_f = self._idx_f = None
+        self._date = None
+        if compress and old and not self._bg_compress:
+            self._compress(old)
+        elif compress and old:
+            threading.Thread(target=self._compress, args=(old,), name="JournalGzip", daemon=True).start()
+
+    def _compress(self, date: str):
+        seg = self._path(date, "jsonl")
+        gz = seg + ".gz"
+        try:
+            with open(seg, "rb") as src, gzip.open(gz + ".tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(gz + ".tmp", gz)
+            os.remove(seg)
+            print(f"[JOURNAL] compressed {os.path.basename(seg)}")
+        except Exception as e:
+            print(f"[JOURNAL] compress {seg} failed: {e}")
+
+    def _compress_stale(self):
+        """segment ของวันก่อนที่ยังไม่ถูกบีบอัด (เช่น process ตายก่อน rotate)"""
+        today = time.strftime("%Y-%m-%d")
+        for date in self.dates():
+            if date < today and os.path.exists(self._path(date, "jsonl")):
+                self._compress(date)
+
+    def append_many(self, records: List[Dict[str, Any]]):
+        with self._lock:
+            for rec in records:
+                date = _record_date(rec)
+                if date != self._date:
+                    self._open(date)
+                line = (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+                self._seg_f.write(line)
+                self._idx_f.write(f"{_tsv(rec.get('goal_id'))}\t{_tsv(rec.get('op'))}\t{self._pos}\t{len(line)}\t{_tsv(rec.get('ts'))}\n")
+                self._pos += len(line)
+                self.appended += 1
+
+    def append(self, rec: Dict[str, Any]):
+        self.append_many([rec])
+
+    def sync(self):
+        """flush + fsync segment และ index (เรียกครั้งเดียวต่อ batch)"""
+        with self._lock:
+            for f in (self._seg_f, self._idx_f):
+                if f is not None:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def close(self):
+        with self._lock:
+            self._close_current(compress=False)
+
+    # ---------- read ----------
+    def _read_index(self, date: str) -> List[Tuple[str, str, int, int, Optional[float]]]:
+        out = []
+        try:
+            with open(self._path(date, "idx"), "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) < 4:
+                        continue
+                    ts = float(parts[4]) if len(parts) > 4 and parts[4] else None
+                    out.append((parts[0], parts[1], int(parts[2]), int(parts[3]), ts))
+        except FileNotFoundError:
+            pass
+        return out
+
+    def _segment_bytes(self, date: str) -> Optional[bytes]:
+        seg = self._path(date, "jsonl")
+        try:
+            with open(seg, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        try:
+            with gzip.open(seg + ".gz", "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def query(self, goal_id: Optional[str] = None, op: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None,
+              since_ts: Optional[float] = None, until_ts: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """since/until = 'YYYY-MM-DD' (รวมวันนั้น), since_ts/until_ts = epoch สำหรับกรองละเอียด"""
+        goal_id = goal_id.strip().upper() if goal_id else None
+        if self._seg_f is not None:
+            self.sync()
+        for date in self.dates():
+            if (since and date < since) or (until and date > until):
+                continue
+            hits = [(off, ln) for g, o, off, ln, ts in self._read_index(date)
+                    if (goal_id is None or g.upper() == goal_id)
+                    and (op is None or o == op)
+                    and (since_ts is None or ts is None or ts >= since_ts)
+                    and (until_ts is None or ts is None or ts <= until_ts)]
+            if not hits:
+                continue
+            data = self._segment_bytes(date)
+            if data is None:
+                continue
+            for off, ln in hits:
+                try:
+                    yield json.loads(data[off:off + ln].decode("utf-8"))
+                except Exception:
+                    continue
+
+    def stats(self) -> Dict[str, Any]:
+        out = {}
+        for date in self.dates():
+            idx = self._read_index(date)
+            gz = os.path.exists(self._path(date, "jsonl") + ".gz")
+            out[date] = {"jobs": len(idx), "compressed": gz}
+        return out
+
+    # ---------- import ----------
+    def import_jsonl(self, path: str) -> int:
+        """
+        นำเข้า job_ids.jsonl รูปแบบเดิม (1 บรรทัด = 1 งาน)
+        - จัดกลุ่มตามวันก่อนเขียน -> แต่ละ segment ถูกเปิด/บีบอัดครั้งเดียว แม้ไฟล์เดิมเรียงวันสลับไปมา
+        - ไม่เขียน segment ของวันนี้ (main_server เปิด append อยู่ -> บรรทัดจาก 2 process ปนกัน, offset ใน idx เพี้ยน)
+          งานของวันนี้ (หรือไม่มี date/ts) ถูกข้าม ; import ใหม่หลังเที่ยงคืนได้
+        """
+        today = time.strftime("%Y-%m-%d")
+        by_date: Dict[str, List[Dict[str, Any]]] = {}
+        skipped = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    continue
+                date = _record_date(rec)
+                if date >= today:
+                    skipped += 1
+                    continue
+                by_date.setdefault(date, []).append(rec)
+        n = 0
+        self._bg_compress = False   # ปิด segment ย้อนหลังแล้วบีบอัดทันที (ไม่ทิ้ง thread gzip ค้าง)
+        try:
+            for date in sorted(by_date):
+                self.append_many(by_date[date])
+                n += len(by_date[date])
+            with self._lock:
+                self._close_current(compress=True)
+        finally:
+            self._bg_compress = True
+        if skipped:
+            print(f"[JOURNAL] import skipped {skipped} jobs dated {today} or later (live segment)")
+        return n
+
+_journal: Optional[JobJournal] = None
+
+def get_journal() -> JobJournal:
+    global _journal
+    if _journal is None:
+        _journal = JobJournal(writer=True)
+    return _journal
+
+# ---------- CLI ----------
+def main():
+    ap = argparse.ArgumentParser(description="SmartCart job journal")
+    ap.add_argument("--dir", default=JOURNAL_DIR)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    q = sub.add_parser("query", help="ค้นหางานตาม goal/op/ช่วงวัน")
+    q.add_argument("--goal", default=None)
+    q.add_argument("--op", default=None, choices=("Request", "Return"))
+    q.add_argument("--since", default=None, help="YYYY-MM-DD")
+    q.add_argument("--until", default=None, help="YYYY-MM-DD")
+    q.add_argument("--count", action="store_true", help="แสดงเฉพาะจำนวน")
+    im = sub.add_parser("import", help="นำเข้า job_ids.jsonl เดิม")
+    im.add_argument("path")
+    sub.add_parser("stats", help="จำนวนงานต่อ segment")
+    args = ap.parse_args()
+
+    j = JobJournal(args.dir)
+    if args.cmd == "query":
+        n = 0
+        for rec in j.query(goal_id=args.goal, op=args.op, since=args.since, until=args.until):
+            n += 1
+            if not args.count:
+                print(json.dumps(rec, ensure_ascii=False))
+        if args.count:
+            print(n)
+    elif args.cmd == "import":
+        n = j.import_jsonl(args.path)
+        j.close()
+        print(f"[JOURNAL] imported {n} jobs from {args.path}")
+    elif args.cmd == "stats":
+        for date, st in j.stats().items():
+            print(f"{date}  jobs={st['jobs']}  {'gz' if st['compressed'] else 'open'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Priority job queue ของ OrchestratorFleet (แทน deque FIFO)
+
+    q = JobQueue()
+    q.push(job)              # เติม priority / enq_ts / attempts / qid ลงใน job dict
+    job = q.pop()            # งานที่ effective priority สูงสุด
+    q.requeue(job)           # dispatch error / watchdog -> attempts+1 ; ครบ JOBQ_MAX_ATTEMPTS -> parked
+
+effective priority = priority + (เวลารอ / JOBQ_AGE_SECS) - attempts * (JOBQ_RETRY_PENALTY / JOBQ_AGE_SECS)
+  -> เรียงด้วย key คงที่  enq_ts - priority*AGE + attempts*PENALTY  (น้อย = ก่อน) ใช้ heap ได้ตรง ๆ
+- Request (JOBQ_PRIO_REQUEST) มาก่อน Return (JOBQ_PRIO_RETURN) แต่ Return ที่รอนานจะค่อย ๆ ขึ้นมาเอง
+- payload ที่มี "priority" (int) ใช้ค่านั้นแทนค่าตาม op
+- ข้อมูลคิวอยู่ใน job dict เอง (journal / snapshot เก็บ job ทั้งก้อน -> กู้ลำดับเดิมได้)
+- ไม่ thread-safe (ใช้ใต้ lock ของ fleet)
+"""
+
+import os, time, heapq
+from typing import Any, Dict, List, Optional, Tuple
+
+JOBQ_PRIO_REQUEST  = int(os.getenv("JOBQ_PRIO_REQUEST", "10"))
+JOBQ_PRIO_RETURN   = int(os.getenv("JOBQ_PRIO_RETURN", "0"))
+JOBQ_AGE_SECS      = float(os.getenv("JOBQ_AGE_SECS", "30"))       # รอครบเท่านี้ = priority +1
+JOBQ_RETRY_PENALTY = float(os.getenv("JOBQ_RETRY_PENALTY", "60"))  # วินาที / attempt ที่ถูกดันไปท้าย
+JOBQ_MAX_ATTEMPTS  = int(os.getenv("JOBQ_MAX_ATTEMPTS", "3"))      # requeue ครบ -> parked
+
+class JobQueue:
+    def __init__(self, age_secs: float = JOBQ_AGE_SECS, retry_penalty: float = JOBQ_RETRY_PENALTY,
+                 max_attempts: int = JOBQ_MAX_ATTEMPTS):
+        self.age_secs = max(0.001, age_secs)
+        self.retry_penalty = retry_penalty
+        self.max_attempts = max(1, max_attempts)
+        self._heap: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._by_age: List[Tuple[float, int]] = []     # (enq_ts, qid) สำหรับ oldest_wait (ลบแบบ lazy)
+        self._live: set = set()                         # qid ที่อยู่ใน _heap
+        self._next_qid = 1
+        self.parked: List[Dict[str, Any]] = []
+        # stats
+        self.pushed = 0
+        self.taken = 0
+        self.requeued = 0
+        self.parked_total = 0
+
+    def _key(self, job: Dict[str, Any]) -> float:
+        return job["enq_ts"] - job["priority"] * self.age_secs + job["attempts"] * self.retry_penalty
+
+    def _heappush(self, job: Dict[str, Any]):
+        heapq.heappush(self._heap, (self._key(job), job["qid"], job))
+        heapq.heappush(self._by_age, (job["enq_ts"], job["qid"]))
+        self._live.add(job["qid"])
+
+    def _adopt(self, job: Dict[str, Any], now: Optional[float] = None):
+        """เติม field ของคิวที่ยังไม่มี (งานใหม่ หรือ journal เก่าก่อนมี priority)"""
+        if not isinstance(job.get("priority"), int):
+            job["priority"] = JOBQ_PRIO_REQUEST if job.get("op") == "Request" else JOBQ_PRIO_RETURN
+        if not isinstance(job.get("enq_ts"), (int, float)):
+            job["enq_ts"] = time.time() if now is None else now
+        job.setdefault("attempts", 0)
+        if not isinstance(job.get("qid"), int):
+            job["qid"] = self._next_qid
+        self._next_qid = max(self._next_qid, job["qid"] + 1)
+
+    # ---------- API ----------
+    def push(self, job: Dict[str, Any], now: Optional[float] = None) -> Dict[str, Any]:
+        self._adopt(job, now)
+        self._heappush(job)
+        self.pushed += 1
+        return job
+
+    def restore(self, jobs: List[Dict[str, Any]], parked: Optional[List[Dict[str, Any]]] = None):
+        """งานจาก journal (มี field ของคิวอยู่แล้ว) ; ไม่นับเป็น push ใหม่"""
+        for job in jobs:
+            self._adopt(job)
+            self._heappush(job)
+        for job in parked or ():
+            self._adopt(job)
+            self.parked.append(job)
+
+    def peek(self) -> Optional[Dict[str, Any]]:
+        return self._heap[0][2] if self._heap else None
+
+    def pop(self) -> Dict[str, Any]:
+        job = heapq.heappop(self._heap)[2]
+        self._live.discard(job["qid"])
+        self.taken += 1
+        return job
+
+    def requeue(self, job: Dict[str, Any]) -> bool:
+        """คืนงานเข้าคิว (attempts+1) ; ครบ max_attempts -> parked และคืน False"""
+        job["attempts"] = int(job.get("attempts") or 0) + 1
+        if job["attempts"] >= self.max_attempts:
+            self.parked.append(job)
+            self.parked_total += 1
+            return False
+        self._heappush(job)
+        self.requeued += 1
+        return True
+
+    def unpark(self, qid: Optional[int] = None) -> List[Dict[str, Any]]:
+        """parked -> คิว (attempts = 0) ; qid=None = ทั้งหมด"""
+        back = [j for j in self.parked if qid is None or j.get("qid") == qid]
+        self.parked = [j for j in self.parked if not (qid is None or j.get("qid") == qid)]
+        for job in back:
+            job["attempts"] = 0
+            self._heappush(job)
+        return back
+
+    def items(self) -> List[Dict[str, Any]]:
+        """งานทั้งหมดตามลำดับที่จะถูกหยิบ"""
+        return [j for _, _, j in sorted(self._heap, key=lambda e: (e[0], e[1]))]
+
+    def oldest_wait(self, now: Optional[float] = None) -> float:
+        age = self._by_age
+        while age and age[0][1] not in self._live:
+            heapq.heappop(age)
+        if not age:
+            return 0.0
+        now = time.time() if now is None else now
+        return max(0.0, now - age[0][0])
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __bool__(self):
+        return bool(self._heap)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"depth": len(self._heap), "parked": len(self.parked), "oldest_wait_s": round(self.oldest_wait(), 1),
+                "pushed": self.pushed, "taken": self.taken, "requeued": self.requeued,
+                "parked_total": self.parked_total}
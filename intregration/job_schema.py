@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Job payload validator (ใช้ทั้งฝั่ง server: main_server และฝั่ง client: send_to_pi)
+
+รูปแบบที่รับ:
+    1) list[6]: [status|op, CUH1, CUH2, KIT1, KIT2, DOT]      <- fast path (รูปแบบหลัก)
+    2) list[5]: [CUH1, CUH2, KIT1, KIT2, DOT]                 (legacy, op = default_op)
+    3) object : {status|op, cuh_ids, kit_ids, dot|goal_id|goal}
+
+validate_job() ตรวจ + normalize ในรอบเดียว คืน (job, errors, warnings)
+- job    : {op, cuh_ids[2], kit_ids[2], goal_id, goal_name}   (คงตำแหน่ง, ช่องว่าง = None)
+- errors : [JobError(path, code, message)]  path บอกตำแหน่ง เช่น "[0]", "[5]", "cuh_ids", "dot"
+- ไม่ import paho / state (client ใช้ได้โดยไม่มี dependency ของ server)
+"""
+
+import re
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+DOT_RE = re.compile(r"^DOT\d{6,}$", re.I)
+
+# status/op (lower) -> op
+OP_MAP = {"approved": "Request", "returning": "Return", "request": "Request", "return": "Return"}
+
+class JobError(NamedTuple):
+    path: str
+    code: str
+    message: str
+
+    def __str__(self):
+        return f"{self.path}: {self.message}"
+
+    def as_dict(self) -> Dict[str, str]:
+        return {"path": self.path, "code": self.code, "message": self.message}
+
+GoalLookup = Optional[Callable[[str], Optional[str]]]
+
+def _canon(x: Any) -> Optional[str]:
+    """'None'/None/'' -> None, อื่น ๆ -> str (strip)"""
+    if x is None:
+        return None
+    s = x.strip() if type(x) is str else str(x).strip()
+    if not s or (len(s) == 4 and s.lower() == "none"):
+        return None
+    return s
+
+def _op_of(x: Any) -> Optional[str]:
+    if type(x) is str:
+        return OP_MAP.get(x.strip().lower())
+    return OP_MAP.get(str(x).strip().lower()) if x is not None else None
+
+def _check_goal(dot_raw: Any, path: str, errors: List[JobError],
+                goals_map: Optional[Dict[str, str]], resolve: GoalLookup) -> Tuple[Optional[str], Optional[str]]:
+    dot = _canon(dot_raw)
+    if dot is None:
+        errors.append(JobError(path, "missing_dot", "missing DOT"))
+        return None, None
+    s = dot.upper()
+    if not DOT_RE.match(s):
+        errors.append(JobError(path, "invalid_dot", f"invalid DOT format '{dot_raw}'"))
+        return None, None
+    if goals_map is not None:
+        name = goals_map.get(s)
+    elif resolve is not None:
+        name = resolve(s)
+    else:
+        return s, None          # ตรวจเฉพาะรูปแบบ (ฝั่ง client ไม่มี goals map)
+    if not name:
+        errors.append(JobError(path, "unknown_dot", f"unknown DOT '{s}' (not found in goals_map.json)"))
+        return None, None
+    return s, name
+
+def _pair(v: Any, path: str, errors: List[JobError], warns: List[str]) -> List[Optional[str]]:
+    if v is None:
+        return [None, None]
+    if not isinstance(v, (list, tuple)):
+        errors.append(JobError(path, "not_list", f"expected list of up to 2 ids, got {type(v).__name__}"))
+        return [None, None]
+    if len(v) > 2:
+        warns.append(f"{path}: {len(v)} items, only first 2 used")
+    a = _canon(v[0]) if len(v) > 0 else None
+    b = _canon(v[1]) if len(v) > 1 else None
+    return [a, b]
+
+def validate_job(data: Any, goals_map: Optional[Dict[str, str]] = None, resolve: GoalLookup = None,
+                 default_op: str = "Request") -> Tuple[Optional[Dict[str, Any]], List[JobError], List[str]]:
+    """
+    goals_map: snapshot {DOT: goal_name} (validate หลายงานด้วย map เดียว)
+    resolve  : ฟังก์ชัน DOT -> goal_name (ใช้เมื่อไม่มี goals_map)
+    ไม่ระบุทั้งคู่ -> ตรวจเฉพาะรูปแบบ DOT, goal_name = None
+    """
+    errors: List[JobError] = []
+    warns: List[str] = []
+
+    if type(data) is list and len(data) == 6:
+        # ---- fast path ----
+        s_or_op, c1, c2, k1, k2, dot_raw = data
+        op = _op_of(s_or_op)
+        if op is None:
+            errors.append(JobError("[0]", "invalid_op",
+                                   f"invalid status/op '{s_or_op}' (expect: approved/returning or Request/Return)"))
+        cuh = [_canon(c1), _canon(c2)]
+        kit = [_canon(k1), _canon(k2)]
+        dot_path = "[5]"
+        present_path = "[1..4]"
+    elif isinstance(data, list) and len(data) == 5:
+        c1, c2, k1, k2, dot_raw = data
+        op = default_op
+        warns.append(f"legacy-5-items: default OP={default_op}")
+        cuh = [_canon(c1), _canon(c2)]
+        kit = [_canon(k1), _canon(k2)]
+        dot_path = "[4]"
+        present_path = "[0..3]"
+    elif isinstance(data, list):
+        return None, [JobError("$", "bad_length", f"unsupported list length {len(data)} (expect 5 or 6)")], warns
+    elif isinstance(data, dict):
+        raw_op = data.get("status")
+        op = _op_of(raw_op)
+        if op is None:
+            raw_op = data.get("op")
+            op = _op_of(raw_op)
+        if op is None:
+            errors.append(JobError("status", "invalid_op",
+                                   f"missing/invalid status or op '{raw_op}' (expect: approved/returning or Request/Return)"))
+        cuh = _pair(data.get("cuh_ids"), "cuh_ids", errors, warns)
+        kit = _pair(data.get("kit_ids"), "kit_ids", errors, warns)
+        dot_raw, dot_path = None, "dot"
+        for key in ("dot", "goal_id", "goal"):
+            if data.get(key):
+                dot_raw, dot_path = data[key], key
+                break
+        present_path = "cuh_ids|kit_ids"
+    else:
+        return None, [JobError("$", "bad_type", "payload must be list or object")], warns
+
+    if cuh[0] is None and cuh[1] is None and kit[0] is None and kit[1] is None:
+        errors.append(JobError(present_path, "no_ids", "at least one of CUH/KIT must be present"))
+
+    goal_id, goal_name = _check_goal(dot_raw, dot_path, errors, goals_map, resolve)
+
+    if errors:
+        return None, errors, warns
+    return {"op": op, "cuh_ids": cuh, "kit_ids": kit, "goal_id": goal_id, "goal_name": goal_name}, errors, warns
+
+def to_list(job: Dict[str, Any]) -> List[Optional[str]]:
+    """job ที่ validate แล้ว -> [op, CUH1, CUH2, KIT1, KIT2, DOT] (รูปแบบ fast path)"""
+    return [job["op"], job["cuh_ids"][0], job["cuh_ids"][1], job["kit_ids"][0], job["kit_ids"][1], job["goal_id"]]
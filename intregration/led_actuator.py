@@ -4,14 +4,18 @@
 import os, json, signal
 import paho.mqtt.client as mqtt
 
-# ใช้ gpiozero กับ lgpio backend
-os.environ.setdefault("GPIOZERO_PIN_FACTORY", "lgpio")
-from gpiozero import OutputDevice
+# lgpio group write + shadow register (fallback gpiozero อยู่ใน led_backend)
+from led_backend import LedBackend
+from supervisor import mark_ready
 
 BASE       = "smartcart"
 MQTT_HOST  = os.getenv("MQTT_HOST", "127.0.0.1")
 MQTT_PORT  = int(os.getenv("MQTT_PORT", "1883"))
-LED_CMD_TOPIC = f"{BASE}/led/cmd"
+LED_CMD_TOPIC = f"{BASE}/led/cmd"             # legacy: 1 target ต่อ message
+LED_DESIRED_TOPIC = f"{BASE}/led/desired"     # frame หลาย target (retained)
+LED_CART = os.getenv("LED_CART", "")          # multi-cart: ฟัง <desired>/<cart>
+RESULTS = ("ok", "nok", "skip")
+LED_NOK_BLINK = os.getenv("LED_NOK_BLINK", "0") == "1"   # nok -> ไฟแดงกระพริบ
 
 PIN_MAP = {
     "cuh1": (20, 21),
@@ -20,39 +24,72 @@ PIN_MAP = {
     "kit2": (13, 19),
 }
 
-_outputs: dict[int, OutputDevice] = {}
+_backend: LedBackend = None
 
 def gpio_setup():
+    global _backend
     pins = {p for pair in PIN_MAP.values() for p in pair}
-    for p in pins:
-        _outputs[p] = OutputDevice(p, active_high=True, initial_value=False)
+    _backend = LedBackend(pins)
+
+def _pair_levels(green_pin: int, red_pin: int, result: str, levels: dict, blink: set):
+    levels[int(green_pin)] = (result == "ok")
+    levels[int(red_pin)]   = (result == "nok")
+    if result == "nok" and LED_NOK_BLINK:
+        blink.add(int(red_pin))
 
 def set_pair(green_pin: int, red_pin: int, result: str):
-    gp = _outputs[int(green_pin)]
-    rp = _outputs[int(red_pin)]
-    if result == "ok":
-        gp.on();  rp.off()
-    elif result == "nok":
-        gp.off(); rp.on()
-    else:
-        gp.off(); rp.off()
+    levels, blink = {}, set()
+    _pair_levels(green_pin, red_pin, result, levels, blink)
+    return _backend.apply(levels, blink)
+
+def apply_frame(leds: dict):
+    """ตั้งค่าทุก target ใน frame ด้วย group write ครั้งเดียว (เขียนเฉพาะ pin ที่เปลี่ยน)"""
+    levels, blink = {}, set()
+    for target, result in leds.items():
+        pins = PIN_MAP.get(target)
+        if pins is None:
+            print(f"[LED] unknown target in frame: {target}")
+            continue
+        if result not in RESULTS:
+            print(f"[LED] invalid result in frame: {target}={result}")
+            continue
+        _pair_levels(pins[0], pins[1], result, levels, blink)
+    return _backend.apply(levels, blink)
 
 def cleanup():
-    for dev in _outputs.values():
-        try: dev.off(); dev.close()
-        except: pass
+    try:
+        if _backend is not None: _backend.close()
+    except: pass
 
 def on_connect(client, userdata, flags, rc):
-    print(f"[LED] connected rc={rc}; sub {LED_CMD_TOPIC}")
-    client.subscribe(LED_CMD_TOPIC, qos=1)
+    desired = f"{LED_DESIRED_TOPIC}/{LED_CART}" if LED_CART else LED_DESIRED_TOPIC
+    userdata["desired_topic"] = desired
+    print(f"[LED] connected rc={rc}; sub {LED_CMD_TOPIC}, {desired}")
+    client.subscribe([(LED_CMD_TOPIC, 1), (desired, 1)])
+    mark_ready(client)
+
+def _on_frame(data: dict):
+    leds = data.get("leds") or {}
+    if data.get("full", True):
+        # frame เต็ม: target ที่ไม่ระบุ = ดับ
+        leds = {**{t: "skip" for t in PIN_MAP}, **leds}
+    try:
+        changed = apply_frame(leds)
+        print(f"[LED] frame -> {leds} (changed pins={changed})")
+    except Exception as e:
+        print(f"[LED] apply_frame error: {e}")
 
 def on_message(client, userdata, msg):
     try:
-        data = json.loads(msg.payload.decode("utf-8"))
+        data = json.loads(msg.payload.decode("utf-8")) if msg.payload else {}
     except Exception as e:
         print(f"[LED] bad payload: {e}")
         return
 
+    if msg.topic == userdata.get("desired_topic"):
+        _on_frame(data)
+        return
+
     target = data.get("target")
     result = data.get("result")   # "ok" | "nok" | "skip"
     gpin   = data.get("green_gpio")
@@ -61,7 +98,7 @@ def on_message(client, userdata, msg):
     if target not in PIN_MAP:
         print(f"[LED] unknown target: {target} payload={data}")
         return
-    if result not in ("ok","nok","skip"):
+    if result not in RESULTS:
         print(f"[LED] invalid result: {result}")
         return
     if gpin is None or rpin is None:
@@ -75,7 +112,7 @@ def on_message(client, userdata, msg):
 
 def main():
     gpio_setup()
-    cli = mqtt.Client(client_id="led_actuator_gpiozero")
+    cli = mqtt.Client(client_id="led_actuator_gpiozero", userdata={})
     cli.on_connect = on_connect
     cli.on_message = on_message
     cli.connect(MQTT_HOST, MQTT_PORT, keepalive=30)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+LED backend: shadow register + diff + group write
+
+- เก็บสถานะทุก pin ไว้ใน shadow register (bitmask)
+- ทุกคำสั่งคำนวณ diff กับ shadow แล้วเขียนเฉพาะ pin ที่เปลี่ยน ด้วย lgpio.group_write ครั้งเดียว
+  (LED เปลี่ยนพร้อมกัน / pin ที่ไม่เปลี่ยนไม่ถูกแตะ)
+- blink engine: timer thread เดียวสำหรับทุก pin ที่กระพริบ
+- ถ้าไม่มี lgpio -> fallback เป็น gpiozero OutputDevice (ยัง diff เหมือนเดิม)
+"""
+
+import os, sys, threading
+from typing import Dict, Iterable, List, Optional, Set
+
+try:
+    import lgpio
+except Exception as e:
+    lgpio = None
+    print(f"[LED] lgpio not available: {e}", file=sys.stderr)
+
+LGPIO_CHIP   = int(os.getenv("LGPIO_CHIP", "0"))
+LED_BLINK_MS = int(os.getenv("LED_BLINK_MS", "250"))   # ครึ่งคาบของการกระพริบ
+
+
+class _LgpioGroup:
+    """claim pin ทั้งหมดเป็น output group เดียว -> group_write(bits, mask)"""
+    def __init__(self, pins: List[int], chip: int = LGPIO_CHIP):
+        self.pins = pins
+        self._h = lgpio.gpiochip_open(chip)
+        lgpio.group_claim_output(self._h, pins, [0] * len(pins))
+
+    def write(self, bits: int, mask: int):
+        lgpio.group_write(self._h, self.pins[0], bits, mask)
+
+    def close(self):
+        try:
+            lgpio.group_write(self._h, self.pins[0], 0, (1 << len(self.pins)) - 1)
+            lgpio.group_free(self._h, self.pins[0])
+        finally:
+            lgpio.gpiochip_close(self._h)
+
+
+class _GpiozeroGroup:
+    """fallback: เขียนทีละ pin แต่เฉพาะ bit ที่อยู่ใน mask
+    (มาถึงตรงนี้เพราะ import lgpio ไม่ได้ -> ไม่บังคับ pin factory ให้ gpiozero เลือกเอง / ตาม GPIOZERO_PIN_FACTORY)"""
+    def __init__(self, pins: List[int]):
+        from gpiozero import OutputDevice
+        self.pins = pins
+        self._devs = [OutputDevice(p, active_high=True, initial_value=False) for p in pins]
+
+    def write(self, bits: int, mask: int):
+        for i, dev in enumerate(self._devs):
+            if mask & (1 << i):
+                dev.on() if bits & (1 << i) else dev.off()
+
+    def close(self):
+        for dev in self._devs:
+            try: dev.off(); dev.close()
+            except: pass
+
+
+class LedBackend:
+    def __init__(self, pins: Iterable[int], blink_ms: int = LED_BLINK_MS):
+        self.pins: List[int] = sorted(set(int(p) for p in pins))
+        self._bit = {p: 1 << i for i, p in enumerate(self.pins)}
+        self._io = _LgpioGroup(self.pins) if lgpio is not None else _GpiozeroGroup(self.pins)
+
+        self._lock = threading.Lock()
+        self._shadow = 0          # สถานะที่เขียนลง hardware แล้ว
+        self._steady = 0          # สถานะที่ต้องการ (ไม่รวม blink)
+        self._blink_mask = 0      # pin ที่กำลังกระพริบ
+        self._blink_on = False
+        self.writes = 0           # จำนวน group write จริง
+
+        self._blink_s = max(0.02, blink_ms / 1000.0)
+        self._wake = threading.Condition(self._lock)
+        self._stop = False
+        self._th = threading.Thread(target=self._blink_loop, name="LEDBlink", daemon=True)
+        self._th.start()
+
+    # ---------- core ----------
+    def _target_bits(self) -> int:
+        bits = self._steady & ~self._blink_mask
+        if self._blink_on:
+            bits |= self._blink_mask
+        return bits
+
+    def _flush(self) -> int:
+        """เขียนเฉพาะ bit ที่ต่างจาก shadow (ต้องถือ lock)"""
+        bits = self._target_bits()
+        mask = bits ^ self._shadow
+        if mask:
+            self._io.write(bits, mask)
+            self._shadow = bits
+            self.writes += 1
+        return bin(mask).count("1")
+
+    def apply(self, levels: Dict[int, bool], blink: Optional[Set[int]] = None) -> int:
+        """
+        levels: {pin: on/off} (steady) ; blink: pin ที่ต้องกระพริบ
+        pin ที่ระบุใน levels แต่ไม่อยู่ใน blink -> หยุดกระพริบ
+        คืนจำนวน pin ที่เปลี่ยนจริง
+        """
+        blink = blink or set()
+        with self._lock:
+            was_blinking = bool(self._blink_mask)
+            for pin, on in levels.items():
+                b = self._bit.get(int(pin))
+                if b is None:
+                    raise KeyError(f"pin {pin} not managed by LedBackend")
+                self._steady = (self._steady | b) if on else (self._steady & ~b)
+                self._blink_mask &= ~b
+            for pin in blink:
+                self._blink_mask |= self._bit[int(pin)]
+            if self._blink_mask and not was_blinking:
+                self._blink_on = True     # เริ่มกระพริบจากสถานะติด
+            changed = self._flush()
+            if self._blink_mask and not was_blinking:
+                self._wake.notify()
+            return changed
+
+    def snapshot(self) -> Dict[int, bool]:
+        with self._lock:
+            return {p: bool(self._shadow & b) for p, b in self._bit.items()}
+
+    # ---------- blink engine ----------
+    def _blink_loop(self):
+        with self._lock:
+            while not self._stop:
+                if not self._blink_mask:
+                    self._blink_on = False
+                    self._wake.wait()
+                    continue
+                self._wake.wait(timeout=self._blink_s)
+                if self._stop:
+                    break
+                self._blink_on = not self._blink_on
+                try:
+                    self._flush()
+                except Exception as e:
+                    print(f"[LED] blink write error: {e}")
+
+    def close(self):
+        with self._lock:
+            self._stop = True
+            self._wake.notify()
+        self._th.join(timeout=1.0)
+        self._io.close()
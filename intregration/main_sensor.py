@@ -5,6 +5,7 @@ import time, argparse
 from bus_sensor import MqttBus
 import drivers_sensor as drv
 from detect_sensor import SensorNode
+from supervisor import mark_ready
 
 # ===== ปรับได้ตามฮาร์ดแวร์ =====
 BARCODE_PORTS = {'1': '/dev/barcode0', '2': '/dev/barcode1'}
@@ -19,6 +20,7 @@ def main():
     ap.add_argument("--mqtt-user", default=None)
     ap.add_argument("--mqtt-pass", default=None)
     ap.add_argument("--device-id", default="pi5-01")
+    ap.add_argument("--cart-id", default=None, help="publish ที่ <base>/sensor/<cart-id> (multi-cart)")
     # RFID decode words
     ap.add_argument("--rfid-words", type=int, default=5)
     args = ap.parse_args()
@@ -26,7 +28,7 @@ def main():
     # MQTT
     bus = MqttBus(args.mqtt_host, args.mqtt_port, args.mqtt_base,
                   user=args.mqtt_user, password=args.mqtt_pass,
-                  client_id=f"{args.device_id}-sensor")
+                  client_id=f"{args.device_id}-sensor", cart_id=args.cart_id)
 
     # เปิดพอร์ต Barcode (fixed path เท่านั้น)
     ser1 = drv.barcode_open(BARCODE_PORTS.get('1'))
@@ -46,6 +48,7 @@ def main():
         rfid_words=args.rfid_words
     )
 
+    mark_ready(bus.cli)
     print("===== RUNNING (Ctrl+C to quit) =====")
     try:
         while True:
@@ -1,108 +1,360 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, json, asyncio, websockets
+import os, json, time, uuid, asyncio, hashlib, tempfile, websockets
+from websockets.exceptions import ConnectionClosed
 from typing import Any, Dict, List, Optional, Tuple
 
 from fn_server import (
-    mqtt_init, now_fields,
-    publish_job_topics, publish_detect_config, detect_mode_any,
-    setup_amr_status_subscriptions, persist_state_and_log, _fill_two_slots,
-    validate_and_map_goal, map_status_to_op
+    now_fields,
+    publish_job_topics, publish_job_batch, publish_detect_config, detect_mode_any,
+    setup_amr_status_subscriptions, build_job_record, _fill_two_slots,
+    _load_goals_map
 )
+from goals_registry import install_reload_signal
+from job_schema import JobError, validate_job
+from state_writer import StateWriter
+from progress_hub import ProgressHub
+from ws_limits import WsLimits, TokenBucket, serve_kwargs
+from ttl_cache import TTLCache
+from state_store import DATA_DIR
+from metrics import REGISTRY, serve_http
+from aio_mqtt import AsyncMqtt
+from supervisor import mark_ready
+
+WS_MAX_BATCH_JOBS = int(os.getenv("WS_MAX_BATCH_JOBS", "200"))
+DEDUPE_MAX        = int(os.getenv("DEDUPE_MAX", "4096"))
+DEDUPE_KEY_SECS   = float(os.getenv("DEDUPE_KEY_SECS", "600"))   # job_key ที่ client ส่งมา
+DEDUPE_HASH_SECS  = float(os.getenv("DEDUPE_HASH_SECS", "10"))   # ไม่มี job_key -> hash เนื้องาน (กัน retry ซ้ำ)
+
+# -------- Metrics (GET /metrics, /healthz บน METRICS_PORT) --------
+M_JOBS     = REGISTRY.counter("smartcart_ws_jobs_total", "Jobs received over WebSocket by result", ("result",))
+M_VALIDATE = REGISTRY.histogram("smartcart_ws_validate_seconds", "Time to validate + normalize one job")
+M_PERSIST  = REGISTRY.histogram("smartcart_ws_persist_seconds", "Submit to durable commit (state writer group commit)",
+                                (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+M_PUBLISH  = REGISTRY.histogram("smartcart_ws_mqtt_publish_seconds", "Time spent publishing job topics to MQTT")
+M_PUBACK   = REGISTRY.histogram("smartcart_ws_mqtt_puback_seconds", "Publish to broker PUBACK (qos 1 job/latest, job/batch)")
+M_QWAIT    = REGISTRY.histogram("smartcart_fsm_queue_wait_seconds", "Orchestrator queue wait (enqueue to robot assignment)",
+                                buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+M_DWELL    = REGISTRY.histogram("smartcart_fsm_state_seconds", "Time spent in each orchestrator FSM state",
+                                buckets=(0.1, 1, 5, 15, 30, 60, 120, 300, 600, 1800), labels=("state",))
+M_PHASE    = REGISTRY.histogram("smartcart_fsm_job_phase_seconds", "Per-job time by phase (QUEUED + FSM states) for completed jobs",
+                                buckets=(0.1, 1, 5, 15, 30, 60, 120, 300, 600, 1800), labels=("phase",))
+M_CYCLE    = REGISTRY.histogram("smartcart_fsm_job_cycle_seconds", "Completed job cycle time (queue to done)",
+                                buckets=(15, 30, 60, 120, 300, 600, 1200, 1800, 3600))
+
+async def _await_ack(mqtt: AsyncMqtt, info) -> Dict[str, Any]:
+    """รอ PUBACK -> field "mqtt" ของ reply"""
+    acked, secs = await mqtt.wait_published(info)
+    if acked:
+        M_PUBACK.observe(secs)
+    return {"acked": acked, "ack_ms": round(secs * 1000, 2)}
+
+def _new_job_id() -> str:
+    """ไม่ชนกันแม้รับหลายงานใน ms เดียว (ts*1000 เดิมชนกันได้ทั้งข้าม client และข้าม batch)"""
+    return uuid.uuid4().hex
+
+def _observe_persist(fut):
+    t0 = time.perf_counter()
+    fut.add_done_callback(lambda _f: M_PERSIST.observe(time.perf_counter() - t0))
+    return fut
 
 # -------- Normalizer (KEEP POSITIONS) --------
-def _canon_keep(x: Any) -> Optional[str]:
+def normalize_payload(data: Any, goals_map: Optional[Dict[str, str]] = None) -> Tuple[Optional[Dict[str, Any]], List[JobError], List[str]]:
     """
-    รักษาตำแหน่ง: 'None'/None/"" -> None, อื่น ๆ -> str(x)
+    ตรวจ + normalize ด้วย job_schema.validate_job (รอบเดียว) คืน:
+    - norm: {op, cuh_ids[2], kit_ids[2], goal_id, goal_name}  # คงตำแหน่ง
+    - errors: [JobError(path, code, message)] (ถ้าไม่ว่าง -> ไม่ประมวลผล)
+    - warnings: ข้อควรทราบ แต่ยังประมวลผลได้
     """
-    if x is None:
-        return None
-    s = str(x).strip()
-    if s == "" or s.lower() == "none":
-        return None
-    return s
+    with M_VALIDATE.time():
+        return validate_job(data, goals_map if goals_map is not None else _load_goals_map())
 
-def normalize_payload(data: Any) -> Tuple[Optional[Dict[str, Any]], List[str], List[str]]:
+def _err_fields(errs: List[JobError]) -> Dict[str, Any]:
+    """errors (ข้อความเดิม) + error_details (ตำแหน่ง/รหัส) สำหรับ reply"""
+    return {"errors": [str(e) for e in errs], "error_details": [e.as_dict() for e in errs]}
+
+# -------- Idempotency (ก่อนแตะดิสก์/MQTT) --------
+class JobDedupe:
     """
-    พยายามรับทุกรูปแบบ แล้วคืน:
-    - norm: {op, cuh_ids[2], kit_ids[2], goal_id, goal_name}  # คงตำแหน่ง
-    - errors: รายการสาเหตุไม่ผ่าน (ถ้าไม่ว่าง -> ไม่ประมวลผล)
-    - warnings: ข้อควรทราบ แต่ยังประมวลผลได้
+    key -> reply ที่เคยตอบไปแล้ว (TTLCache: จำกัดจำนวน + อายุ)
+    - "k:<job_key>" : client ส่ง job_key มาเอง (ตรวจได้ก่อน validate)
+    - "h:<hash>"    : hash ของงานที่ normalize แล้ว (op, cuh, kit, goal)
+    - key ถูกจองด้วย future ก่อน await แรก (fsync / PUBACK) -> งานซ้ำที่มาระหว่างนั้นรอ reply ของงานแรก ไม่ถูกรับซ้ำ
+    """
+    def __init__(self, max_items: int = DEDUPE_MAX):
+        self.cache = TTLCache(max_items, DEDUPE_KEY_SECS)
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.duplicates = 0
+
+    @staticmethod
+    def client_key(data: Any) -> Optional[str]:
+        if isinstance(data, dict):
+            k = data.get("job_key")
+            if isinstance(k, (str, int)) and str(k).strip():
+                return f"k:{str(k).strip()}"
+        return None
+
+    @staticmethod
+    def content_key(norm: Dict[str, Any]) -> str:
+        raw = json.dumps([norm["op"], norm["cuh_ids"], norm["kit_ids"], norm["goal_id"]], separators=(",", ":"))
+        return "h:" + hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+    async def claim(self, key: str) -> Optional[Dict[str, Any]]:
+        """reply เดิมถ้าซ้ำ ; None = ผู้เรียกจอง key แล้ว (ต้อง remember() หรือ release() ทุกทาง)"""
+        while True:
+            hit = self.cache.get(key)
+            if hit is not None:
+                self.duplicates += 1
+                return hit
+            fut = self.inflight.get(key)
+            if fut is None:
+                self.inflight[key] = asyncio.get_running_loop().create_future()
+                return None
+            await asyncio.shield(fut)   # release() (งานแรกล้ม) -> ไม่มีใน cache -> จองเองรอบถัดไป
+
+    def remember(self, key: str, reply: Dict[str, Any]):
+        self.cache.put(key, reply, ttl=DEDUPE_KEY_SECS if key.startswith("k:") else DEDUPE_HASH_SECS)
+        self.release(key)
+
+    def release(self, key: str):
+        fut = self.inflight.pop(key, None)
+        if fut is not None and not fut.done():
+            fut.set_result(None)
+
+def _mapped(norm: Dict[str, Any]) -> Dict[str, Any]:
+    cuh_ids, kit_ids, goal_id = norm["cuh_ids"], norm["kit_ids"], norm["goal_id"]
+    mode = detect_mode_any([x for x in cuh_ids if x is not None],
+                           [x for x in kit_ids if x is not None],
+                           goal_id)
+    return {
+        "op": norm["op"],
+        "cuh_ids": _fill_two_slots(list(cuh_ids)),  # cuh_ids ยาว 2 อยู่แล้ว
+        "kit_ids": _fill_two_slots(list(kit_ids)),
+        "goal_id": goal_id,
+        "goal_name": norm["goal_name"],
+        "mode": mode
+    }
+
+def is_batch_frame(data: Any) -> bool:
+    return isinstance(data, dict) and data.get("type") == "batch"
+
+def is_subscribe_frame(data: Any) -> bool:
+    return isinstance(data, dict) and data.get("type") in ("subscribe", "unsubscribe")
+
+def _throttled_reply(bucket: TokenBucket, n: int, **extra) -> str:
+    wait = bucket.retry_after(n)
+    err = (f"rate limited: retry after {wait:.1f}s" if wait >= 0
+           else f"rate limited: {n} jobs exceeds burst {int(bucket.burst)}")
+    return json.dumps({"status": "error", **extra, "errors": [err], "retry_after": round(wait, 2)})
 
-    รูปแบบที่ลอง:
-    1) list[6]: [status|op, CUH1, CUH2, KIT1, KIT2, DOT]
-    2) list[5]: [CUH1, CUH2, KIT1, KIT2, DOT]
-    3) object: {status|op, cuh_ids, kit_ids, dot|goal_id|goal}
+async def handle_batch(websocket, mqtt: AsyncMqtt, writer: StateWriter, hub: ProgressHub,
+                       limits: WsLimits, bucket: TokenBucket, dedupe: JobDedupe, data: Dict[str, Any]):
     """
-    errors, warns = [], []
+    batch frame: {"type":"batch", "jobs":[job, job, ...], "durable": bool}
+    - validate ทุกงานในรอบเดียวด้วย goals map snapshot เดียว
+    - persist งานที่ผ่านทั้งหมดใน group commit เดียว / publish job/batch ครั้งเดียว
+    - ตอบผลรายงาน (index ตามลำดับใน jobs) งานที่ซ้ำ (job_key/เนื้องาน) ได้ status=duplicate + job_id เดิม
+    - ตอบหลังได้ PUBACK ของ job/batch (field "mqtt")
+    """
+    jobs = data.get("jobs")
+    if not isinstance(jobs, list) or not jobs:
+        await websocket.send(json.dumps({"status":"error","type":"batch","errors":["batch 'jobs' must be a non-empty list"]}))
+        return
+    if len(jobs) > WS_MAX_BATCH_JOBS:
+        await websocket.send(json.dumps({"status":"error","type":"batch",
+                                         "errors":[f"too many jobs in batch ({len(jobs)} > {WS_MAX_BATCH_JOBS})"]}))
+        return
+    if not limits.allow_jobs(websocket, bucket, len(jobs)):
+        M_JOBS.inc(len(jobs), result="throttled")
+        await websocket.send(_throttled_reply(bucket, len(jobs), type="batch"))
+        return
 
-    op: Optional[str] = None
-    c1 = c2 = k1 = k2 = None
-    dot_raw: Optional[str] = None
+    goals_map = _load_goals_map()
+    ts, d, t, iso = now_fields()
+    results: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+    keyed: List[Tuple[int, Any, str, Optional[Dict[str, Any]], List[str]]] = []
+    for i, job in enumerate(jobs):
+        key = dedupe.client_key(job)
+        norm, warns = None, []
+        if key is None:
+            norm, errs, warns = normalize_payload(job, goals_map)
+            if errs:
+                results[i] = {"index": i, "status": "error", **_err_fields(errs), "warnings": warns}
+                continue
+            key = dedupe.content_key(norm)
+        keyed.append((i, job, key, norm, warns))
 
+    records: List[Dict[str, Any]] = []
+    fresh: Dict[str, Dict[str, Any]] = {}     # key -> result ของงานใหม่ใน batch นี้
+    prevs: Dict[str, Dict[str, Any]] = {}     # key -> reply เดิม (ซ้ำกับงานก่อน batch นี้)
+    claimed: List[str] = []
+    duplicates = 0
+    last_ok: Optional[Dict[str, Any]] = None
+    durable = bool(data.get("durable"))
+    ack = None
     try:
-        if isinstance(data, list):
-            if len(data) == 6:
-                s_or_op, c1, c2, k1, k2, last = data
-                op = map_status_to_op(s_or_op)  # approved/returning/request/return
-                dot_raw = last
-            elif len(data) == 5:
-                # legacy: ไม่มี status/op -> default ใช้ Request
-                c1, c2, k1, k2, last = data
-                op = "Request"
-                warns.append("legacy-5-items: default OP=Request")
-                dot_raw = last
+        # จองตามลำดับ key (batch ที่รอกันเองจะไม่ deadlock)
+        for key in sorted({k for _, _, k, _, _ in keyed}):
+            prev = await dedupe.claim(key)
+            if prev is None:
+                claimed.append(key)
             else:
-                errors.append("unsupported list length (expect 5 or 6)")
-        elif isinstance(data, dict):
-            # flexible object (ยอมรับ keyed)
-            op = map_status_to_op(data.get("status")) or map_status_to_op(data.get("op"))
-            cuh = data.get("cuh_ids") or [None, None]
-            kit = data.get("kit_ids") or [None, None]
-            # รองรับทั้ง list ยาว >=2 หรือ <2
-            c1 = cuh[0] if len(cuh) >= 1 else None
-            c2 = cuh[1] if len(cuh) >= 2 else None
-            k1 = kit[0] if len(kit) >= 1 else None
-            k2 = kit[1] if len(kit) >= 2 else None
-            dot_raw = data.get("dot") or data.get("goal_id") or data.get("goal")
-        else:
-            errors.append("payload must be list or object")
-    except Exception as e:
-        errors.append(f"normalize exception: {e}")
+                prevs[key] = prev
+        for i, job, key, norm, warns in keyed:
+            prev = prevs.get(key) or fresh.get(key)
+            if prev is not None:
+                duplicates += 1
+                results[i] = {"index": i, "status": "duplicate", "job_id": prev.get("job_id")}
+                continue
+            if norm is None:
+                norm, errs, warns = normalize_payload(job, goals_map)
+                if errs:
+                    results[i] = {"index": i, "status": "error", **_err_fields(errs), "warnings": warns}
+                    continue
+            job_id = _new_job_id()
+            records.append(build_job_record(norm["cuh_ids"], norm["kit_ids"], norm["goal_id"], ts, d, t, iso,
+                                            op=norm["op"], goal_name=norm["goal_name"], job_id=job_id))
+            res = {"index": i, "status": "ok", "job_id": job_id, "mapped": _mapped(norm), "warnings": warns}
+            results[i] = res
+            fresh[key] = res
+            last_ok = norm
 
-    # --- Canonicalize (KEEP POSITIONS) ---
-    cuh2 = [_canon_keep(c1), _canon_keep(c2)]
-    kit2 = [_canon_keep(k1), _canon_keep(k2)]
+        if records:
+            persisted = _observe_persist(writer.submit_many(records))
+            with M_PUBLISH.time():
+                info = publish_job_batch(mqtt.client, records)
+            # detect config เป็น desired state ของสถานี -> ตั้งตามงานล่าสุดเหมือนส่งทีละงาน
+            publish_detect_config(mqtt.client, last_ok["cuh_ids"], last_ok["kit_ids"], last_ok["goal_id"], ts, d, t, iso)
+            ack_task = asyncio.ensure_future(_await_ack(mqtt, info))
+            if durable:
+                try:
+                    await asyncio.wrap_future(persisted)
+                except Exception as e:
+                    ack_task.cancel()
+                    await websocket.send(json.dumps({"status":"error","type":"batch","errors":[f"persist failed: {e}"]}))
+                    return
+            ack = await ack_task
 
-    # --- validations ---
-    if not op:
-        errors.append("missing/invalid status or op (expect: approved/returning or Request/Return)")
+        for r in records:
+            hub.subscribe(websocket, r["job_id"])   # push progress ของงานที่ส่งเอง
+        for key, res in fresh.items():
+            dedupe.remember(key, {"status": "ok", "type": "job_ids", "job_id": res["job_id"], "mapped": res["mapped"]})
+    finally:
+        for key in claimed:
+            dedupe.release(key)     # key ที่ไม่ได้ remember (error / persist ล้ม) -> งานซ้ำที่รออยู่ทำเอง
 
-    # ต้องมีอย่างน้อย 1 ค่าใน 4 ช่องแรก
-    if all(v is None for v in (cuh2[0], cuh2[1], kit2[0], kit2[1])):
-        errors.append("at least one of CUH/KIT must be present")
+    accepted = len(records)
+    rejected = len(jobs) - accepted - duplicates
+    M_JOBS.inc(accepted, result="accepted")
+    M_JOBS.inc(duplicates, result="duplicate")
+    M_JOBS.inc(rejected, result="rejected")
+    status = "ok" if rejected == 0 else ("partial" if accepted or duplicates else "error")
+    print(f"[WS][{iso}] BATCH {status}: accepted={accepted} duplicates={duplicates} rejected={rejected} mqtt={ack}")
+    await websocket.send(json.dumps({
+        "status": status, "type": "batch",
+        "accepted": accepted, "duplicates": duplicates, "rejected": rejected,
+        "results": results,
+        "durable": durable,
+        "mqtt": ack,
+        "ts":ts,"date":d,"time":t,"iso":iso
+    }, ensure_ascii=False))
 
-    goal_id, goal_name, gerr = validate_and_map_goal(dot_raw)
-    if gerr:
-        errors.append(gerr)
+# -------- WebSocket Handler --------
+async def _send_duplicate(websocket, cached: Dict[str, Any]):
+    M_JOBS.inc(result="duplicate")
+    print(f"[WS] DUPLICATE -> job_id={cached.get('job_id')} (cached reply)")
+    await websocket.send(json.dumps({**cached, "duplicate": True}, ensure_ascii=False))
 
-    if errors:
-        return None, errors, warns
+async def handle_job(websocket, mqtt: AsyncMqtt, writer: StateWriter, hub: ProgressHub,
+                     limits: WsLimits, bucket: TokenBucket, dedupe: JobDedupe, data: Any, key: Optional[str]):
+    """งานเดี่ยว ; key = job_key ที่ผู้เรียกจองไว้แล้ว (None -> จอง hash ของเนื้องานหลัง validate)"""
+    peer = getattr(websocket, "remote_address", None)
+    if not limits.allow_jobs(websocket, bucket):
+        M_JOBS.inc(result="throttled")
+        print(f"[WS] THROTTLED {peer}")
+        await websocket.send(_throttled_reply(bucket, 1))
+        return
 
-    # ✅ คืนแบบคงตำแหน่ง (ไม่กรอง/ไม่รัดรูป)
-    return {
-        "op": op,
-        "cuh_ids": cuh2,   # เช่น [None, "CUH22-1030"]
-        "kit_ids": kit2,   # เช่น [None, "MXK22-1049"]
-        "goal_id": goal_id,
-        "goal_name": goal_name
-    }, errors, warns
+    norm, errs, warns = normalize_payload(data)
+    if errs:
+        M_JOBS.inc(result="rejected")
+        print("[WS] INVALID:", [str(e) for e in errs], "| warns:", warns)
+        await websocket.send(json.dumps({
+            "status":"error",
+            **_err_fields(errs),
+            "warnings": warns
+        }))
+        return
 
-# -------- WebSocket Handler --------
-async def handle_client(websocket, mqtt_cli):
+    owned = None
+    if key is None:
+        key = dedupe.content_key(norm)
+        cached = await dedupe.claim(key)
+        if cached is not None:
+            await _send_duplicate(websocket, cached)
+            return
+        owned = key
+    try:
+        await _accept_job(websocket, mqtt, writer, hub, dedupe, data, key, norm, warns)
+    finally:
+        if owned is not None:
+            dedupe.release(owned)
+
+async def _accept_job(websocket, mqtt: AsyncMqtt, writer: StateWriter, hub: ProgressHub,
+                      dedupe: JobDedupe, data: Any, key: str, norm: Dict[str, Any], warns: List[str]):
+    """งานที่ validate แล้ว -> persist + publish + ตอบ ; remember(key) เมื่อสำเร็จ"""
+    op = norm["op"]
+    cuh_ids = norm["cuh_ids"]   # คงตำแหน่ง
+    kit_ids = norm["kit_ids"]   # คงตำแหน่ง
+    goal_id = norm["goal_id"]
+    goal_name = norm["goal_name"]
+
+    ts, d, t, iso = now_fields()
+    job_id = _new_job_id()
+    hub.subscribe(websocket, job_id)   # ก่อน publish เพื่อไม่พลาด transition แรก
+
+    # persist (writer thread, group commit) + MQTT + detect
+    record = build_job_record(cuh_ids, kit_ids, goal_id, ts, d, t, iso, op=op, goal_name=goal_name, job_id=job_id)
+    persisted = _observe_persist(writer.submit(record))
+    with M_PUBLISH.time():
+        info = publish_job_topics(mqtt.client, cuh_ids, kit_ids, goal_id, ts, d, t, iso, goal_name=goal_name, op=op, job_id=job_id)
+        publish_detect_config(mqtt.client, cuh_ids, kit_ids, goal_id, ts, d, t, iso)
+    ack_task = asyncio.ensure_future(_await_ack(mqtt, info))   # PUBACK ของ job/latest
+
+    # client ขอ durable -> รอ fsync ก่อนตอบ (ไม่บล็อก client อื่น)
+    durable = isinstance(data, dict) and bool(data.get("durable"))
+    if durable:
+        try:
+            await asyncio.wrap_future(persisted)
+        except Exception as e:
+            ack_task.cancel()
+            await websocket.send(json.dumps({"status":"error","errors":[f"persist failed: {e}"]}))
+            return
+    ack = await ack_task
+
+    mapped = _mapped(norm)
+    mode = mapped["mode"]
+
+    print(f"[WS][{iso}] OK op={op} cuh={mapped['cuh_ids']} kit={mapped['kit_ids']} goal_id={goal_id} -> {goal_name} mode={mode} mqtt={ack}")
+    reply = {
+        "status":"ok","type":"job_ids","job_id":job_id,"mapped":mapped,
+        "warnings": warns,
+        "durable": durable,
+        "mqtt": ack,
+        "ts":ts,"date":d,"time":t,"iso":iso
+    }
+    dedupe.remember(key, reply)
+    M_JOBS.inc(result="accepted")
+    await websocket.send(json.dumps(reply))
+
+async def handle_client(websocket, mqtt: AsyncMqtt, writer: StateWriter, hub: ProgressHub,
+                        limits: WsLimits, dedupe: JobDedupe):
     peer = getattr(websocket, "remote_address", None)
-    print(f"[WS] CONNECT from {peer}")
+    if not await limits.admit(websocket):
+        return
+    print(f"[WS] CONNECT from {peer} (clients={limits.clients})")
+    bucket = TokenBucket()
     try:
         async for message in websocket:
             print("\n" + "="*80)
@@ -117,68 +369,108 @@ async def handle_client(websocket, mqtt_cli):
                 await websocket.send(json.dumps({"status":"error","errors":[err]}))
                 continue
 
-            norm, errs, warns = normalize_payload(data)
-            if errs:
-                print("[WS] INVALID:", errs, "| warns:", warns)
-                await websocket.send(json.dumps({
-                    "status":"error",
-                    "errors": errs,
-                    "warnings": warns
-                }))
+            if is_batch_frame(data):
+                await handle_batch(websocket, mqtt, writer, hub, limits, bucket, dedupe, data)
                 continue
 
-            # valid → process
-            op = norm["op"]
-            cuh_ids = norm["cuh_ids"]   # คงตำแหน่ง
-            kit_ids = norm["kit_ids"]   # คงตำแหน่ง
-            goal_id = norm["goal_id"]
-            goal_name = norm["goal_name"]
-
-            ts, d, t, iso = now_fields()
-
-            # persist + MQTT + detect
-            persist_state_and_log(cuh_ids, kit_ids, goal_id, ts, d, t, iso, op=op, goal_name=goal_name)
-            publish_job_topics(mqtt_cli, cuh_ids, kit_ids, goal_id, ts, d, t, iso, goal_name=goal_name)
-            publish_detect_config(mqtt_cli, cuh_ids, kit_ids, goal_id, ts, d, t, iso)
-
-            mode = detect_mode_any([x for x in cuh_ids if x is not None],
-                                   [x for x in kit_ids if x is not None],
-                                   goal_id)
-
-            mapped = {
-                "op": op,
-                "cuh_ids": _fill_two_slots([x for x in cuh_ids if True]),  # cuh_ids ยาว 2 อยู่แล้ว
-                "kit_ids": _fill_two_slots([x for x in kit_ids if True]),
-                "goal_id": goal_id,
-                "goal_name": goal_name,
-                "mode": mode
-            }
+            if is_subscribe_frame(data):
+                await websocket.send(json.dumps(hub.handle_frame(websocket, data)))
+                continue
 
-            print(f"[WS][{iso}] OK op={op} cuh={mapped['cuh_ids']} kit={mapped['kit_ids']} goal_id={goal_id} -> {goal_name} mode={mode}")
-            await websocket.send(json.dumps({
-                "status":"ok","type":"job_ids","mapped":mapped,
-                "warnings": warns,
-                "ts":ts,"date":d,"time":t,"iso":iso
-            }))
+            # job_key ซ้ำ -> ตอบจาก cache ทันที (ไม่ validate / ไม่นับ rate limit)
+            key = dedupe.client_key(data)
+            if key is not None:
+                cached = await dedupe.claim(key)
+                if cached is not None:
+                    await _send_duplicate(websocket, cached)
+                    continue
+            try:
+                await handle_job(websocket, mqtt, writer, hub, limits, bucket, dedupe, data, key)
+            finally:
+                if key is not None:
+                    dedupe.release(key)
+    except ConnectionClosed as e:
+        limits.note_closed(e)
+        print(f"[WS] CLOSED from {peer}: {e}")
     except Exception as e:
         print(f"[WS] EXC from {peer}: {e}")
     finally:
-        print(f"[WS] CLOSE {peer}")
+        hub.drop(websocket)
+        limits.release(websocket)
+        print(f"[WS] CLOSE {peer} | limits={limits.snapshot()} dedupe={dedupe.cache.stats()}")
+
+# -------- Health / runtime gauges --------
+def _data_dir_writable() -> bool:
+    try:
+        with tempfile.NamedTemporaryFile("w", dir=DATA_DIR, prefix=".healthz-", delete=True) as f:
+            f.write("ok"); f.flush(); os.fsync(f.fileno())
+        return True
+    except Exception as e:
+        print(f"[HEALTH] DATA_DIR not writable: {e}")
+        return False
+
+def _register_runtime_metrics(limits: WsLimits, dedupe: JobDedupe, writer: StateWriter, hub: ProgressHub,
+                              mqtt: AsyncMqtt):
+    REGISTRY.callback("smartcart_ws_clients", "Connected WebSocket clients", lambda: limits.clients)
+    for key in ("frames_rejected", "clients_rejected", "jobs_throttled", "clients_throttled", "slow_evicted"):
+        REGISTRY.callback(f"smartcart_ws_{key}_total", f"WebSocket limits: {key.replace('_', ' ')}",
+                          lambda k=key: getattr(limits, k), kind="counter")
+    REGISTRY.callback("smartcart_dedupe_entries", "Idempotency cache entries", lambda: len(dedupe.cache))
+    REGISTRY.callback("smartcart_dedupe_hits_total", "Idempotency cache hits", lambda: dedupe.cache.hits, kind="counter")
+    REGISTRY.callback("smartcart_writer_batches_total", "State writer group commits", lambda: writer.batches, kind="counter")
+    REGISTRY.callback("smartcart_writer_records_total", "Records committed by state writer", lambda: writer.records, kind="counter")
+    REGISTRY.callback("smartcart_writer_queue", "Records waiting for the state writer", lambda: writer._q.qsize())
+    REGISTRY.callback("smartcart_progress_events_total", "Progress events pushed to clients", lambda: hub.events, kind="counter")
+    REGISTRY.callback("smartcart_fsm_queue_depth", "Jobs waiting in the orchestrator queue", lambda: hub.queue_stats["depth"])
+    REGISTRY.callback("smartcart_fsm_queue_parked", "Jobs parked after JOBQ_MAX_ATTEMPTS retries", lambda: hub.queue_stats["parked"])
+    REGISTRY.callback("smartcart_fsm_queue_oldest_wait_seconds", "Wait of the oldest queued job",
+                      lambda: hub.queue_stats["oldest_wait_s"])
+    REGISTRY.callback("smartcart_mqtt_connected", "MQTT client connected (1/0)", lambda: int(mqtt.is_connected()))
+    REGISTRY.callback("smartcart_mqtt_ack_timeouts_total", "qos 1 publishes without PUBACK within MQTT_ACK_TIMEOUT",
+                      lambda: mqtt.ack_timeouts, kind="counter")
+    REGISTRY.callback("smartcart_mqtt_reconnects_total", "MQTT reconnects", lambda: mqtt.reconnects, kind="counter")
+
+def _observe_phases(phases: Dict[str, float]):
+    for phase, secs in phases.items():
+        M_PHASE.observe(secs, phase=phase)
+    M_CYCLE.observe(sum(phases.values()))
 
 # -------- Main --------
 async def main():
-    mqtt_cli = mqtt_init(client_id="ws-bridge-server")
-    setup_amr_status_subscriptions(mqtt_cli)
+    loop = asyncio.get_running_loop()
+    limits = WsLimits()
+    hub = ProgressHub(loop, limits, on_job_wait=M_QWAIT.observe,
+                      on_state_dwell=lambda st, secs: M_DWELL.observe(secs, state=st),
+                      on_job_phases=_observe_phases)
+    # MQTT บน event loop เดียวกับ WebSocket (ไม่มี paho thread)
+    mqtt = AsyncMqtt(loop, client_id="ws-bridge-server")
+    setup_amr_status_subscriptions(mqtt.client, on_event=hub.on_mqtt)
+    await mqtt.connect()
+    writer = StateWriter().start()
+    dedupe = JobDedupe()
     host = os.getenv("WS_HOST", "0.0.0.0")
     port = int(os.getenv("WS_PORT", "8765"))
+
+    _register_runtime_metrics(limits, dedupe, writer, hub, mqtt)
+    metrics_port = int(os.getenv("METRICS_PORT", str(port + 1)))   # 0 = ปิด
+    if metrics_port:
+        async def health():
+            return {
+                "mqtt_connected": mqtt.is_connected(),
+                "data_dir_writable": await loop.run_in_executor(None, _data_dir_writable),
+                "state_writer_alive": writer.alive(),
+            }
+        await serve_http(os.getenv("METRICS_HOST", host), metrics_port, health)
+        print(f"Metrics on http://{host}:{metrics_port}/metrics (health: /healthz)")
     async with websockets.serve(
-        lambda ws: handle_client(ws, mqtt_cli),
-        host, port,
-        max_size=None, max_queue=None, ping_interval=20, ping_timeout=20
+        lambda ws: handle_client(ws, mqtt, writer, hub, limits, dedupe),
+        host, port, **serve_kwargs()
     ):
         print(f"WebSocket server started on ws://{host}:{port}")
+        mark_ready(mqtt.client)   # qos 1: ยังไม่ connect -> ส่งเมื่อ connect ได้
         await asyncio.Future()
 
 if __name__ == "__main__":
+    install_reload_signal()   # kill -HUP <pid> -> reload goals_map.json
     asyncio.run(main())
 
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Metrics แบบ Prometheus text format (ไม่ต้องติดตั้ง prometheus_client) + HTTP endpoint เล็ก ๆ
+
+    GET /metrics  -> counters / gauges / histograms
+    GET /healthz  -> 200 {"ok": true, ...} หรือ 503 ถ้ามีข้อใดไม่ผ่าน
+
+- Counter / Histogram ใช้ได้จากหลาย thread (lock ต่อ metric)
+- Gauge รับค่าเป็นฟังก์ชัน (อ่านค่าตอน scrape) หรือ set() เอง
+- HTTP server ใช้ asyncio.start_server (event loop เดียวกับ WebSocket)
+"""
+
+import json, time, asyncio, threading
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name, self.help = name, help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._v: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, n: float = 1, **labels):
+        key = tuple(str(labels.get(k, "")) for k in self.labels)
+        with self._lock:
+            self._v[key] = self._v.get(key, 0) + n
+
+    def get(self, **labels) -> float:
+        return self._v.get(tuple(str(labels.get(k, "")) for k in self.labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._v.items())
+        return [f"{self.name}{_labels(self.labels, k)} {_fmt(v)}" for k, v in items]
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Optional[Callable[[], float]] = None, kind: str = "gauge"):
+        self.name, self.help = name, help
+        self.kind = kind        # "counter" สำหรับตัวนับที่อ่านจาก object อื่นผ่าน fn
+        self._fn = fn
+        self._v = 0.0
+
+    def set(self, v: float):
+        self._v = v
+
+    def render(self) -> List[str]:
+        try:
+            v = self._fn() if self._fn is not None else self._v
+        except Exception:
+            return []
+        return [f"{self.name} {_fmt(v)}"]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS, labels: Iterable[str] = ()):
+        self.name, self.help = name, help
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}    # label values -> [counts, sum, n]
+        if not self.labels:
+            self._series[()] = [[0] * len(self.buckets), 0.0, 0]
+
+    def observe(self, v: float, **labels):
+        key = tuple(str(labels.get(k, "")) for k in self.labels)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if v <= b:
+                    s[0][i] += 1
+                    break
+            s[1] += v
+            s[2] += 1
+
+    def time(self) -> "_Timer":
+        """with hist.time(): ..."""
+        return _Timer(self)
+
+    def totals(self) -> Dict[Tuple[str, ...], Tuple[int, float]]:
+        """label values -> (count, sum)"""
+        with self._lock:
+            return {k: (n, total) for k, (_, total, n) in self._series.items()}
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(c), total, n) for k, (c, total, n) in self._series.items())
+        out = []
+        for key, counts, total, n in items:
+            pairs = list(zip(self.labels, key))
+            acc = 0
+            for b, c in zip(self.buckets, counts):
+                acc += c
+                lbl = _labels(tuple(p[0] for p in pairs) + ("le",), tuple(p[1] for p in pairs) + (_fmt(b),))
+                out.append(f"{self.name}_bucket{lbl} {acc}")
+            lbl = _labels(self.labels, key)
+            out.append(f"{self.name}_sum{lbl} {_fmt(total)}")
+            out.append(f"{self.name}_count{lbl} {n}")
+        return out
+
+class _Timer:
+    def __init__(self, h: Histogram):
+        self.h = h
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.h.observe(time.perf_counter() - self.t0)
+        return False
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def _add(self, m):
+        if m.name in self._metrics:
+            return self._metrics[m.name]
+        self._metrics[m.name] = m
+        return m
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, fn: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._add(Gauge(name, help, fn))
+
+    def callback(self, name: str, help: str, fn: Callable[[], float], kind: str = "gauge") -> Gauge:
+        """ค่าอ่านตอน scrape จาก fn() (เช่น counter ที่ module อื่นนับไว้เอง)"""
+        return self._add(Gauge(name, help, fn, kind))
+
+    def histogram(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS,
+                  labels: Iterable[str] = ()) -> Histogram:
+        return self._add(Histogram(name, help, buckets, labels))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics.values():
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# ---------- HTTP ----------
+_REASONS = {200: "OK", 404: "Not Found", 405: "Method Not Allowed", 503: "Service Unavailable"}
+
+async def _respond(writer: asyncio.StreamWriter, code: int, body: str, ctype: str):
+    data = body.encode("utf-8")
+    head = (f"HTTP/1.1 {code} {_REASONS.get(code, '')}\r\n"
+            f"Content-Type: {ctype}\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n")
+    writer.write(head.encode("ascii") + data)
+    await writer.drain()
+
+async def serve_http(host: str, port: int, health: Callable[[], Awaitable[Dict[str, Any]]],
+                     registry: Registry = REGISTRY) -> asyncio.AbstractServer:
+    """
+    health(): coroutine -> dict ของผลตรวจ (bool ต่อหัวข้อ) ; ok = ทุกข้อ True
+    """
+    async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+            while True:     # ข้าม header
+                h = await asyncio.wait_for(reader.readline(), timeout=5.0)
+                if not h or h in (b"\r\n", b"\n"):
+                    break
+            parts = line.decode("latin-1").split()
+            method, path = (parts[0], parts[1].split("?", 1)[0]) if len(parts) >= 2 else ("", "")
+            if method != "GET":
+                await _respond(writer, 405, "method not allowed\n", "text/plain")
+            elif path == "/metrics":
+                await _respond(writer, 200, registry.render(), "text/plain; version=0.0.4")
+            elif path == "/healthz":
+                checks = await health()
+                ok = all(bool(v) for v in checks.values())
+                await _respond(writer, 200 if ok else 503, json.dumps({"ok": ok, **checks}) + "\n", "application/json")
+            else:
+                await _respond(writer, 404, "not found\n", "text/plain")
+        except Exception as e:
+            print(f"[METRICS] http error: {e}")
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    return await asyncio.start_server(_handle, host, port)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Progress hub: push สถานะงาน (FSM / match / AMR) ให้ WebSocket client ที่สนใจ
+
+- client ที่ส่งงานถูก subscribe job_id ของตัวเองอัตโนมัติ
+- client ส่ง {"type":"subscribe","job_id": "<id>"|"*"} / {"type":"unsubscribe", ...} เองได้
+- MQTT callback: ถ้ามาจาก event loop เดียวกัน (aio_mqtt) dispatch ทันที
+  ถ้ามาจาก thread ของ paho (loop_start) ส่งเข้า loop ด้วย call_soon_threadsafe
+- event 1 ตัว json.dumps ครั้งเดียว แล้ว websockets.broadcast ให้ทุก subscriber
+  (ไม่ await ทีละ client -> client ช้าไม่ถ่วงคนอื่น)
+- client ที่อ่านไม่ทันจน write buffer เกิน WS_EVICT_BYTES ถูกตัดทิ้ง (ws_limits)
+
+event ที่ส่ง:
+    {"type":"progress","job_id":..,"state":..,"prev":..,"label":..,"goal_id":..,"op":..,"ts":..}
+    {"type":"match","job_id":..,"complete":..,"matched":{..},"required":{..},"ts":..}
+    {"type":"amr","job_id":..,"connected":..|"status":{..},"ts":..}
+event ของหุ่นใน fleet มี "amr": "<id>" (job_id = งานของหุ่นตัวนั้น)
+
+fsm/state ยังอัปเดต queue_stats (depth / parked / oldest_wait_s) และเรียก callback -> main_server ทำเป็น metrics
+    on_job_wait(wait_s)          งานออกจากคิว
+    on_state_dwell(state, secs)  ทุก transition (เวลาใน state ก่อนหน้า)
+    on_job_phases(phases)        งานจบ (DONE -> IDLE): {state: secs, "QUEUED": secs}
+"""
+
+import json, time, asyncio, threading
+from typing import Any, Callable, Dict, Optional, Set
+
+import websockets
+
+from ws_limits import WsLimits
+from fn_server import MQTT_BASE, TOPIC_FSM_STATE_IN, TOPIC_MATCH_IN, parse_arcl_line
+from fleet import parse_amr_topic
+
+ALL = "*"
+
+# state ของ FSM -> ข้อความเดียวกับที่ dashboard/simulator ใช้
+STATE_LABELS = {
+    "WAIT_MATCH":       "Checking Cart",
+    "WAIT_PHOTO_CLEAR": "Cart Not Clear",
+    "EN_ROUTE":         "Going To Goals",
+    "AT_DEST":          "Arrived Goals",
+    "DONE":             "Arrived Goals",
+    "IDLE":             "Parking",
+}
+ERROR_LABEL = "Error Need Help"
+ERROR_REASONS = ("dispatch_error", "watchdog_reset")
+
+class ProgressHub:
+    def __init__(self, loop: asyncio.AbstractEventLoop, limits: Optional[WsLimits] = None,
+                 on_job_wait: Optional[Callable[[float], None]] = None,
+                 on_state_dwell: Optional[Callable[[str, float], None]] = None,
+                 on_job_phases: Optional[Callable[[Dict[str, float]], None]] = None):
+        self.loop = loop
+        self.limits = limits
+        self.on_job_wait = on_job_wait
+        self.on_state_dwell = on_state_dwell
+        self.on_job_phases = on_job_phases
+        self.queue_stats: Dict[str, float] = {"depth": 0, "parked": 0, "oldest_wait_s": 0.0}
+        self._loop_thread: Optional[int] = None
+        self._subs: Dict[str, Set[Any]] = {}      # job_id|"*" -> {websocket}
+        self._by_ws: Dict[Any, Set[str]] = {}     # websocket -> {job_id}
+        self._current_job: Optional[str] = None   # งานล่าสุดที่ FSM เริ่ม (ไว้ผูก match event)
+        self._amr_job: Dict[str, Optional[str]] = {}   # amr id ("" = หุ่นเดี่ยว) -> งานที่หุ่นกำลังทำ
+        self.events = 0
+        self.sent = 0
+
+    # ---------- subscriptions (event loop เท่านั้น) ----------
+    def subscribe(self, ws, job_id: str):
+        self._subs.setdefault(job_id, set()).add(ws)
+        self._by_ws.setdefault(ws, set()).add(job_id)
+
+    def unsubscribe(self, ws, job_id: str):
+        subs = self._subs.get(job_id)
+        if subs is not None:
+            subs.discard(ws)
+            if not subs:
+                del self._subs[job_id]
+        self._by_ws.get(ws, set()).discard(job_id)
+
+    def drop(self, ws):
+        """client ปิด connection -> ลบทุก subscription"""
+        for job_id in list(self._by_ws.pop(ws, ())):
+            subs = self._subs.get(job_id)
+            if subs is not None:
+                subs.discard(ws)
+                if not subs:
+                    del self._subs[job_id]
+
+    def handle_frame(self, ws, data: Dict[str, Any]) -> Dict[str, Any]:
+        """frame subscribe/unsubscribe จาก client -> คืน reply"""
+        job_id = data.get("job_id")
+        if not isinstance(job_id, str) or not job_id:
+            return {"status": "error", "type": data.get("type"), "errors": ["'job_id' must be a non-empty string (or '*')"]}
+        if data.get("type") == "subscribe":
+            self.subscribe(ws, job_id)
+        else:
+            self.unsubscribe(ws, job_id)
+        return {"status": "ok", "type": data.get("type"), "job_id": job_id,
+                "subscriptions": sorted(self._by_ws.get(ws, ()))}
+
+    # ---------- MQTT side ----------
+    def on_mqtt(self, topic: str, data: Dict[str, Any]):
+        if self._loop_thread is None and self.loop.is_running():
+            try:
+                if asyncio.get_running_loop() is self.loop:
+                    self._loop_thread = threading.get_ident()
+            except RuntimeError:
+                pass
+        if threading.get_ident() == self._loop_thread:
+            self._dispatch(topic, data)
+        else:
+            self.loop.call_soon_threadsafe(self._dispatch, topic, data)
+
+    # ---------- fan-out (event loop) ----------
+    def _event_for(self, topic: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if topic == TOPIC_FSM_STATE_IN:
+            state = data.get("state")
+            job_id = data.get("job_id")
+            self._note_queue(data)
+            active = job_id if state not in ("IDLE", "DONE") else None
+            self._amr_job[data.get("amr") or ""] = active
+            if active:
+                self._current_job = active
+            elif self._current_job is not None and self._current_job not in self._amr_job.values():
+                self._current_job = next((j for j in self._amr_job.values() if j), None)
+            label = ERROR_LABEL if data.get("reason") in ERROR_REASONS else STATE_LABELS.get(state, state)
+            evt = {"type": "progress", "job_id": job_id, "state": state, "prev": data.get("prev"),
+                   "label": label, "goal_id": data.get("goal_id"), "op": data.get("op"),
+                   "queue_len": data.get("queue_len"), "ts": data.get("ts")}
+            if data.get("amr"):
+                evt["amr"] = data["amr"]
+            return evt
+        if topic == TOPIC_MATCH_IN:
+            latest = data.get("latest_job_ids") or {}
+            return {"type": "match", "job_id": latest.get("job_id") or self._current_job,
+                    "complete": data.get("complete"), "matched": data.get("matched"),
+                    "required": data.get("required"), "op": data.get("op"), "cart": data.get("cart"),
+                    "ts": data.get("ts")}
+        amr = parse_amr_topic(topic, MQTT_BASE)
+        if amr is None:
+            return None
+        amr_id, leaf = amr
+        job_id = self._amr_job.get(amr_id)
+        if leaf == "connected":
+            connected = bool(data.get("connected"))
+            evt = {"type": "amr", "job_id": job_id, "connected": connected, "ts": time.time()}
+            if not connected:
+                evt["label"] = ERROR_LABEL
+        else:
+            if job_id is None and not self._subs.get(ALL):
+                return None     # ไม่มีใครสนใจ -> ไม่ต้อง parse
+            evt = {"type": "amr", "job_id": job_id,
+                   "status": parse_arcl_line(data.get("line", "")), "ts": data.get("ts")}
+        if amr_id:
+            evt["amr"] = amr_id
+        return evt
+
+    def _note_queue(self, data: Dict[str, Any]):
+        for k, src in (("depth", "queue_len"), ("parked", "parked"), ("oldest_wait_s", "oldest_wait_s")):
+            if isinstance(data.get(src), (int, float)):
+                self.queue_stats[k] = data[src]
+        if self.on_job_wait is not None and isinstance(data.get("wait_s"), (int, float)):
+            self.on_job_wait(data["wait_s"])
+        if self.on_state_dwell is not None and data.get("prev") and isinstance(data.get("dwell_s"), (int, float)) \
+                and data.get("prev") != data.get("state"):
+            self.on_state_dwell(data["prev"], data["dwell_s"])
+        if self.on_job_phases is not None and data.get("prev") == "DONE" and isinstance(data.get("phases"), dict):
+            self.on_job_phases(data["phases"])
+
+    def _dispatch(self, topic: str, data: Dict[str, Any]):
+        evt = self._event_for(topic, data)
+        if evt is None:
+            return
+        targets = set(self._subs.get(ALL, ()))
+        if evt.get("job_id"):
+            targets |= self._subs.get(evt["job_id"], set())
+        if self.limits is not None:
+            targets = self.limits.evict_slow(targets)
+        if not targets:
+            return
+        text = json.dumps(evt, ensure_ascii=False)    # serialize ครั้งเดียว
+        websockets.broadcast(targets, text)
+        self.events += 1
+        self.sent += len(targets)
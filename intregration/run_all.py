@@ -1,10 +1,22 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, sys, json, time, signal, pathlib, subprocess, re
-from collections import deque
-from typing import Optional, Dict, Any, Set
+import os, sys, json, time, pathlib, threading, subprocess, collections
+from typing import Optional, Dict, Any, List, NamedTuple, Tuple
 import paho.mqtt.client as mqtt
+from state_store import StateBackend, get_backend   # STATE_BACKEND=json|sqlite
+from metrics import Histogram
+from snapshot_writer import SnapshotWriter
+from shm_state import get_shm
+from fsm_journal import FSM_SEEN_MAX, FSM_SEEN_SECS, FsmJournal
+from job_queue import JobQueue
+from supervisor import NodeSpec, Supervisor
+from ttl_cache import TTLCache
+from scheduler import Scheduler, Timer
+from goals_registry import get_registry
+from fleet import (AmrEndpoint, FLEET_POLICY, amr_topics, amr_wildcards, get_policy,
+                   goal_xy_from_entry, parse_amr_topic, parse_fleet)
+from arcl_parser import parse as arcl_parse
 
 # ---------- PATH/CONFIG ----------
 BASE_DIR = pathlib.Path(__file__).resolve().parent
@@ -13,32 +25,49 @@ LOG_DIR.mkdir(exist_ok=True)
 
 DATA_DIR        = pathlib.Path(os.path.expanduser("~/cart_ws/intregration/data"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
-STATE_PATH      = DATA_DIR / "state.json"       # main_server เขียนไฟล์นี้ (และฝัง op)
-FSM_STATE_PATH  = DATA_DIR / "fsm_state.json"   # orchestrator เขียนไฟล์นี้
+# current job และ FSM snapshot (orchestrator เขียน) อยู่ใน state_store backend ; main_server เขียนแค่ประวัติงาน
 
 MQTT_HOST  = os.getenv("MQTT_HOST", "127.0.0.1")
 MQTT_PORT  = int(os.getenv("MQTT_PORT", "1883"))
 MQTT_BASE  = os.getenv("MQTT_BASE", "smartcart")
+FSM_RECOVER = os.getenv("FSM_RECOVER", "1") == "1"   # 0 = ล้าง queue/current ทุกครั้งที่เริ่ม (แบบเดิม)
+FSM_STALL_SECS   = float(os.getenv("FSM_STALL_SECS", str(30 * 60)))   # ไม่มี update นานเกิน -> คืนงานเข้า queue
+SUP_REPORT_SECS  = float(os.getenv("SUP_REPORT_SECS", "60"))    # log uptime / restarts ของโหนดลูก
+FSM_SETTLE_SECS  = float(os.getenv("FSM_SETTLE_SECS", "0.3"))   # หลัง reset สถานี รอ LED/job/latest เคลียร์ก่อนเริ่มงานถัดไป
 
 TOPIC_JOB_LATEST = f"{MQTT_BASE}/job/latest"
+TOPIC_JOB_BATCH  = f"{MQTT_BASE}/job/batch"
+TOPIC_JOB_UNPARK = f"{MQTT_BASE}/job/unpark"   # {"qid": n} หรือ {} = ทั้งหมด
 TOPIC_TOGGLE     = f"{MQTT_BASE}/toggle_omron"
 TOPIC_MATCH      = f"{MQTT_BASE}/match"
 TOPIC_AMR_STATUS = f"{MQTT_BASE}/amr/status"
 TOPIC_AMR_CONN   = f"{MQTT_BASE}/amr/connected"
 TOPIC_SENSOR     = f"{MQTT_BASE}/sensor"
 TOPIC_LED_CMD    = f"{MQTT_BASE}/led/cmd"
+TOPIC_FSM_STATE  = f"{MQTT_BASE}/fsm/state"    # state transition (retained ล่าสุด) -> main_server push ให้ client
+TOPIC_LED_DESIRED = f"{MQTT_BASE}/led/desired"
+LED_TARGETS      = ("cuh1", "cuh2", "kit1", "kit2")
 
-# รายการโหนดที่จะสตาร์ท
-ORDER = [
-    ("led_actuator",     "led_actuator.py"),
-    ("main_server",      "main_server.py"),
-    ("match_id",         "match_id.py"),
-    ("communicate_AMR",  "communicate_AMR.py"),
-    ("main_sensor",      "main_sensor.py"),
+# โหนดลูก (communicate_AMR 1 process ต่อหุ่นใน AMR_FLEET) ; after = รอโหนดนั้น ready ก่อน
+FLEET = parse_fleet()
+
+def _amr_nodes():
+    for ep in FLEET:
+        if not ep.id:
+            yield NodeSpec("communicate_AMR", "communicate_AMR.py")
+        else:
+            yield NodeSpec(f"communicate_AMR-{ep.id}", "communicate_AMR.py",
+                           {"AMR_ID": ep.id, "AMR_HOST": ep.host, "AMR_PORT": str(ep.port)})
+
+NODES = [
+    NodeSpec("led_actuator",     "led_actuator.py"),
+    NodeSpec("main_server",      "main_server.py"),
+    NodeSpec("match_id",         "match_id.py"),
+    *_amr_nodes(),
+    NodeSpec("main_sensor",      "main_sensor.py", after=("match_id",)),   # sensor ต้องมีคนรับแล้ว
 ]
 
 # ---------- Process runner ----------
-PROCS = []
 def _log(name):
     return open(LOG_DIR / f"{name}.log", "ab", buffering=0)
 
@@ -56,32 +85,21 @@ def _now_fields():
     lt = time.localtime(ts)
     return ts, time.strftime("%Y-%m-%d", lt), time.strftime("%H:%M:%S", lt), time.strftime("%Y-%m-%dT%H:%M:%S%z", lt)
 
-def _safe_read_json(path: pathlib.Path) -> Dict[str, Any]:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-def _safe_write_json(path: pathlib.Path, obj: Dict[str, Any]):
-    tmp = str(path) + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, path)
-
-def _clear_file(path: pathlib.Path):
-    try:
-        _safe_write_json(path, {})
-    except Exception as e:
-        print(f"[INIT] cannot clear {path}: {e}")
+def _clear_state():
+    backend = get_backend()
+    fns = [backend.clear_current_job, backend.clear_fsm_snapshot]
+    shm = get_shm()
+    if shm is not None:
+        fns.append(lambda: shm.put_fsm(None))
+    for fn in fns:
+        try:
+            fn()
+        except Exception as e:
+            print(f"[INIT] cannot clear state ({backend.name}): {e}")
 
 def _at_least_one_present(cuh_ids, kit_ids) -> bool:
     return any(bool(x) for x in (cuh_ids or [])) or any(bool(x) for x in (kit_ids or []))
 
-def _parse_arrived_line(line: str) -> Optional[str]:
-    m = re.match(r"^Arrived at\s+(.+)$", line.strip(), re.I)
-    return m.group(1).strip() if m else None
-
 def _fill_two(vals):
     v = list(vals or [])
     v = v[:2] + [None, None]
@@ -90,6 +108,9 @@ def _fill_two(vals):
 # ---------- MQTT helper for retained clearing ----------
 def mqtt_connect():
     cli = mqtt.Client(client_id="run_all_bootstrap")
+    # retained frame ต่อ cart ที่ค้างจากรอบก่อน -> จำชื่อ cart ไว้ล้าง
+    cli.on_connect = lambda c, u, f, rc: c.subscribe(f"{TOPIC_LED_DESIRED}/+", qos=1)
+    cli.on_message = lambda c, u, msg: note_led_cart(msg.topic) if msg.payload else None
     cli.connect(MQTT_HOST, MQTT_PORT, 30)
     cli.loop_start()
     return cli
@@ -98,21 +119,36 @@ def mqtt_clear_retained(cli: mqtt.Client, topic: str):
     # publish payload ว่าง retain=True เพื่อล้าง retained ตามสเปค
     cli.publish(topic, b"", qos=1, retain=True)
 
+def led_clear_frame() -> str:
+    return json.dumps({"leds": {t: "skip" for t in LED_TARGETS}, "full": True, "ts": time.time()})
+
+# cart ที่มี retained frame ของตัวเอง (<led/desired>/<cart> จาก match_id) ; เรียนรู้จาก subscription
+# frozenset ที่ถูกแทนทั้งก้อน -> อ่านจาก scheduler thread ได้ระหว่าง paho thread เพิ่ม
+_led_carts: frozenset = frozenset()
+
+def note_led_cart(topic: str):
+    global _led_carts
+    cart = topic[len(TOPIC_LED_DESIRED) + 1:]
+    if cart and "/" not in cart and cart not in _led_carts:
+        _led_carts = _led_carts | {cart}
+
 def mqtt_led_clear(cli: mqtt.Client):
-    # เคลียร์ LED ทุกจุด (ถ้า led_actuator ต้องการ payload อื่น แจ้งได้)
-    for target in ("cuh1","cuh2","kit1","kit2"):
-        cli.publish(
-            TOPIC_LED_CMD,
-            json.dumps({"target": target, "result": "skip", "ts": time.time()}),
-            qos=1, retain=False
-        )
-
-def initial_cleanup():
+    # เคลียร์ LED ทุกจุดด้วย frame เดียว (retained = desired state)
+    cli.publish(TOPIC_LED_DESIRED, led_clear_frame(), qos=1, retain=True)
+    # frame ต่อ cart: ล้าง retained (payload ว่าง = ดับทุกดวง) กัน state เก่า replay หลัง reset/reconnect
+    for cart in sorted(_led_carts):
+        mqtt_clear_retained(cli, f"{TOPIC_LED_DESIRED}/{cart}")
+
+def initial_cleanup(keep_state: bool = False):
+    if keep_state:
+        # กู้งานจาก fsm journal -> คง current job + retained job/latest + LED ไว้
+        print("[INIT] recovered FSM from journal; keep state files and retained messages")
+        return
     cli = mqtt_connect()
     try:
         print("[INIT] clearing state files and retained messages...")
-        _clear_file(STATE_PATH)
-        _clear_file(FSM_STATE_PATH)
+        time.sleep(0.3)     # รอ retained ของ <led/desired>/+ มาถึง
+        _clear_state()
         mqtt_clear_retained(cli, TOPIC_JOB_LATEST)
         mqtt_led_clear(cli)
         time.sleep(0.3)
@@ -120,117 +156,176 @@ def initial_cleanup():
         cli.loop_stop(); cli.disconnect()
 
 # ---------- FSM ----------
+class Transition(NamedTuple):
+    guard: Optional[str]            # method(data) -> bool ; None = ผ่านเสมอ
+    action: Optional[str]           # method(data) ก่อนเปลี่ยน state -> field เพิ่มของ state event
+    next: Optional[str]             # None = อยู่ state เดิม
+    after: Optional[str] = None     # method(data) หลังเปลี่ยน state
+    reason: Optional[str] = None    # reason ของ state event
+
+class _Redirect(Exception):
+    """action ทำไม่สำเร็จ -> ยิง event อื่นแทน (เช่น dispatch_failed)"""
+    def __init__(self, event: str):
+        super().__init__(event)
+        self.event = event
+
+_T = Transition
+_BUSY = ("WAIT_MATCH", "WAIT_PHOTO_CLEAR", "EN_ROUTE", "AT_DEST", "DONE")
+_RESET_DISPATCH = (_T(None, None, "IDLE", "_after_reset", "dispatch_error"),)
+
+# (state, event) -> transitions (ลองตามลำดับ ตัวแรกที่ guard ผ่าน)
+FSM_TABLE: Dict[Tuple[str, str], Tuple[Transition, ...]] = {
+    ("IDLE", "assign"):                  (_T("_g_request", "_a_take", "WAIT_MATCH", "_after_take"),
+                                          _T(None, "_a_take", "WAIT_PHOTO_CLEAR", "_after_take")),
+    ("WAIT_MATCH", "match"):             (_T("_g_match_complete", "_a_dispatch", "EN_ROUTE", "_after_dispatch"),),
+    ("WAIT_PHOTO_CLEAR", "photo"):       (_T(None, "_a_photo", None),),
+    ("WAIT_PHOTO_CLEAR", "photo_timer"): (_T("_g_photo_clear_elapsed", "_a_dispatch", "EN_ROUTE", "_after_dispatch"),),
+    ("WAIT_MATCH", "dispatch_failed"):       _RESET_DISPATCH,
+    ("WAIT_PHOTO_CLEAR", "dispatch_failed"): _RESET_DISPATCH,
+    ("EN_ROUTE", "arrived"):             (_T(None, "_a_arrived", "AT_DEST"),),
+    ("AT_DEST", "arrived"):              (_T(None, "_a_arrived", "DONE", "_after_done"),),
+    ("DONE", "finish"):                  (_T(None, "_a_finish", "IDLE", "_after_finish"),),
+    **{(s, "stall"): (_T("_g_stalled", "_a_stall", "IDLE", "_after_reset", "watchdog_reset"),) for s in _BUSY},
+}
+
 class OrchestratorFSM:
     """
+    FSM ของหุ่น 1 ตัว (lane) ใน OrchestratorFleet — queue / กันซ้ำ / snapshot / journal อยู่ที่ fleet
+
     Auto mode:
       - Request: WAIT_MATCH → dispatch เมื่อ smartcart/match complete
       - Return : WAIT_PHOTO_CLEAR (photo 4 ตัวโล่งต่อเนื่อง ≥ 5s) → dispatch
     States:
-      IDLE, WAIT_MATCH, WAIT_PHOTO_CLEAR, EN_ROUTE, AT_DEST, RETURNING, DONE
+      IDLE, WAIT_MATCH, WAIT_PHOTO_CLEAR, EN_ROUTE, AT_DEST, DONE
+    transition ทั้งหมดอยู่ใน FSM_TABLE ; event เข้าทาง fire(event, data) เท่านั้น
+    WAIT_MATCH / WAIT_PHOTO_CLEAR ใช้สถานี (photo / match) -> มีได้ทีละ lane
+    state event มี dwell_s (เวลาใน state ก่อนหน้า) ; กลับ IDLE มี phases (เวลาต่อ state ของงาน + QUEUED)
     """
     PHOTO_NAMES_TARGET = ("barcode1", "barcode2", "rfidA", "rfidB")
 
-    def __init__(self, mqtt_cli: mqtt.Client):
-        self.cli = mqtt_cli
-        self.queue: deque = deque()     # jobs: {"op","goal_id","cuh_ids","kit_ids"}
+    def __init__(self, fleet: "OrchestratorFleet", amr: AmrEndpoint):
+        self.fleet = fleet
+        self.cli = fleet.cli
+        self.amr_id = amr.id
+        self.topics = amr_topics(amr.id, MQTT_BASE)
+        self.lock = fleet.lock
+        self.sched = fleet.sched
+        self._t_photo: Optional[Timer] = None
+        self._t_stall: Optional[Timer] = None
+        self.queue: JobQueue = fleet.queue  # queue ร่วมของ fleet
         self.current: Optional[Dict[str, Any]] = None
         self.state   = "IDLE"
-        self.last_update_ts = time.time()
+        self.last_update_ts = time.monotonic()     # monotonic: stall timer / dwell (ไม่เพี้ยนตาม NTP step)
+        self.state_since = self.last_update_ts
+        self._phases: Dict[str, float] = {}     # state -> วินาที ของงานปัจจุบัน
+        self._last_done: Optional[Dict[str, Any]] = None
 
         self.match_info = {
             "required": None, "matched": None, "complete": False,
             "seen": {}, "op": None, "goal_id": None,
         }
 
-        self.photo_state: Dict[str, int] = {}
-        self.photo_clear_since: Optional[float] = None
+        self.photo_state: Dict[str, int] = fleet.photo_state    # sensor ของสถานี (ร่วมกัน)
+        self.photo_clear_since: Optional[float] = None      # wall clock (snapshot "clear_since")
+        self._photo_clear_mono: Optional[float] = None      # monotonic ของเวลาเดียวกัน (timer / guard)
         self.photo_clear_secs_required = 5.0
 
-        # กันซ้ำ
-        self._seen_jobs: Set[str] = set()
-        self._seen_capacity = 100
-        self._last_done_fingerprint: Optional[str] = None
-        self._last_done_ts: float = 0.0
+        # สำหรับ policy
+        self.connected: Optional[bool] = None
+        self.pose: Optional[Tuple[float, float]] = None
+        self.idle_since = time.time()
+        self.busy_since = self.idle_since
+        self.jobs_done = 0
+        self.busy_secs = 0.0
+
+    def _tag(self) -> str:
+        return f"[FSM:{self.amr_id}]" if self.amr_id else "[FSM]"
 
-    def _fingerprint(self, job: Dict[str, Any]) -> str:
-        return json.dumps(
-            {"op": job.get("op"),
-             "goal_id": job.get("goal_id"),
-             "cuh_ids": job.get("cuh_ids"),
-             "kit_ids": job.get("kit_ids")},
-            sort_keys=True
-        )
+    def _j(self, kind: str, **fields):
+        if self.amr_id:
+            fields["amr"] = self.amr_id
+        self.fleet._j(kind, **fields)
 
     def _persist(self):
-        ts, d, t, iso = _now_fields()
-        out = {
-            "ts": ts, "date": d, "time": t, "iso": iso,
-            "state": self.state,
-            "current": self.current,
-            "queue_len": len(self.queue),
-            "match": self.match_info,
-            "photo": {
-                "state": self.photo_state,
-                "clear_since": self.photo_clear_since,
-                "required_secs": self.photo_clear_secs_required
-            },
-            "mode": "auto",
+        self.fleet._persist()
+
+    def lane_snapshot(self) -> Dict[str, Any]:
+        return {"id": self.amr_id, "state": self.state,
+                "current": dict(self.current) if self.current else None,
+                "connected": self.connected, "pose": self.pose, "jobs_done": self.jobs_done}
+
+    def restore(self, st: Dict[str, Any]):
+        """lane state จาก FsmJournal.recover() (เรียกก่อน MQTT connect) ; คืนงานที่ต้องกลับเข้า queue"""
+        self.current = st.get("current")
+        state = st.get("state") or "IDLE"
+        if self.current is not None and state == "IDLE":
+            # crash ระหว่าง take กับ transition -> กลับเข้า queue
+            job, self.current = self.current, None
+            return job
+        if st.get("match"):
+            self.match_info = st["match"]
+        self.last_update_ts = time.monotonic()
+        self.state = "IDLE"
+        self._set_state(state, reason="recovered")
+        print(f"{self._tag()} restored state={self.state} current={self.current}")
+        if state == "DONE":
+            # crash ระหว่าง journal "state DONE" กับ finish (_after_done) -> ปิดงานต่อ (ห้ามรอ stall: จะ requeue งานที่เสร็จแล้ว)
+            self.sched.call_later(0, self._on_recovered_done, "recovered_finish")
+        return None
+
+    def _set_state(self, new: str, reason: Optional[str] = None, extra: Optional[Dict[str, Any]] = None):
+        """เปลี่ยน state + publish transition (ใช้ job ปัจจุบันเป็นเจ้าของ event)"""
+        prev, self.state = self.state, new
+        if prev == new and not reason:
+            return
+        now, mono = time.time(), time.monotonic()
+        dwell = mono - self.state_since
+        if prev != new:
+            self._j("state", s=new)
+            self.last_update_ts = mono          # นับ stall จากเวลาเข้า state
+            self.state_since = mono
+            if prev != "IDLE":
+                self._phases[prev] = self._phases.get(prev, 0.0) + dwell
+        self._sync_timers()
+        job = self.current or {}
+        evt = {
+            "state": new, "prev": prev, "reason": reason,
+            "job_id": job.get("job_id"), "goal_id": job.get("goal_id"), "op": job.get("op"),
+            "queue_len": len(self.queue), "parked": len(self.queue.parked),
+            "oldest_wait_s": round(self.queue.oldest_wait(), 1), "dwell_s": dwell, "ts": now,
         }
-        _safe_write_json(FSM_STATE_PATH, out)
+        if new == "IDLE" and self._phases:
+            evt["phases"] = dict(self._phases)
+            self._phases = {}
+        if extra:
+            evt.update(extra)
+        if self.amr_id:
+            evt["amr"] = self.amr_id
+        try:
+            self.cli.publish(TOPIC_FSM_STATE, json.dumps(evt, ensure_ascii=False), qos=0, retain=True)
+        except Exception as e:
+            print(f"{self._tag()} publish state error: {e}")
+
+    # ---- table-driven dispatch
+    def fire(self, event: str, data: Any = None) -> bool:
+        """หา transition (state, event) จาก FSM_TABLE -> guard -> action -> next state -> after ; คืน True ถ้ามี transition"""
+        for t in FSM_TABLE.get((self.state, event), ()):
+            if t.guard is not None and not getattr(self, t.guard)(data):
+                continue
+            t0 = time.perf_counter()
+            try:
+                extra = getattr(self, t.action)(data) if t.action is not None else None
+            except _Redirect as r:
+                return self.fire(r.event, data)
+            if t.next is not None:
+                self._set_state(t.next, reason=t.reason, extra=extra)
+            if t.after is not None:
+                getattr(self, t.after)(data)
+            self.fleet.m_fire.observe(time.perf_counter() - t0, event=event)
+            return True
+        return False
 
     # ---- MQTT events
-    def on_job_latest(self, payload: Dict[str, Any]):
-        """
-        NOTE: main_server ของคุณ publish job/latest 'ไม่มี op'
-        และฝัง op ลงใน state.json → เราอ่าน 'op' จาก STATE_PATH
-        """
-        st = _safe_read_json(STATE_PATH)
-        latest = st.get("latest_job_ids") or {}
-
-        op   = latest.get("op")
-        goal = latest.get("goal_id") or payload.get("goal_id")
-        cuh2 = _fill_two(latest.get("cuh_ids") or ([latest.get("cuh_id")] if latest.get("cuh_id") else []))
-        kit2 = _fill_two(latest.get("kit_ids") or ([latest.get("kit_id")] if latest.get("kit_id") else []))
-
-        if op not in ("Request", "Return"):
-            print(f"[FSM] ignore job: invalid op in state.json (op={op})")
-            return
-        if not goal:
-            print("[FSM] ignore job: missing goal_id")
-            return
-        if not _at_least_one_present(cuh2, kit2):
-            print("[FSM] ignore job: both CUH and KIT empty")
-            return
-
-        # ใช้ ts จาก payload ถ้ามี (main_server ใส่ให้ใน publish_job_topics) — ถ้าไม่มี จะ fallback เป็น now
-        ts_in = payload.get("ts") if isinstance(payload, dict) else None
-        if not isinstance(ts_in, (int, float)):
-            ts_in = time.time()
-
-        job = {"op": op, "goal_id": goal, "cuh_ids": cuh2, "kit_ids": kit2}
-        fp  = self._fingerprint(job)
-        key = f"{fp}|{int(ts_in)}"
-
-        if key in self._seen_jobs:
-            print("[FSM] ignore job: duplicate key (already seen)")
-            return
-
-        if self._last_done_fingerprint and fp == self._last_done_fingerprint and ts_in <= self._last_done_ts + 1e-6:
-            print("[FSM] ignore job: same as last done (retained duplicate)")
-            return
-
-        self._seen_jobs.add(key)
-        if len(self._seen_jobs) > self._seen_capacity:
-            self._seen_jobs = set(list(self._seen_jobs)[-self._seen_capacity:])
-
-        self.queue.append(job)
-        print(f"[FSM] queued job: {job} (qlen={len(self.queue)})")
-
-        if self.state == "IDLE":
-            self._prepare()
-
-        self._persist()
-
     def on_match(self, payload: Dict[str, Any]):
         latest = payload.get("latest_job_ids") or {}
         op = payload.get("op") or latest.get("op")
@@ -245,13 +340,10 @@ class OrchestratorFSM:
             "op": op,
             "goal_id": goal,
         }
-        self.last_update_ts = time.time()
+        self.last_update_ts = time.monotonic()
+        self._j("match", m=self.match_info)
         self._persist()
-
-        if self.current and self.state == "WAIT_MATCH":
-            if op == "Request" and complete and goal == self.current.get("goal_id"):
-                print(f"[FSM] Request match complete for goal={goal} → dispatch now")
-                self._dispatch_current()
+        self.fire("match", self.match_info)
 
     def on_sensor(self, payload: Dict[str, Any]):
         if not isinstance(payload, dict): return
@@ -263,78 +355,270 @@ class OrchestratorFSM:
         except Exception:
             state = 1
         self.photo_state[name] = state
-        self.last_update_ts = time.time()
-
-        if self.current and self.current.get("op") == "Return" and self.state == "WAIT_PHOTO_CLEAR":
-            self._check_photo_clear_and_maybe_start_timer()
-        self._persist()
+        self.last_update_ts = time.monotonic()
+        self.fire("photo")
 
     def on_amr_status(self, payload: Dict[str, Any]):
         line = (payload or {}).get("line", "")
-        if not line or not self.current:
+        if not line:
+            return
+        rec = arcl_parse(line)
+        if rec.x is not None and rec.y is not None:
+            self.pose = (rec.x, rec.y)
+        if not self.current:
             return
-        arr = _parse_arrived_line(line)
-        if arr:
-            if self.state in ("DISPATCHED", "EN_ROUTE"):
-                self.state = "AT_DEST"
-                print(f"[FSM] arrived destination: '{arr}'")
-            elif self.state in ("AT_DEST", "RETURNING"):
-                self.state = "DONE"
-                print(f"[FSM] arrived dropoff/home: '{arr}' → DONE")
-                self._finish_current()
+        if rec.kind == "arrived" and rec.goal:
+            self.fire("arrived", rec.goal)
             self._persist()
-        self.last_update_ts = time.time()
+        self.last_update_ts = time.monotonic()
+
+    def on_amr_connected(self, connected: bool):
+        print(f"{self._tag()} AMR connected={connected}")
+        self.connected = connected
+        if connected:
+            self.fleet.kick()
+
+    def begin(self, job: Dict[str, Any]):
+        """fleet มอบงาน (pop จาก queue แล้ว) ให้หุ่นตัวนี้"""
+        self.fire("assign", job)
+
+    # ---- guards
+    def _g_request(self, job: Dict[str, Any]) -> bool:
+        return job.get("op") == "Request"
+
+    def _g_match_complete(self, m: Dict[str, Any]) -> bool:
+        return bool(self.current and m.get("op") == "Request" and m.get("complete")
+                    and m.get("goal_id") == self.current.get("goal_id"))
+
+    def _g_photo_clear_elapsed(self, _=None) -> bool:
+        return (self._photo_clear_mono is not None
+                and time.monotonic() - self._photo_clear_mono >= self.photo_clear_secs_required)
+
+    def _g_stalled(self, _=None) -> bool:
+        return self.current is not None and time.monotonic() - self.last_update_ts >= FSM_STALL_SECS
+
+    # ---- actions (ก่อนเปลี่ยน state ; คืน field เพิ่มของ state event)
+    def _a_take(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        self.current = job
+        self._j("take", qid=job.get("qid"))
+        # current job = งานที่รับจริง (ไม่ใช่งานล่าสุดที่ main_server ได้รับ) ; คิวเดียวกับ clear -> ลำดับไม่สลับ
+        self.sched.call_later(0, lambda: self._set_current_job(job), "set_current_job")
+        self.busy_since = time.time()
+        wait = self.busy_since - job.get("enq_ts", self.busy_since)
+        self._phases = {"QUEUED": wait}
+        return {"wait_s": round(wait, 3), "attempts": job.get("attempts", 0), "priority": job.get("priority")}
+
+    def _a_photo(self, _=None):
+        self._check_photo_clear_and_maybe_start_timer()
+
+    def _a_dispatch(self, _=None):
+        payload = {
+            "reason": "fsm_dispatch",
+            "goal_id": self.current["goal_id"],
+            "op": self.current["op"],
+            "ts": time.time(),
+        }
+        topic = self.topics["toggle"]
+        try:
+            self.cli.publish(topic, json.dumps(payload, ensure_ascii=False), qos=1, retain=False)
+        except Exception as e:
+            print(f"{self._tag()} dispatch error:", e)
+            raise _Redirect("dispatch_failed")
+        print(f"{self._tag()} dispatched ({self.state}) -> {topic}: {payload}")
 
-    # ---- core
-    def _prepare(self):
-        if self.current or not self.queue: return
-        self.current = self.queue.popleft()
-        op = self.current["op"]
+    def _a_arrived(self, goal: str):
+        print(f"{self._tag()} arrived '{goal}' ({self.state})")
 
-        if op == "Request":
-            self.state = "WAIT_MATCH"
-            print(f"[FSM] WAIT_MATCH (Request) goal={self.current['goal_id']}")
-        else:
-            self.state = "WAIT_PHOTO_CLEAR"
-            self.photo_clear_since = None
-            print(f"[FSM] WAIT_PHOTO_CLEAR (Return) goal={self.current['goal_id']}")
+    def _a_finish(self, _=None):
+        done, self._last_done = self.current, self.current
+        self.fleet.note_done(done)
+        self.current = None
+        self.jobs_done += 1
+        self._went_idle()
+        self._j("done", fp=self.fleet._last_done_fingerprint, ts=self.fleet._last_done_ts)
+
+    def _a_stall(self, _=None):
+        print(f"{self._tag()} watchdog: no updates for {int(time.monotonic() - self.last_update_ts)}s → reset to IDLE")
+
+    # ---- after (หลังเปลี่ยน state)
+    def _after_take(self, job: Dict[str, Any]):
+        print(f"{self._tag()} {self.state} ({job['op']}) goal={job['goal_id']}")
+        if self.state == "WAIT_PHOTO_CLEAR":
+            self.photo_clear_since = self._photo_clear_mono = None
             self._check_photo_clear_and_maybe_start_timer()
         self._persist()
 
+    def _after_dispatch(self, _=None):
+        self._persist()
+        self.fleet.kick()   # สถานีว่างแล้ว -> หุ่นตัวอื่นรับงานถัดไปได้
+
+    def _after_reset(self, _=None):
+        # dispatch error / watchdog: งานกลับเข้าคิว
+        self._requeue()
+        self.photo_clear_since = self._photo_clear_mono = None
+        self._persist()
+        self.fleet.kick()
+
+    def _after_done(self, _=None):
+        self.fire("finish")
+
     def _check_photo_clear_and_maybe_start_timer(self):
         all_present = all((n in self.photo_state) for n in self.PHOTO_NAMES_TARGET)
         all_clear   = all_present and all(self.photo_state.get(n,0)==1 for n in self.PHOTO_NAMES_TARGET)
         if all_clear:
             if self.photo_clear_since is None:
-                self.photo_clear_since = time.time()
-                print("[FSM] photo all-clear → start 5s timer")
+                self.photo_clear_since, self._photo_clear_mono = time.time(), time.monotonic()
+                print(f"{self._tag()} photo all-clear → start 5s timer")
+                self._cancel("_t_photo")
+                self._t_photo = self.sched.call_at(self._photo_clear_mono + self.photo_clear_secs_required,
+                                                   self._on_photo_timer, "photo_clear")
         else:
             if self.photo_clear_since is not None:
-                print("[FSM] photo became blocked again → reset timer")
-            self.photo_clear_since = None
+                print(f"{self._tag()} photo became blocked again → reset timer")
+            self.photo_clear_since = self._photo_clear_mono = None
+            self._cancel("_t_photo")
+
+    def _requeue(self):
+        """งานกลับเข้าคิว (ไม่แซงหัวคิว: attempts+1 ถูกดันไปหลัง) ; ครบ JOBQ_MAX_ATTEMPTS -> parked"""
+        job = self.current
+        queued = self.queue.requeue(job)
+        self.current = None
+        self._j("requeue", attempts=job["attempts"], parked=not queued)
+        if not queued:
+            print(f"{self._tag()} job parked after {job['attempts']} attempts: {job} "
+                  f"(publish {TOPIC_JOB_UNPARK} to retry)")
+        self._sync_timers()
+        self._went_idle()
+
+    def _went_idle(self):
+        now = time.time()
+        self.busy_secs += now - self.busy_since
+        self.idle_since = now
+
+    def _after_finish(self, _=None):
+        self.photo_clear_since = self._photo_clear_mono = None
+        print(f"{self._tag()} job done: {self._last_done}")
+        self._persist()
 
-    def _dispatch_current(self):
-        if not self.current: return
-        payload = {
-            "reason": "fsm_dispatch",
-            "goal_id": self.current["goal_id"],
-            "op": self.current["op"],
-            "ts": time.time(),
-        }
+        # ---- RESET หลังงานจบ (เฉพาะเมื่อสถานีไม่มีงานอื่นกำลังเตรียม) ----
+        # callback ของ MQTT ไม่หลับ / ไม่แตะดิสก์: publish แค่เข้าคิวของ paho, ไฟล์ไปเขียนบน scheduler
+        # งานถัดไปเริ่มหลัง FSM_SETTLE_SECS (แทน time.sleep)
+        if self.fleet.station_busy():
+            self.fleet.kick()
+            return
         try:
-            self.cli.publish(TOPIC_TOGGLE, json.dumps(payload, ensure_ascii=False), qos=1, retain=False)
-            print(f"[FSM] dispatched -> {TOPIC_TOGGLE}: {payload}")
-            self.state = "EN_ROUTE"
+            if not any(l.current for l in self.fleet.lanes):
+                self.fleet.snap.clear()         # write-behind (ลำดับเดียวกับ snapshot)
+                self.fleet._snap_state = None
+            # เคลียร์ retained ของ job/latest + LED (frame เดียว)
+            self.cli.publish(TOPIC_JOB_LATEST, b"", qos=1, retain=True)
+            mqtt_led_clear(self.cli)
         except Exception as e:
-            print("[FSM] dispatch error:", e)
-            self.queue.appendleft(self.current)
-            self.current = None
-            self.state = "IDLE"
-        finally:
-            self._persist()
+            print(f"{self._tag()} reset-after-done error: {e}")
+        self.sched.call_later(0, self._clear_current_job, "clear_current_job")
+        self.fleet.settle(FSM_SETTLE_SECS)
 
-    def _finish_current(self):
-        done = self.current
+    def _set_current_job(self, job: Dict[str, Any]):
+        # scheduler thread: backend + shm (match_id อ่านจากที่นี่)
+        try:
+            self.fleet.backend.set_current_job(job)
+        except Exception as e:
+            print(f"{self._tag()} set current job error: {e}")
+
+    def _clear_current_job(self):
+        # scheduler thread (ไม่แตะ state ของ FSM -> ไม่ต้องถือ lock)
+        try:
+            self.fleet.backend.clear_current_job()
+        except Exception as e:
+            print(f"{self._tag()} clear current job error: {e}")
+
+    # ---- timers (scheduler thread)
+    def _cancel(self, attr: str):
+        t = getattr(self, attr)
+        if t is not None:
+            t.cancel()
+            setattr(self, attr, None)
+
+    def _sync_timers(self):
+        """photo timer มีได้เฉพาะ WAIT_PHOTO_CLEAR ; stall timer มีเมื่อมี current"""
+        if self.state != "WAIT_PHOTO_CLEAR":
+            self._cancel("_t_photo")
+        if self.current is None:
+            self._cancel("_t_stall")
+        elif self._t_stall is None:
+            self._t_stall = self.sched.call_at(self.last_update_ts + FSM_STALL_SECS, self._on_stall_timer, "stall")
+
+    def _on_photo_timer(self):
+        # Return: all-clear ≥ N วินาที → dispatch
+        with self.lock:
+            self._t_photo = None
+            self.fire("photo_timer")
+
+    def _on_recovered_done(self):
+        with self.lock:
+            if self.state == "DONE":
+                self.fire("finish")
+
+    def _on_stall_timer(self):
+        with self.lock:
+            self._t_stall = None
+            if not self.fire("stall"):
+                self._sync_timers()     # มี update ระหว่างนั้น -> ตั้งใหม่จาก update ล่าสุด
+
+class OrchestratorFleet:
+    """
+    หุ่นหลายตัว (AMR_FLEET) ใช้ queue เดียว:
+    - รับงาน (job/latest, job/batch) + กันซ้ำ -> queue
+    - kick(): สถานีว่าง + มีหุ่นว่าง -> policy (FLEET_POLICY) เลือกหุ่นให้งานหัว queue
+      หุ่นที่รู้ว่า disconnected จะไม่ได้รับงาน
+    - หุ่นเดี่ยว (ไม่ตั้ง AMR_FLEET) = พฤติกรรมเดิม: รับงานถัดไปเมื่องานก่อนหน้าจบ
+    """
+    PREP_STATES = ("WAIT_MATCH", "WAIT_PHOTO_CLEAR")
+
+    def __init__(self, mqtt_cli: mqtt.Client, endpoints: Optional[List[AmrEndpoint]] = None,
+                 snap: Optional[SnapshotWriter] = None, journal: Optional[FsmJournal] = None,
+                 sched: Optional[Scheduler] = None, policy: Optional[str] = None,
+                 backend: Optional[StateBackend] = None):
+        self.cli = mqtt_cli
+        self.journal = journal
+        # journal: บรรทัดที่ encode แล้ว (line, snapshot line | None) รอเขียนบน scheduler thread
+        self._j_buf: "collections.deque[Tuple[str, Optional[str]]]" = collections.deque()
+        self._j_since_snap = journal.stats()["since_snap"] if journal is not None else 0
+        self.backend = backend or get_backend()
+        # MQTT thread + scheduler thread เข้ามาพร้อมกันได้ -> lock ทุก event / timer
+        self.lock = threading.RLock()
+        self.sched = sched or Scheduler().start()
+        # write-behind (ไม่เขียนดิสก์ใน MQTT callback) ; region fsm ใน shared memory เขียนทันที
+        self.snap = snap or SnapshotWriter(self.backend, shm=get_shm()).start()
+        # เวลา CPU ต่อ transition (guard + action + state event + after) แยกตาม event
+        self.m_fire = Histogram("smartcart_fsm_transition_seconds", "FSM transition handling time",
+                                buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05),
+                                labels=("event",))
+        self._snap_state: Optional[Tuple[str, ...]] = None
+        self._settle_until = 0.0         # หลัง reset สถานี (FSM_SETTLE_SECS) ; time.monotonic()
+        self.queue = JobQueue()         # jobs: {"op","goal_id","cuh_ids","kit_ids", +priority/enq_ts/attempts/qid}
+        self.photo_state: Dict[str, int] = {}
+        self.policy_name = policy or FLEET_POLICY
+        self.policy = get_policy(self.policy_name)
+
+        self.lanes: List[OrchestratorFSM] = [OrchestratorFSM(self, ep) for ep in (endpoints or parse_fleet())]
+        self.by_id: Dict[str, OrchestratorFSM] = {l.amr_id: l for l in self.lanes}
+
+        # กันซ้ำ
+        # key ที่เคยเห็น: เรียงตามลำดับเข้า หมดอายุตาม FSM_SEEN_SECS / ตัดตัวเก่าสุดเมื่อเกิน FSM_SEEN_MAX
+        self._seen_jobs = TTLCache(FSM_SEEN_MAX, FSM_SEEN_SECS)
+        self._last_done_fingerprint: Optional[str] = None
+        self._last_done_ts: float = 0.0
+
+    @staticmethod
+    def _fingerprint(job: Dict[str, Any]) -> str:
+        """key ของเนื้องาน 'Request|DOT..|C1,C2|K1,' (string คงที่ข้าม restart -> เก็บใน journal ได้)"""
+        cuh = job.get("cuh_ids") or ()
+        kit = job.get("kit_ids") or ()
+        return "|".join((job.get("op") or "", job.get("goal_id") or "",
+                         ",".join(c or "" for c in cuh), ",".join(k or "" for k in kit)))
+
+    def note_done(self, done: Optional[Dict[str, Any]]):
         # เก็บ fingerprint + ts ของงานล่าสุดที่เสร็จ เพื่อกัน retained/ซ้ำ
         try:
             self._last_done_fingerprint = self._fingerprint(done) if done else None
@@ -342,82 +626,271 @@ class OrchestratorFSM:
             self._last_done_fingerprint = None
         self._last_done_ts = time.time()
 
-        self.current = None
-        self.state = "IDLE"
-        self.photo_clear_since = None
-        print(f"[FSM] job done: {done}")
-        self._persist()
-
-        # ---- RESET หลังงานจบ ----
+    # ---- journal (กู้ queue/current/state หลัง restart)
+    def _j(self, kind: str, **fields):
+        """
+        encode ตอนนี้ (ใต้ lock: ลำดับ/เนื้อหาตรงกับ state) ; เขียน + compaction (fsync) บน scheduler thread
+        -> MQTT callback ไม่แตะดิสก์
+        """
+        if self.journal is None:
+            return
         try:
-            _safe_write_json(STATE_PATH, {})
-            _safe_write_json(FSM_STATE_PATH, {})
-            # เคลียร์ retained ของ job/latest
-            self.cli.publish(TOPIC_JOB_LATEST, b"", qos=1, retain=True)
-            # เคลียร์ LED
-            for target in ("cuh1","cuh2","kit1","kit2"):
-                self.cli.publish(
-                    TOPIC_LED_CMD,
-                    json.dumps({"target":target,"result":"skip","ts":time.time()}),
-                    qos=1, retain=False
-                )
+            line = self.journal.encode(kind, **fields)
+            snap = None
+            self._j_since_snap += 1
+            if self._j_since_snap >= self.journal.compact_every:
+                snap = self.journal.encode("snap", **self._journal_state())     # state หลัง record นี้
+                self._j_since_snap = 1
         except Exception as e:
-            print(f"[FSM] reset-after-done error: {e}")
+            print(f"[FSM] journal error: {e}")
+            return
+        self._j_buf.append((line, snap))
+        if len(self._j_buf) == 1:
+            self.sched.call_later(0, self.flush_journal, "journal")
+
+    def flush_journal(self):
+        """scheduler thread (หรือ main thread ตอนปิด) ; เขียนตามลำดับที่ encode"""
+        while self._j_buf:
+            line, snap = self._j_buf.popleft()
+            try:
+                self.journal.append_line(line)
+                if snap is not None:
+                    self.journal.write_snapshot(snap)
+            except Exception as e:
+                print(f"[FSM] journal error: {e}")
+
+    def _journal_state(self) -> Dict[str, Any]:
+        return {
+            "queue": self.queue.items(),
+            "parked": list(self.queue.parked),
+            "lanes": {l.amr_id: {"current": l.current, "state": l.state, "match": l.match_info} for l in self.lanes},
+            "seen": self._seen_jobs.keys(),
+            "last_done_fp": self._last_done_fingerprint, "last_done_ts": self._last_done_ts,
+        }
 
-        time.sleep(0.3)
-        self._prepare()
+    def restore(self, st: Dict[str, Any]):
+        """state จาก FsmJournal.recover() (เรียกก่อน MQTT connect)"""
+        self.queue.restore(st.get("queue") or [], st.get("parked"))
+        for key in st.get("seen") or []:
+            self._seen_jobs.put(key)      # อายุนับใหม่จากตอนกู้
+        self._last_done_fingerprint = st.get("last_done_fp")
+        self._last_done_ts = st.get("last_done_ts") or 0.0
+        for amr_id, lst in (st.get("lanes") or {}).items():
+            lane = self.by_id.get(amr_id)
+            if lane is None:
+                # หุ่นถูกถอดออกจาก AMR_FLEET -> งานของมันกลับเข้า queue (ลำดับเดิม)
+                job = lst.get("current")
+            else:
+                job = lane.restore(lst)
+            if job is not None:
+                self.queue.restore([job])
+        print(f"[FSM] restored qlen={len(self.queue)} parked={len(self.queue.parked)} lanes={[(l.amr_id, l.state) for l in self.lanes]}")
+        self.kick()
+        self._persist()
 
-    # ---- watchdog
-    def watchdog_tick(self):
-        # Return: all-clear ≥ N วินาที → dispatch
-        if self.current and self.current.get("op") == "Return" and self.state == "WAIT_PHOTO_CLEAR":
-            if self.photo_clear_since is not None:
-                elapsed = time.time() - self.photo_clear_since
-                if elapsed >= self.photo_clear_secs_required:
-                    print(f"[FSM] photo clear for {elapsed:.1f}s ≥ {self.photo_clear_secs_required}s → dispatch Return")
-                    self._dispatch_current()
-
-        # reset ถ้านิ่งเกินไป
-        idle_secs = time.time() - self.last_update_ts
-        if self.current and idle_secs > 30*60:
-            print(f"[FSM] watchdog: no updates for {int(idle_secs)}s → reset to IDLE")
-            self.queue.appendleft(self.current)
-            self.current = None
-            self.state = "IDLE"
-            self.photo_clear_since = None
-            self._persist()
+    def _persist(self):
+        """ส่ง snapshot ให้ SnapshotWriter (copy ตื้น เพราะเขียนจาก thread อื่น) ; เปลี่ยน state -> flush ทันที"""
+        main = self.station_lane() or next((l for l in self.lanes if l.current), self.lanes[0])
+        ts, d, t, iso = _now_fields()
+        out = {
+            "ts": ts, "date": d, "time": t, "iso": iso,
+            "state": main.state,
+            "current": dict(main.current) if main.current else None,
+            "queue_len": len(self.queue),
+            "queue": self.queue.stats(),
+            "parked": [{"qid": j.get("qid"), "job_id": j.get("job_id"), "goal_id": j.get("goal_id"),
+                        "op": j.get("op"), "attempts": j.get("attempts")} for j in self.queue.parked],
+            "match": dict(main.match_info),
+            "photo": {
+                "state": dict(self.photo_state),
+                "clear_since": main.photo_clear_since,
+                "required_secs": main.photo_clear_secs_required
+            },
+            "mode": "auto",
+            "policy": self.policy_name,
+            "amrs": [l.lane_snapshot() for l in self.lanes],
+        }
+        states = tuple(l.state for l in self.lanes)
+        urgent = states != self._snap_state
+        self._snap_state = states
+        self.snap.offer(out, urgent=urgent)
+
+    # ---- assignment
+    def station_lane(self) -> Optional[OrchestratorFSM]:
+        return next((l for l in self.lanes if l.state in self.PREP_STATES), None)
+
+    def station_busy(self) -> bool:
+        return self.station_lane() is not None
+
+    def settle(self, secs: float):
+        """สถานีเพิ่ง reset -> งดมอบงาน secs วินาที แล้ว kick จาก scheduler"""
+        self._settle_until = time.monotonic() + secs
+        def _kick():
+            with self.lock:
+                self.kick()
+                self._persist()
+        self.sched.call_at(self._settle_until, _kick, "settle_kick")
+
+    def kick(self):
+        """สถานีว่าง + มีงาน + มีหุ่นว่าง -> มอบงานหัว queue ให้หุ่นที่ policy เลือก"""
+        if not self.queue or self.station_busy() or time.monotonic() < self._settle_until:
+            return
+        idle = [l for l in self.lanes if l.current is None and l.state == "IDLE" and l.connected is not False]
+        if not idle:
+            return
+        job = self.queue.peek()
+        lane = idle[0] if len(idle) == 1 else self.policy(job, idle, _goal_xy)
+        self.queue.pop()
+        if len(self.lanes) > 1:
+            print(f"[FLEET] {self.policy_name}: job {job.get('job_id') or job.get('goal_id')} -> {lane.amr_id} "
+                  f"(idle={[l.amr_id for l in idle]})")
+        lane.begin(job)
+
+    # ---- MQTT events
+    def on_job_latest(self, payload: Dict[str, Any]):
+        """main_server publish job/latest พร้อม op -> ใช้ payload ได้ทันที (current job ใน backend เป็นของ FSM เอง)"""
+        latest = payload if isinstance(payload, dict) else {}
+
+        op   = latest.get("op")
+        goal = latest.get("goal_id")
+        cuh2 = _fill_two(latest.get("cuh_ids") or ([latest.get("cuh_id")] if latest.get("cuh_id") else []))
+        kit2 = _fill_two(latest.get("kit_ids") or ([latest.get("kit_id")] if latest.get("kit_id") else []))
+
+        if op not in ("Request", "Return"):
+            print(f"[FSM] ignore job: invalid op (op={op})")
+            return
+        if not goal:
+            print("[FSM] ignore job: missing goal_id")
+            return
+        if not _at_least_one_present(cuh2, kit2):
+            print("[FSM] ignore job: both CUH and KIT empty")
+            return
+
+        # ใช้ ts จาก payload ถ้ามี (main_server ใส่ให้ใน publish_job_topics) — ถ้าไม่มี จะ fallback เป็น now
+        ts_in = payload.get("ts") if isinstance(payload, dict) else None
+        if not isinstance(ts_in, (int, float)):
+            ts_in = time.time()
+
+        job = {"op": op, "goal_id": goal, "cuh_ids": cuh2, "kit_ids": kit2}
+        if latest.get("job_id"):
+            job["job_id"] = latest["job_id"]
+        if isinstance(latest.get("priority"), int):
+            job["priority"] = latest["priority"]   # ไม่มี -> ตาม op (Request ก่อน Return)
+        fp  = self._fingerprint(job)
+        # งานจาก batch มี job_id ไม่ซ้ำ (ts เดียวกันทั้ง batch) -> ใช้เป็น key
+        key = f"id|{job['job_id']}" if job.get("job_id") else f"{fp}|{int(ts_in)}"
+
+        if self._seen_jobs.get(key) is not None:
+            print("[FSM] ignore job: duplicate key (already seen)")
+            return
+
+        if self._last_done_fingerprint and fp == self._last_done_fingerprint and ts_in <= self._last_done_ts + 1e-6:
+            print("[FSM] ignore job: same as last done (retained duplicate)")
+            return
+
+        self._seen_jobs.put(key)
+
+        self.queue.push(job)
+        self._j("enq", job=job, key=key)
+        print(f"[FSM] queued job: {job} (qlen={len(self.queue)})")
+
+        self.kick()
+        self._persist()
+
+    def on_job_batch(self, payload: Dict[str, Any]):
+        jobs = (payload or {}).get("jobs") or []
+        print(f"[FSM] job batch: {len(jobs)} jobs")
+        for job in jobs:
+            if isinstance(job, dict):
+                self.on_job_latest(job)
+
+    def on_job_unpark(self, payload: Dict[str, Any]):
+        qid = (payload or {}).get("qid")
+        qid = qid if isinstance(qid, int) else None
+        back = self.queue.unpark(qid)
+        if not back:
+            print(f"[FSM] unpark: nothing parked (qid={qid})")
+            return
+        self._j("unpark", qid=qid)
+        print(f"[FSM] unparked {[j.get('qid') for j in back]} (qlen={len(self.queue)})")
+        self.kick()
+        self._persist()
+
+    def on_match(self, payload: Dict[str, Any]):
+        for lane in self.lanes:
+            lane.on_match(payload)
+
+    def on_sensor(self, payload: Dict[str, Any]):
+        for lane in self.lanes:
+            lane.on_sensor(payload)
+        self._persist()
+
+    def on_amr_topic(self, amr_id: str, leaf: str, data: Dict[str, Any]):
+        lane = self.by_id.get(amr_id)
+        if lane is None:
+            return
+        if leaf == "status":
+            lane.on_amr_status(data)
+        else:
+            lane.on_amr_connected(bool(data.get("connected")))
+
+def _goal_xy(goal_id: Optional[str]) -> Optional[Tuple[float, float]]:
+    return goal_xy_from_entry(get_registry().entry(goal_id))
 
 # ---------- MQTT glue ----------
-def start_fsm_mqtt():
+def start_fsm_mqtt(journal: Optional[FsmJournal] = None, recovered: Optional[Dict[str, Any]] = None,
+                   sched: Optional[Scheduler] = None, endpoints: Optional[List[AmrEndpoint]] = None):
     cli = mqtt.Client(client_id="run_all_fsm")
-    fsm = OrchestratorFSM(cli)
+    fsm = OrchestratorFleet(cli, endpoints, journal=journal, sched=sched)
+    if recovered:
+        fsm.restore(recovered)   # ก่อน subscribe: retained job/latest ที่กู้แล้วจะถูกกันซ้ำด้วย seen key
 
     def _on_connect(c, u, f, rc):
         subs = [
             (TOPIC_JOB_LATEST, 1),
+            (TOPIC_JOB_BATCH, 1),
+            (TOPIC_JOB_UNPARK, 1),
             (TOPIC_MATCH, 1),
             (TOPIC_SENSOR, 1),
+            (f"{TOPIC_SENSOR}/+", 1),
             (TOPIC_AMR_STATUS, 0),
             (TOPIC_AMR_CONN, 1),
+            (f"{TOPIC_LED_DESIRED}/+", 1),
         ]
+        if any(l.amr_id for l in fsm.lanes):
+            st, conn = amr_wildcards(MQTT_BASE)
+            subs += [(st, 0), (conn, 1)]
         c.subscribe(subs)
-        print(f"[FSM] MQTT connected; sub: job_latest / match / sensor / amr_status / amr_connected")
+        print(f"[FSM] MQTT connected; sub: job_latest / match / sensor / amr_status / amr_connected "
+              f"(amrs={[l.amr_id or '-' for l in fsm.lanes]} policy={fsm.policy_name})")
 
     def _on_message(c, u, msg):
+        if msg.topic.startswith(TOPIC_LED_DESIRED + "/"):
+            if msg.payload:
+                note_led_cart(msg.topic)
+            return
         try:
             data = json.loads(msg.payload.decode("utf-8"))
         except Exception:
             data = {}
-        if msg.topic == TOPIC_JOB_LATEST:
+        with fsm.lock:
+            _dispatch_msg(msg.topic, data)
+
+    def _dispatch_msg(topic: str, data: Dict[str, Any]):
+        if topic == TOPIC_JOB_LATEST:
             fsm.on_job_latest(data)
-        elif msg.topic == TOPIC_MATCH:
+        elif topic == TOPIC_JOB_BATCH:
+            fsm.on_job_batch(data)
+        elif topic == TOPIC_JOB_UNPARK:
+            fsm.on_job_unpark(data)
+        elif topic == TOPIC_MATCH:
             fsm.on_match(data)
-        elif msg.topic == TOPIC_SENSOR:
+        elif topic == TOPIC_SENSOR or topic.startswith(TOPIC_SENSOR + "/"):
             fsm.on_sensor(data)
-        elif msg.topic == TOPIC_AMR_STATUS:
-            fsm.on_amr_status(data)
-        elif msg.topic == TOPIC_AMR_CONN:
-            print(f"[FSM] AMR connected={data.get('connected')}")
+        else:
+            amr = parse_amr_topic(topic, MQTT_BASE)
+            if amr is not None:
+                fsm.on_amr_topic(amr[0], amr[1], data)
 
     cli.on_connect = _on_connect
     cli.on_message = _on_message
@@ -427,38 +900,39 @@ def start_fsm_mqtt():
 
 # ---------- main ----------
 def main():
-    # 0) เคลียร์สิ่งค้างก่อนเริ่ม
-    initial_cleanup()
-
-    # 1) start nodes
-    for name, script in ORDER:
-        PROCS.append(start_node(name, script))
-        time.sleep(0.4)
-
-    # 2) start FSM/MQTT
-    cli, fsm = start_fsm_mqtt()
-
-    # 3) loop
+    # 0) กู้ FSM จาก journal (มีงานค้าง) หรือเคลียร์สิ่งค้างก่อนเริ่ม
+    journal = FsmJournal()
+    recovered = journal.recover() if FSM_RECOVER else None
+    if not (recovered and (recovered["queue"] or recovered["parked"] or any(l.get("current") for l in recovered["lanes"].values()))):
+        recovered = None
+        journal.reset()
+    initial_cleanup(keep_state=recovered is not None)
+
+    # 1) start nodes พร้อมกัน (ตาม after / ready) + restart อัตโนมัติ
+    # 2) start FSM/MQTT (timer ของ FSM + supervisor รันบน main thread ผ่าน scheduler)
+    sched = Scheduler()
+    sup = Supervisor(NODES, sched, spawn=start_node).start()
+    cli, fsm = start_fsm_mqtt(journal, recovered, sched, FLEET)
+    sched.call_every(SUP_REPORT_SECS, sup.report, "sup_report")
+
+    # 3) loop: หลับจนถึง deadline ถัดไป
     try:
-        while True:
-            time.sleep(0.5)
-            fsm.watchdog_tick()
-            for (name, _), proc in zip(ORDER, PROCS):
-                if proc.poll() is not None:
-                    print(f"[RUNNER] WARN: process '{name}' exited with code {proc.returncode}")
+        sched.run_forever()
     except KeyboardInterrupt:
         pass
     finally:
         print("\n[RUNNER] stopping...")
         cli.loop_stop(); cli.disconnect()
-        for p in PROCS:
-            try: p.send_signal(signal.SIGINT)
-            except: pass
-        time.sleep(1.5)
-        for p in PROCS:
-            try:
-                if p.poll() is None: p.terminate()
-            except: pass
+        sched.stop()
+        fsm.snap.close()
+        fsm.flush_journal()     # record ที่ยังค้างใน scheduler
+        journal.close()
+        print(f"[SNAP] {fsm.snap.stats()} [SCHED] fired={sched.fired} max_late_ms={sched.max_late_ms:.1f} "
+              f"[SEEN] {fsm._seen_jobs.stats()}")
+        if get_shm() is not None:
+            print(f"[SHM] {get_shm().stats()}")
+        sup.report()
+        sup.stop()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Deadline scheduler (heap) แทน loop ที่ตื่นทุก 0.5 s
+
+    sched = Scheduler()
+    t = sched.call_later(5.0, fn)          # หรือ call_at(time.monotonic() + 5.0, fn)
+    t.cancel()                              # ยกเลิก (lazy: ทิ้งตอนถึงหัว heap)
+    sched.run_forever()                     # main thread หลับจนถึง deadline ถัดไป
+    sched.start()                           # หรือรันใน thread แยก
+
+- deadline เป็น time.monotonic(): Pi ไม่มี RTC, NTP step นาฬิกาตอนบูตเป็นนาที -> time.time() ทำ timer ยิงก่อน/หลังเวลา
+  (ผู้เรียกที่มีเวลาแบบ wall clock ต้องแปลงเอง: call_later(when - time.time()))
+- arm / cancel ได้จากทุก thread (เช่น paho callback) -> ปลุก loop ถ้า deadline ใหม่มาก่อน
+- callback รันบน thread ของ scheduler ทีละตัว (ผู้ใช้ต้อง lock state เอง)
+"""
+
+import time, heapq, itertools, threading
+from typing import Callable, List, Optional, Tuple
+
+class Timer:
+    __slots__ = ("when", "fn", "name", "cancelled")
+
+    def __init__(self, when: float, fn: Callable[[], None], name: str):
+        self.when, self.fn, self.name = when, fn, name
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def active(self) -> bool:
+        return not self.cancelled
+
+class Scheduler:
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Timer]] = []
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self._stop = False
+        self._th: Optional[threading.Thread] = None
+        # stats
+        self.fired = 0
+        self.wakeups = 0
+        self.max_late_ms = 0.0
+
+    # ---------- arm ----------
+    def call_at(self, when: float, fn: Callable[[], None], name: str = "") -> Timer:
+        t = Timer(when, fn, name)
+        with self._cv:
+            heapq.heappush(self._heap, (when, next(self._seq), t))
+            if self._heap[0][2] is t:
+                self._cv.notify()
+        return t
+
+    def call_later(self, delay: float, fn: Callable[[], None], name: str = "") -> Timer:
+        return self.call_at(time.monotonic() + max(0.0, delay), fn, name)
+
+    def call_every(self, interval: float, fn: Callable[[], None], name: str = "") -> Timer:
+        """รันซ้ำทุก interval วินาที (คืน Timer ตัวแรก ; ยกเลิกด้วย stop())"""
+        def _tick():
+            fn()
+            self.call_later(interval, _tick, name)
+        return self.call_later(interval, _tick, name)
+
+    def pending(self) -> int:
+        with self._cv:
+            return sum(1 for _, _, t in self._heap if not t.cancelled)
+
+    # ---------- run ----------
+    def _next_due(self) -> Optional[Timer]:
+        with self._cv:
+            while not self._stop:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cv.wait()
+                else:
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        return heapq.heappop(self._heap)[2]
+                    self._cv.wait(wait)
+                self.wakeups += 1
+            return None
+
+    def run_forever(self):
+        while True:
+            t = self._next_due()
+            if t is None:
+                return
+            if t.cancelled:
+                continue
+            t.cancelled = True      # ยิงครั้งเดียว
+            late = (time.monotonic() - t.when) * 1000.0
+            self.max_late_ms = max(self.max_late_ms, late)
+            self.fired += 1
+            try:
+                t.fn()
+            except Exception as e:
+                print(f"[SCHED] timer '{t.name}' error: {e}")
+
+    def start(self):
+        self._th = threading.Thread(target=self.run_forever, name="Scheduler", daemon=True)
+        self._th.start()
+        return self
+
+    def stop(self):
+        with self._cv:
+            self._stop = True
+            self._cv.notify_all()
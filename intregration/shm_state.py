@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+State ร่วมระหว่างโหนดผ่าน shared memory (แทนการเขียน/อ่าน state.json + fsm_state.json ทุกครั้ง)
+
+    shm = get_shm()               # None เมื่อ SHM_STATE=0 หรือเปิด segment ไม่ได้
+    shm.put_job(job)              # current job (None = ไม่มีงาน)
+    job = shm.job()               # dict / {} ไม่มีงาน / None = ยังไม่เคยเขียน หรืออ่านไม่สำเร็จ -> ใช้ backend
+    shm.put_fsm(snap)             # snapshot ของ fleet (dict เดียวกับที่ SnapshotWriter ได้)
+    fsm = shm.fsm()
+
+layout (POSIX shm "/SHM_STATE_NAME", ขนาดคงที่, little-endian):
+    0     header   magic "SCS1" + ขนาด layout
+    64    job      [seq u64][crc32 u32][pad] + _JOB   (ts, flags, op, goal_id, goal_name, cuh x2, kit x2, job_id)
+    ...   fsm      [seq u64][crc32 u32][pad] + _FSM   (ts, flags, state, queue_len, parked, photo x4,
+                                                       clear_since, match_complete, current job)
+- seqlock ต่อ region: writer ทำ seq เป็นคี่ -> เขียน body + crc -> seq คู่ ;
+  reader copy body ระหว่าง seq คู่ที่เท่ากันสองครั้ง + crc ตรง (กันอ่านขาดกลางบน ARM ที่ไม่มี barrier)
+  ไม่ได้ภายใน SHM_READ_SPINS รอบ -> None (ผู้เรียก fallback ไป backend)
+- writer หลาย process (main_server commit / run_all clear) ต่อคิวกันด้วย flock -> มี writer ทีละ 1 ; reader ไม่ล็อก
+- string ยาวเกินช่อง -> flag truncated -> job() คืน None (ใช้ค่าจาก backend แทนค่าที่ถูกตัด)
+- segment อยู่ข้าม restart ของโหนด (ไม่ให้ resource_tracker unlink ตอน process จบ) ; หายเมื่อ reboot -> seq 0
+- ไฟล์ JSON ยังเขียนเหมือนเดิม (durable / debug export) แต่โหนดอ่านจากที่นี่
+
+    python shm_state.py          # dump ทั้งสอง region + เวลาอ่าน
+"""
+
+import os, json, time, zlib, fcntl, struct, threading, contextlib
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, List, Optional
+
+from state_store import DATA_DIR, StateBackend
+
+SHM_STATE      = os.getenv("SHM_STATE", "1") == "1"         # 0 = อ่าน/เขียนผ่าน backend อย่างเดียว (แบบเดิม)
+SHM_STATE_NAME = os.getenv("SHM_STATE_NAME", "smartcart_state")
+SHM_READ_SPINS = int(os.getenv("SHM_READ_SPINS", "1000"))
+SHM_LOCK_PATH  = os.path.join(DATA_DIR, ".shm_state.lock")
+
+PHOTO_NAMES = ("barcode1", "barcode2", "rfidA", "rfidB")   # ลำดับช่อง photo ใน record
+
+_MAGIC = b"SCS1"
+_HDR   = struct.Struct("<4sI")
+_SEQ   = struct.Struct("<Q")
+_CRC   = struct.Struct("<I")
+_BODY  = 16                                   # offset ของ body ใน region
+_JOB   = struct.Struct("<dB8s32s64s64s64s64s64s64s")
+_FSM   = struct.Struct("<dB16sII4sdB8s32s64s64s64s64s64s")
+_PRESENT, _TRUNC = 1, 2
+_PHOTO_UNKNOWN = 255
+
+def _align(n: int) -> int:
+    return (n + 63) // 64 * 64
+
+_OFF_JOB = 64
+_OFF_FSM = _OFF_JOB + _align(_BODY + _JOB.size)
+SHM_SIZE = _OFF_FSM + _align(_BODY + _FSM.size)
+
+class _Enc:
+    """str -> bytes ความยาวไม่เกินช่อง (จำว่ามีการตัดหรือไม่)"""
+    def __init__(self):
+        self.trunc = False
+
+    def __call__(self, v: Any, width: int) -> bytes:
+        raw = b"" if v is None else str(v).encode("utf-8")
+        if len(raw) > width:
+            self.trunc = True
+            raw = raw[:width]
+        return raw
+
+def _dec(b: bytes) -> Optional[str]:
+    s = b.rstrip(b"\0").decode("utf-8", errors="ignore")
+    return s or None
+
+def _two(vals: Any) -> List[Any]:
+    v = list(vals or [])
+    return (v[:2] + [None, None])[:2]
+
+def _job_fields(job: Dict[str, Any], enc: _Enc, name_key: str) -> tuple:
+    cuh = _two(job.get("cuh_ids") or [job.get("cuh_id")])
+    kit = _two(job.get("kit_ids") or [job.get("kit_id")])
+    return (enc(job.get("op"), 8), enc(job.get("goal_id"), 32), enc(job.get(name_key), 64),
+            enc(cuh[0], 64), enc(cuh[1], 64), enc(kit[0], 64), enc(kit[1], 64))
+
+def _job_dict(op, goal, extra, c0, c1, k0, k1, name_key: str) -> Dict[str, Any]:
+    cuh2, kit2 = [_dec(c0), _dec(c1)], [_dec(k0), _dec(k1)]
+    job = {"goal_id": _dec(goal), "cuh_ids": cuh2, "kit_ids": kit2}
+    if cuh2[0] is not None:
+        job["cuh_id"] = cuh2[0]
+    if kit2[0] is not None:
+        job["kit_id"] = kit2[0]
+    if _dec(op):
+        job["op"] = _dec(op)
+    if _dec(extra):
+        job[name_key] = _dec(extra)
+    return job
+
+def _open_segment(name: str, size: int) -> shared_memory.SharedMemory:
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        shm = shared_memory.SharedMemory(name=name)
+        if shm.size < size:
+            # layout เก่าที่เล็กกว่า -> สร้างใหม่ (reader ที่เปิดค้างอยู่จะเห็น seq 0 ในรอบถัดไปที่ attach)
+            shm.close()
+            shm.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    try:
+        # segment ใช้ร่วมกันข้าม process/restart (เหมือนไฟล์) -> ไม่ให้ tracker unlink ตอน process นี้จบ
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+class ShmState:
+    def __init__(self, name: str = SHM_STATE_NAME, lock_path: str = SHM_LOCK_PATH):
+        self.name = name
+        self.lock_path = lock_path
+        self._shm = _open_segment(name, SHM_SIZE)
+        self.buf = self._shm.buf
+        self._tlock = threading.RLock()     # flock ไม่กันระหว่าง thread ของ process เดียวกัน
+        self._depth = 0                     # ซ้อนได้ (ShmStateBackend ถือ lock ครอบ backend + put_job)
+        self._lock_fd: Optional[int] = None
+        with self._write_lock():
+            magic, size = _HDR.unpack_from(self.buf, 0)
+            if magic != _MAGIC or size != SHM_SIZE:
+                self.buf[:SHM_SIZE] = bytes(SHM_SIZE)
+                _HDR.pack_into(self.buf, 0, _MAGIC, SHM_SIZE)
+        # stats
+        self.writes = 0
+        self.reads = 0
+        self.retries = 0
+        self.misses = 0         # อ่านไม่สำเร็จ / ยังไม่เคยเขียน / ถูกตัด -> fallback
+
+    # ---------- seqlock ----------
+    @contextlib.contextmanager
+    def _write_lock(self):
+        with self._tlock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+                return
+            if self._lock_fd is None:
+                os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+                self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._depth = 1
+            try:
+                yield
+            finally:
+                self._depth = 0
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _write(self, off: int, body: bytes):
+        crc = zlib.crc32(body)
+        buf = self.buf
+        with self._write_lock():
+            seq = _SEQ.unpack_from(buf, off)[0]
+            odd = seq + 1 if seq % 2 == 0 else seq + 2      # seq คี่ค้าง = writer ก่อนหน้าตายกลางการเขียน
+            _SEQ.pack_into(buf, off, odd)
+            buf[off + _BODY:off + _BODY + len(body)] = body
+            _CRC.pack_into(buf, off + 8, crc)
+            _SEQ.pack_into(buf, off, odd + 1)
+            self.writes += 1
+
+    def _read(self, off: int, size: int) -> Optional[bytes]:
+        buf = self.buf
+        self.reads += 1
+        for _ in range(SHM_READ_SPINS):
+            s1 = _SEQ.unpack_from(buf, off)[0]
+            if s1 == 0:
+                break
+            if s1 % 2:
+                self.retries += 1
+                continue
+            body = bytes(buf[off + _BODY:off + _BODY + size])
+            crc = _CRC.unpack_from(buf, off + 8)[0]
+            if _SEQ.unpack_from(buf, off)[0] == s1 and zlib.crc32(body) == crc:
+                return body
+            self.retries += 1
+        self.misses += 1
+        return None
+
+    def version(self, region: str = "job") -> int:
+        """seq ปัจจุบันของ region (เปลี่ยนทุกครั้งที่เขียน ; ใช้เช็คว่ามีอะไรใหม่โดยไม่ต้อง decode)"""
+        return _SEQ.unpack_from(self.buf, _OFF_JOB if region == "job" else _OFF_FSM)[0]
+
+    # ---------- current job ----------
+    def put_job(self, job: Optional[Dict[str, Any]]):
+        enc = _Enc()
+        if job:
+            fields = _job_fields(job, enc, "goal_name") + (enc(job.get("job_id"), 64),)
+            ts, flags = float(job.get("ts") or time.time()), _PRESENT
+        else:
+            fields, ts, flags = (b"",) * 8, time.time(), 0
+        if enc.trunc:
+            flags |= _TRUNC
+        self._write(_OFF_JOB, _JOB.pack(ts, flags, *fields))
+
+    def job(self) -> Optional[Dict[str, Any]]:
+        body = self._read(_OFF_JOB, _JOB.size)
+        if body is None:
+            return None
+        ts, flags, op, goal, name, c0, c1, k0, k1, job_id = _JOB.unpack(body)
+        if flags & _TRUNC:
+            self.misses += 1
+            return None
+        if not flags & _PRESENT:
+            return {}
+        job = _job_dict(op, goal, name, c0, c1, k0, k1, "goal_name")
+        job["ts"] = ts
+        if _dec(job_id):
+            job["job_id"] = _dec(job_id)
+        return job
+
+    # ---------- FSM ----------
+    def put_fsm(self, snap: Optional[Dict[str, Any]]):
+        if not snap:
+            self._write(_OFF_FSM, _FSM.pack(time.time(), 0, b"", 0, 0, bytes([_PHOTO_UNKNOWN] * 4), 0.0, 0,
+                                            *((b"",) * 7)))
+            return
+        enc = _Enc()
+        photo = snap.get("photo") or {}
+        pst = photo.get("state") or {}
+        parked = snap.get("parked")
+        state = enc(snap.get("state"), 16)
+        cur = _job_fields(snap.get("current") or {}, enc, "job_id")
+        self._write(_OFF_FSM, _FSM.pack(
+            float(snap.get("ts") or time.time()), _PRESENT | (_TRUNC if enc.trunc else 0), state,
+            int(snap.get("queue_len") or 0), len(parked) if isinstance(parked, list) else int(parked or 0),
+            bytes(_PHOTO_UNKNOWN if pst.get(n) is None else (1 if pst[n] else 0) for n in PHOTO_NAMES),
+            float(photo.get("clear_since") or 0.0), 1 if (snap.get("match") or {}).get("complete") else 0,
+            *cur))
+
+    def fsm(self) -> Optional[Dict[str, Any]]:
+        body = self._read(_OFF_FSM, _FSM.size)
+        if body is None:
+            return None
+        (ts, flags, state, qlen, parked, photo, clear_since, complete,
+         op, goal, job_id, c0, c1, k0, k1) = _FSM.unpack(body)
+        if not flags & _PRESENT:
+            return {}
+        cur = _job_dict(op, goal, job_id, c0, c1, k0, k1, "job_id") if _dec(goal) or _dec(op) else None
+        return {
+            "ts": ts, "state": _dec(state) or "IDLE", "queue_len": qlen, "parked": parked,
+            "current": cur,
+            "photo": {"state": {n: v for n, v in zip(PHOTO_NAMES, photo) if v != _PHOTO_UNKNOWN},
+                      "clear_since": clear_since or None},
+            "match_complete": bool(complete),
+            "truncated": bool(flags & _TRUNC),
+        }
+
+    def stats(self) -> Dict[str, int]:
+        return {"writes": self.writes, "reads": self.reads, "retries": self.retries, "misses": self.misses}
+
+    def close(self):
+        self.buf = None
+        self._shm.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+class ShmStateBackend(StateBackend):
+    """backend เดิม (durable + debug export) + current job ใน shared memory ; อ่าน current job จาก shm ก่อน"""
+
+    def __init__(self, inner: StateBackend, shm: ShmState):
+        self.inner = inner
+        self.shm = shm
+        self.name = f"{inner.name}+shm"
+
+    def commit_jobs(self, records):
+        self.inner.commit_jobs(records)
+
+    def set_current_job(self, job):
+        # durable ก่อน แล้วค่อยให้โหนดอื่นเห็น ; ทั้งคู่ใต้ lock เดียว -> writer อื่นแทรกให้ backend กับ shm ไม่ตรงกันไม่ได้
+        with self.shm._write_lock():
+            self.inner.set_current_job(job)
+            self.shm.put_job(job)
+
+    def get_current_job(self):
+        job = self.shm.job()
+        return job if job is not None else self.inner.get_current_job()
+
+    def clear_current_job(self):
+        with self.shm._write_lock():
+            self.inner.clear_current_job()
+            self.shm.put_job(None)
+
+    def query_jobs(self, goal_id=None, op=None, since_ts=None, until_ts=None):
+        return self.inner.query_jobs(goal_id=goal_id, op=op, since_ts=since_ts, until_ts=until_ts)
+
+    def save_fsm_snapshot(self, text):
+        self.inner.save_fsm_snapshot(text)
+
+    def load_fsm_snapshot(self):
+        return self.inner.load_fsm_snapshot()
+
+    def clear_fsm_snapshot(self):
+        # region fsm เขียนโดย SnapshotWriter.offer() เท่านั้น (ไฟล์ถูก clear ช้ากว่าบน writer thread)
+        self.inner.clear_fsm_snapshot()
+
+    def record_match(self, result):
+        self.inner.record_match(result)
+
+    def latest_match(self):
+        return self.inner.latest_match()
+
+    def close(self):
+        self.inner.close()
+
+_shm: Optional[ShmState] = None
+_shm_failed = False
+
+def get_shm() -> Optional[ShmState]:
+    global _shm, _shm_failed
+    if _shm is None and SHM_STATE and not _shm_failed:
+        try:
+            _shm = ShmState()
+            print(f"[SHM] state segment /{_shm.name} ({SHM_SIZE} bytes)")
+        except Exception as e:
+            _shm_failed = True
+            print(f"[SHM] shared state unavailable ({e}) → file/db only")
+    return _shm
+
+def _bench(fn, n: int = 20000) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) * 1e6 / n
+
+if __name__ == "__main__":
+    shm = get_shm()
+    if shm is None:
+        raise SystemExit(1)
+    print("job :", json.dumps(shm.job(), ensure_ascii=False))
+    print("fsm :", json.dumps(shm.fsm(), ensure_ascii=False))
+    print(f"read: job {_bench(shm.job):.2f} us  fsm {_bench(shm.fsm):.2f} us  "
+          f"(seq job={shm.version('job')} fsm={shm.version('fsm')})")
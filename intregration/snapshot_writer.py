@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Write-behind writer สำหรับ FSM snapshot (OrchestratorFSM)
+
+- FSM เรียก offer(snap) ทุก event (แค่วาง dict ลงช่องเดียว ไม่แตะดิสก์)
+  snap ใหม่ทับตัวเก่าที่ยังไม่ได้เขียน (coalesce)
+- writer thread flush อย่างมาก 1 ครั้ง / SNAPSHOT_FLUSH_MS
+  urgent=True (state transition / clear) -> flush ทันที
+- เนื้อหาเหมือนครั้งก่อน (ไม่นับ ts/date/time/iso) -> ข้าม ไม่เขียน
+- JSON แบบ compact (ไม่มี indent)
+- offer(None) = clear_fsm_snapshot() (ตามลำดับเดียวกับ snapshot)
+- shm (shm_state.ShmState) -> offer() เขียน region fsm ทันที (โหนดอื่นอ่านได้เลย) ; ไฟล์/DB เป็น debug export
+"""
+
+import os, json, time, threading
+from typing import Any, Dict, Optional
+
+from state_store import StateBackend, get_backend
+
+SNAPSHOT_FLUSH_MS = float(os.getenv("SNAPSHOT_FLUSH_MS", "500"))
+
+_TS_KEYS = ("ts", "date", "time", "iso")
+_CLEAR = object()     # ช่องว่าง = ไม่มีอะไรค้าง ; None = clear
+
+class SnapshotWriter:
+    def __init__(self, backend: Optional[StateBackend] = None, flush_ms: float = SNAPSHOT_FLUSH_MS, shm=None):
+        self.backend = backend or get_backend()
+        self.shm = shm
+        self.interval = max(0.0, flush_ms) / 1000.0
+        self._cv = threading.Condition()
+        self._pending: Any = _CLEAR
+        self._urgent = False
+        self._stop = False
+        self._last_body: Optional[Dict[str, Any]] = None
+        self._last_flush = 0.0
+        # stats
+        self.offers = 0
+        self.writes = 0
+        self.skipped = 0        # เนื้อหาไม่เปลี่ยน
+        self.coalesced = 0      # ถูก snap ใหม่ทับก่อนเขียน
+        self.clears = 0
+        self.errors = 0
+        self.last_write_ms = 0.0
+        self.max_write_ms = 0.0
+        self.total_write_ms = 0.0
+        self._th = threading.Thread(target=self._run, name="SnapshotWriter", daemon=True)
+
+    def start(self):
+        self._th.start()
+        return self
+
+    # ---------- API (FSM thread) ----------
+    def offer(self, snap: Optional[Dict[str, Any]], urgent: bool = False):
+        if self.shm is not None:
+            try:
+                self.shm.put_fsm(snap)
+            except Exception as e:
+                self.errors += 1
+                print(f"[SNAP] shm write failed: {e}")
+        with self._cv:
+            if self._pending is not _CLEAR:
+                self.coalesced += 1
+            self._pending = snap
+            self.offers += 1
+            if urgent or snap is None:
+                self._urgent = True
+            self._cv.notify()
+
+    def clear(self):
+        self.offer(None)
+
+    def close(self, timeout: float = 2.0):
+        """flush ที่ค้างแล้วหยุด thread"""
+        with self._cv:
+            self._stop = True
+            self._cv.notify()
+        self._th.join(timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        n = self.writes or 1
+        return {"offers": self.offers, "writes": self.writes, "skipped": self.skipped,
+                "coalesced": self.coalesced, "clears": self.clears, "errors": self.errors,
+                "last_ms": round(self.last_write_ms, 3), "max_ms": round(self.max_write_ms, 3),
+                "avg_ms": round(self.total_write_ms / n, 3)}
+
+    # ---------- writer thread ----------
+    def _take(self):
+        """รอจนถึงเวลา flush -> (snap, stop)"""
+        with self._cv:
+            while True:
+                if self._pending is not _CLEAR:
+                    wait = self._last_flush + self.interval - time.monotonic()
+                    if self._urgent or self._stop or wait <= 0:
+                        snap, self._pending, self._urgent = self._pending, _CLEAR, False
+                        return snap, False
+                    self._cv.wait(wait)
+                elif self._stop:
+                    return _CLEAR, True
+                else:
+                    self._cv.wait()
+
+    def _write(self, snap: Optional[Dict[str, Any]]):
+        if snap is None:
+            self.backend.clear_fsm_snapshot()
+            self._last_body = None
+            self.clears += 1
+            return
+        body = {k: v for k, v in snap.items() if k not in _TS_KEYS}
+        if body == self._last_body:
+            self.skipped += 1
+            return
+        t0 = time.perf_counter()
+        self.backend.save_fsm_snapshot(json.dumps(snap, ensure_ascii=False, separators=(",", ":")))
+        ms = (time.perf_counter() - t0) * 1000.0
+        self._last_body = body
+        self.writes += 1
+        self.last_write_ms = ms
+        self.total_write_ms += ms
+        self.max_write_ms = max(self.max_write_ms, ms)
+
+    def _run(self):
+        while True:
+            snap, stop = self._take()
+            if stop:
+                break
+            try:
+                self._write(snap)
+            except Exception as e:
+                self.errors += 1
+                print(f"[SNAP] write failed: {e}")
+            self._last_flush = time.monotonic()
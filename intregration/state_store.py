@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+State backend (เลือกด้วย env STATE_BACKEND=json|sqlite)
+
+API เดียวกันทุก backend:
+    commit_jobs(records)        ประวัติงานใหม่จาก main_server (durable เมื่อ return)
+    set_current_job(job)        งานที่ orchestrator รับทำอยู่ (match_id ใช้เทียบ CUH/KIT)
+    get_current_job()           -> dict ("latest_job_ids")
+    clear_current_job()
+    query_jobs(goal_id, op, since_ts, until_ts)
+    save_fsm_snapshot(text)     snapshot ของ OrchestratorFSM (JSON text)
+    load_fsm_snapshot()         -> dict
+    clear_fsm_snapshot()
+    record_match(result)        ผลจาก match_id
+    latest_match()              -> dict
+
+- json   : state.json / fsm_state.json + job_journal (รูปแบบไฟล์เดิม)
+- sqlite : data/smartcart.db (WAL) อ่านพร้อมกันได้หลาย process, เขียนทีละ 1 (busy_timeout)
+- SHM_STATE=1 (ค่าเริ่มต้น): get_backend() ห่อด้วย shm_state.ShmStateBackend
+  current job อ่านจาก shared memory (ไม่ต้องเปิด/parse ไฟล์) ; backend ข้างในยังเขียนเป็น durable/debug export
+"""
+
+import os, abc, json, time, sqlite3, tempfile, threading
+from typing import Any, Dict, Iterator, List, Optional
+
+DATA_DIR       = os.path.expanduser("~/cart_ws/intregration/data")
+STATE_PATH     = os.path.join(DATA_DIR, "state.json")
+FSM_STATE_PATH = os.path.join(DATA_DIR, "fsm_state.json")
+SQLITE_PATH    = os.getenv("STATE_DB", os.path.join(DATA_DIR, "smartcart.db"))
+STATE_BACKEND  = os.getenv("STATE_BACKEND", "json").strip().lower()
+SQLITE_SYNC    = os.getenv("STATE_DB_SYNC", "FULL").upper()   # FULL = durable ทุก commit, NORMAL = เร็วกว่า
+
+def _atomic_write(path: str, text: str):
+    d = os.path.dirname(path)
+    os.makedirs(d, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=d, delete=False, encoding="utf-8") as tmp:
+        tmp.write(text); tmp.flush(); os.fsync(tmp.fileno())
+        tmp_path = tmp.name
+    os.replace(tmp_path, path)
+
+def _read_json(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+class StateBackend(abc.ABC):
+    name = "base"
+
+    @abc.abstractmethod
+    def commit_jobs(self, records: List[Dict[str, Any]]): ...
+    @abc.abstractmethod
+    def set_current_job(self, job: Dict[str, Any]): ...
+    @abc.abstractmethod
+    def get_current_job(self) -> Dict[str, Any]: ...
+    @abc.abstractmethod
+    def clear_current_job(self): ...
+    @abc.abstractmethod
+    def query_jobs(self, goal_id: Optional[str] = None, op: Optional[str] = None,
+                   since_ts: Optional[float] = None, until_ts: Optional[float] = None) -> Iterator[Dict[str, Any]]: ...
+    @abc.abstractmethod
+    def save_fsm_snapshot(self, text: str): ...
+    @abc.abstractmethod
+    def load_fsm_snapshot(self) -> Dict[str, Any]: ...
+    @abc.abstractmethod
+    def clear_fsm_snapshot(self): ...
+    @abc.abstractmethod
+    def record_match(self, result: Dict[str, Any]): ...
+    @abc.abstractmethod
+    def latest_match(self) -> Dict[str, Any]: ...
+    def close(self): pass
+
+# ========= JSON files (เดิม) =========
+class JsonFileBackend(StateBackend):
+    name = "json"
+
+    def __init__(self, state_path: str = STATE_PATH, fsm_path: str = FSM_STATE_PATH, journal=None):
+        self.state_path = state_path
+        self.fsm_path = fsm_path
+        self._journal = journal
+        self._last_match: Dict[str, Any] = {}
+
+    @property
+    def journal(self):
+        if self._journal is None:
+            from job_journal import get_journal
+            self._journal = get_journal()
+        return self._journal
+
+    def commit_jobs(self, records):
+        if not records:
+            return
+        self.journal.append_many(records)
+        self.journal.sync()
+
+    def set_current_job(self, job):
+        _atomic_write(self.state_path, json.dumps({"latest_job_ids": job}, ensure_ascii=False, indent=2))
+
+    def get_current_job(self):
+        return _read_json(self.state_path).get("latest_job_ids") or {}
+
+    def clear_current_job(self):
+        _atomic_write(self.state_path, "{}")
+
+    def query_jobs(self, goal_id=None, op=None, since_ts=None, until_ts=None):
+        return self.journal.query(goal_id=goal_id, op=op, since_ts=since_ts, until_ts=until_ts)
+
+    def save_fsm_snapshot(self, text):
+        tmp = self.fsm_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, self.fsm_path)
+
+    def load_fsm_snapshot(self):
+        return _read_json(self.fsm_path)
+
+    def clear_fsm_snapshot(self):
+        self.save_fsm_snapshot("{}")
+
+    def record_match(self, result):
+        # json backend: ไม่เขียนไฟล์ (ผล match ส่งผ่าน MQTT อยู่แล้ว) เก็บล่าสุดไว้ใน memory
+        self._last_match = result
+
+    def latest_match(self):
+        return self._last_match
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+
+# ========= SQLite (WAL) =========
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS current_job (
+    id   INTEGER PRIMARY KEY CHECK (id = 1),
+    ts   REAL,
+    job  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts       REAL,
+    date     TEXT,
+    goal_id  TEXT,
+    op       TEXT,
+    job      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_goal_ts ON jobs (goal_id, ts);
+CREATE INDEX IF NOT EXISTS jobs_ts ON jobs (ts);
+CREATE TABLE IF NOT EXISTS fsm_snapshot (
+    id    INTEGER PRIMARY KEY CHECK (id = 1),
+    ts    REAL,
+    snap  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS match_results (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts        REAL,
+    goal_id   TEXT,
+    op        TEXT,
+    complete  INTEGER,
+    result    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS match_ts ON match_results (ts);
+"""
+
+class SqliteBackend(StateBackend):
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_PATH, synchronous: str = SQLITE_SYNC):
+        self.path = path
+        self.synchronous = synchronous if synchronous in ("OFF", "NORMAL", "FULL") else "FULL"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()     # 1 connection ต่อ thread
+        with self._conn() as c:
+            c.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute(f"PRAGMA synchronous={self.synchronous}")
+            c.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = c
+        return c
+
+    def _tx(self, fn):
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            out = fn(c)
+            c.execute("COMMIT")
+            return out
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    def commit_jobs(self, records):
+        if not records:
+            return
+        rows = [(r.get("ts"), r.get("date"), r.get("goal_id"), r.get("op"),
+                 json.dumps(r, ensure_ascii=False)) for r in records]
+        self._tx(lambda c: c.executemany("INSERT INTO jobs (ts, date, goal_id, op, job) VALUES (?,?,?,?,?)", rows))
+
+    def set_current_job(self, job):
+        self._conn().execute("INSERT OR REPLACE INTO current_job (id, ts, job) VALUES (1, ?, ?)",
+                             (job.get("ts"), json.dumps(job, ensure_ascii=False)))
+
+    def get_current_job(self):
+        row = self._conn().execute("SELECT job FROM current_job WHERE id = 1").fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def clear_current_job(self):
+        self._conn().execute("DELETE FROM current_job WHERE id = 1")
+
+    def query_jobs(self, goal_id=None, op=None, since_ts=None, until_ts=None):
+        sql, args = ["SELECT job FROM jobs WHERE 1=1"], []
+        if goal_id:
+            sql.append("AND goal_id = ?"); args.append(goal_id.strip().upper())
+        if op:
+            sql.append("AND op = ?"); args.append(op)
+        if since_ts is not None:
+            sql.append("AND ts >= ?"); args.append(since_ts)
+        if until_ts is not None:
+            sql.append("AND ts <= ?"); args.append(until_ts)
+        sql.append("ORDER BY ts")
+        for (job,) in self._conn().execute(" ".join(sql), args):
+            yield json.loads(job)
+
+    def save_fsm_snapshot(self, text):
+        self._conn().execute("INSERT OR REPLACE INTO fsm_snapshot (id, ts, snap) VALUES (1, ?, ?)",
+                             (time.time(), text))
+
+    def load_fsm_snapshot(self):
+        row = self._conn().execute("SELECT snap FROM fsm_snapshot WHERE id = 1").fetchone()
+        try:
+            return json.loads(row[0]) if row else {}
+        except Exception:
+            return {}
+
+    def clear_fsm_snapshot(self):
+        self._conn().execute("DELETE FROM fsm_snapshot WHERE id = 1")
+
+    def record_match(self, result):
+        latest = result.get("latest_job_ids") or {}
+        self._conn().execute(
+            "INSERT INTO match_results (ts, goal_id, op, complete, result) VALUES (?,?,?,?,?)",
+            (result.get("ts"), latest.get("goal_id"), result.get("op"),
+             1 if result.get("complete") else 0, json.dumps(result, ensure_ascii=False)))
+
+    def latest_match(self):
+        row = self._conn().execute("SELECT result FROM match_results ORDER BY id DESC LIMIT 1").fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def close(self):
+        c = getattr(self._local, "conn", None)
+        if c is not None:
+            c.close()
+            self._local.conn = None
+
+# ========= factory =========
+_BACKENDS = {"json": JsonFileBackend, "sqlite": SqliteBackend}
+_backend: Optional[StateBackend] = None
+
+def get_backend() -> StateBackend:
+    global _backend
+    if _backend is None:
+        cls = _BACKENDS.get(STATE_BACKEND)
+        if cls is None:
+            print(f"[STATE] unknown STATE_BACKEND '{STATE_BACKEND}', use json")
+            cls = JsonFileBackend
+        _backend = cls()
+        from shm_state import ShmStateBackend, get_shm     # import ตรงนี้ (shm_state import state_store)
+        shm = get_shm()
+        if shm is not None:
+            _backend = ShmStateBackend(_backend, shm)
+        print(f"[STATE] backend = {_backend.name}")
+    return _backend
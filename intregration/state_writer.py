@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+State writer (group commit) สำหรับ main_server
+
+- event loop แค่ submit() งานเข้า queue แล้วได้ Future กลับมา (ไม่แตะดิสก์)
+- writer thread ดึงงานทั้งหมดที่ค้างใน queue เป็น batch:
+    * ประวัติงาน append ทุกรายการในครั้งเดียว แล้ว fsync/commit ครั้งเดียว
+  (ผ่าน state_store backend: json = state.json + job journal, sqlite = 1 transaction)
+- Future ของทุกงานใน batch จะ resolve หลัง fsync เสร็จ (ใช้เมื่อ client ขอ durable)
+"""
+
+import os, time, queue, threading
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Dict, List, Optional, Tuple
+
+from state_store import StateBackend, get_backend
+
+WRITER_MAX_BATCH = int(os.getenv("WRITER_MAX_BATCH", "256"))
+
+def _resolve(fut: Future, result: Any = None, err: Optional[BaseException] = None):
+    """
+    ผู้รอยกเลิก future ได้ (asyncio.wrap_future: task ของ client ถูก cancel / server ปิด)
+    -> ข้าม future ที่จบแล้ว ; InvalidStateError ห้ามหลุดออกไปฆ่า writer thread
+    """
+    if fut.done():
+        return
+    try:
+        if err is None:
+            fut.set_result(result)
+        else:
+            fut.set_exception(err)
+    except InvalidStateError:
+        pass    # ถูก cancel ระหว่างเช็กกับ set
+
+class _Group:
+    """Future ร่วมของ submit_many: งานอาจถูกแบ่งไปหลาย batch ; resolve เมื่อครบทุกงาน, fail ถ้า batch ใดล้ม
+    (เรียกจาก writer thread เท่านั้น)"""
+    def __init__(self, n: int, fut: Future):
+        self.left = n
+        self.n = n
+        self.err: Optional[BaseException] = None
+        self.fut = fut
+
+    def finish(self, err: Optional[BaseException] = None):
+        if err is not None and self.err is None:
+            self.err = err
+        self.left -= 1
+        if self.left:
+            return
+        _resolve(self.fut, self.n, self.err)
+
+class StateWriter:
+    def __init__(self, backend: Optional[StateBackend] = None, max_batch: int = WRITER_MAX_BATCH):
+        self.backend = backend or get_backend()
+        self.max_batch = max_batch
+        self._q: "queue.Queue[Optional[Tuple[Dict[str, Any], Any]]]" = queue.Queue()      # (record, Future | _Group)
+        # stats
+        self.batches = 0
+        self.records = 0
+        self.last_batch_ms = 0.0
+        self._th = threading.Thread(target=self._run, name="StateWriter", daemon=True)
+
+    def start(self):
+        self._th.start()
+        return self
+
+    # ---------- API ----------
+    def submit(self, record: Dict[str, Any]) -> Future:
+        fut: Future = Future()
+        self._q.put((record, fut))
+        return fut
+
+    def submit_many(self, records: List[Dict[str, Any]]) -> Future:
+        """หลายงาน ; Future resolve (จำนวนงาน) เมื่อทุกงาน durable แม้ถูกแบ่งหลาย batch, exception ถ้า batch ใดล้ม"""
+        fut: Future = Future()
+        if not records:
+            fut.set_result(0)
+            return fut
+        group = _Group(len(records), fut)
+        for r in records:
+            self._q.put((r, group))
+        return fut
+
+    def alive(self) -> bool:
+        return self._th.is_alive()
+
+    def close(self, timeout: float = 5.0):
+        self._q.put(None)
+        self._th.join(timeout=timeout)
+
+    # ---------- writer thread ----------
+    def _drain(self) -> Tuple[List[Tuple[Dict[str, Any], Any]], bool]:
+        item = self._q.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        stop = False
+        while len(batch) < self.max_batch:
+            try:
+                item = self._q.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _commit(self, records: List[Dict[str, Any]]):
+        self.backend.commit_jobs(records)
+        print(f"[STATE] committed: {records[-1]} (batch={len(records)})")
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._drain()
+            if not batch:
+                continue
+            t0 = time.perf_counter()
+            err = None
+            try:
+                self._commit([r for r, _ in batch])
+            except Exception as e:
+                err = e
+                print(f"[STATE] group commit failed: {e}")
+            self.last_batch_ms = (time.perf_counter() - t0) * 1000.0
+            self.batches += 1
+            self.records += len(batch)
+            for _, fut in batch:
+                if isinstance(fut, _Group):
+                    fut.finish(err)
+                else:
+                    _resolve(fut, len(batch), err)
+        self.backend.close()
+
+if __name__ == "__main__":
+    # self-check: ผู้รอ durable ถูก cancel ระหว่าง commit -> writer ต้องยังรับงานต่อได้
+    import asyncio
+
+    class _SlowBackend:
+        name = "selfcheck"
+        def commit_jobs(self, records): time.sleep(0.05)
+        def close(self): pass
+
+    async def _check(w: StateWriter):
+        for submit in (lambda: w.submit({"n": 1}), lambda: w.submit_many([{"n": 2}, {"n": 3}])):
+            task = asyncio.ensure_future(asyncio.wrap_future(submit()))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await asyncio.sleep(0.1)
+            assert w.alive(), "writer thread died after a cancelled waiter"
+        assert w.submit({"n": 4}).result(timeout=2) == 1
+        assert w.submit_many([{"n": 5}, {"n": 6}]).result(timeout=2) == 2
+
+    w = StateWriter(backend=_SlowBackend()).start()
+    asyncio.run(_check(w))
+    w.close()
+    print("[STATE] self-check ok: cancelled waiters do not stop the writer")
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Supervisor ของโหนดลูกใน run_all (แทน start ทีละตัว + sleep 0.4 s)
+
+    specs = [NodeSpec("match_id", "match_id.py"), NodeSpec("main_sensor", "main_sensor.py", after=("match_id",))]
+    sup = Supervisor(specs, sched, spawn=start_node).start()
+
+- โหนดที่ไม่มี after เริ่มพร้อมกันทันที ; โหนดที่มี after เริ่มเมื่อโหนดเหล่านั้น ready แล้ว
+- ready = โหนด publish retained {BASE}/node/<name>/ready {"pid":..} หลัง subscribe เสร็จ (mark_ready)
+  pid ต้องตรงกับ process ปัจจุบัน (retained เก่าจากรอบก่อนไม่นับ)
+  ไม่มีสัญญาณภายใน SUP_READY_TIMEOUT -> ถือว่า ready (เตือนใน log)
+- process ตาย -> start ใหม่หลัง backoff 1, 2, 4, ... ≤ SUP_BACKOFF_MAX วินาที
+  (อยู่ได้นาน ≥ SUP_STABLE_SECS แล้วตาย -> เริ่มนับ backoff ใหม่)
+- สถานะ (pid / state / uptime / restarts) -> retained {BASE}/supervisor/status ทุกครั้งที่เปลี่ยน
+- state ทั้งหมดแก้บน scheduler thread (MQTT / waiter thread แค่ส่งต่อเข้า scheduler)
+"""
+
+import os, json, time, signal, threading, subprocess
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import paho.mqtt.client as mqtt
+
+from scheduler import Scheduler
+
+MQTT_HOST         = os.getenv("MQTT_HOST", "127.0.0.1")
+MQTT_PORT         = int(os.getenv("MQTT_PORT", "1883"))
+MQTT_BASE         = os.getenv("MQTT_BASE", "smartcart")
+SUP_READY_TIMEOUT = float(os.getenv("SUP_READY_TIMEOUT", "15"))
+SUP_BACKOFF_BASE  = float(os.getenv("SUP_BACKOFF_BASE", "1.0"))
+SUP_BACKOFF_MAX   = float(os.getenv("SUP_BACKOFF_MAX", "60"))
+SUP_STABLE_SECS   = float(os.getenv("SUP_STABLE_SECS", "60"))
+
+NODE_NAME = os.getenv("SUPERVISOR_NODE", "")     # run_all ตั้งให้โหนดลูก
+TOPIC_SUP_STATUS = f"{MQTT_BASE}/supervisor/status"
+
+def ready_topic(name: str, base: str = MQTT_BASE) -> str:
+    return f"{base}/node/{name}/ready"
+
+def mark_ready(cli: mqtt.Client, name: str = NODE_NAME):
+    """ฝั่งโหนด: เรียกหลัง subscribe (broker ทำตามลำดับ -> ready มาถึงหลัง subscription ใช้งานได้แล้ว)"""
+    if not name:
+        return
+    cli.publish(ready_topic(name), json.dumps({"pid": os.getpid(), "ts": time.time()}), qos=1, retain=True)
+
+class NodeSpec(NamedTuple):
+    name: str
+    script: str
+    env: Optional[Dict[str, str]] = None
+    after: Sequence[str] = ()        # รอโหนดเหล่านี้ ready ก่อนเริ่ม
+
+class _Node:
+    def __init__(self, spec: NodeSpec):
+        self.spec = spec
+        self.proc: Optional[subprocess.Popen] = None
+        self.state = "waiting"       # waiting | starting | ready | backoff | stopped
+        self.ever_ready = False
+        self.started_at = 0.0
+        self.ready_ms: Optional[float] = None
+        self.restarts = 0
+        self.streak = 0              # ตายติดกัน (ใช้คำนวณ backoff)
+
+class Supervisor:
+    def __init__(self, specs: List[NodeSpec], sched: Scheduler,
+                 spawn: Callable[[str, str, Optional[Dict[str, str]]], subprocess.Popen]):
+        self.sched = sched
+        self.spawn = spawn
+        self.nodes: Dict[str, _Node] = {s.name: _Node(s) for s in specs}
+        self._stopping = False
+        self._t0 = time.time()
+        self._all_ready = False
+        self.cli = mqtt.Client(client_id=f"run_all_sup-{os.getpid()}")
+        self.cli.on_connect = self._on_connect
+        self.cli.on_message = self._on_message
+
+    # ---------- MQTT (paho thread) ----------
+    def _on_connect(self, c, u, f, rc):
+        c.subscribe(ready_topic("+"), qos=1)
+
+    def _on_message(self, c, u, msg):
+        name = msg.topic[len(MQTT_BASE) + len("/node/"):-len("/ready")]
+        try:
+            pid = json.loads(msg.payload.decode("utf-8")).get("pid")
+        except Exception:
+            return
+        self.sched.call_later(0, lambda: self._on_ready(name, pid), "node_ready")
+
+    # ---------- lifecycle (scheduler thread) ----------
+    def start(self):
+        self.cli.connect_async(MQTT_HOST, MQTT_PORT, 30)
+        self.cli.loop_start()
+        for node in self.nodes.values():
+            self._maybe_start(node)
+        return self
+
+    def _maybe_start(self, node: _Node):
+        if node.state != "waiting" or self._stopping:
+            return
+        if all(self.nodes[d].ever_ready for d in node.spec.after if d in self.nodes):
+            self._spawn(node)
+
+    def _spawn(self, node: _Node):
+        env = dict(node.spec.env or {})
+        env["SUPERVISOR_NODE"] = node.spec.name
+        try:
+            proc = self.spawn(node.spec.name, node.spec.script, env)
+        except Exception as e:
+            print(f"[SUP] {node.spec.name} spawn failed: {e}")
+            self._schedule_restart(node, uptime=0.0)
+            return
+        node.proc, node.state, node.started_at, node.ready_ms = proc, "starting", time.time(), None
+        threading.Thread(target=self._wait, args=(node, proc), name=f"wait-{node.spec.name}", daemon=True).start()
+        self.sched.call_later(SUP_READY_TIMEOUT, lambda: self._ready_timeout(node, proc), "ready_timeout")
+        self._publish_status()
+
+    def _wait(self, node: _Node, proc: subprocess.Popen):
+        rc = proc.wait()
+        self.sched.call_later(0, lambda: self._on_exit(node, proc, rc), "node_exit")
+
+    def _set_ready(self, node: _Node, how: str):
+        node.state = "ready"
+        node.ever_ready = True
+        node.ready_ms = (time.time() - node.started_at) * 1000.0
+        print(f"[SUP] {node.spec.name} ready ({how}) in {node.ready_ms:.0f} ms")
+        for other in self.nodes.values():
+            if node.spec.name in other.spec.after:
+                self._maybe_start(other)
+        self._publish_status()
+        if not self._all_ready and all(n.ever_ready for n in self.nodes.values()):
+            self._all_ready = True
+            print(f"[SUP] all nodes ready in {(time.time() - self._t0) * 1000:.0f} ms")
+
+    def _on_ready(self, name: str, pid: Any):
+        node = self.nodes.get(name)
+        if node is None or node.proc is None or node.state != "starting" or pid != node.proc.pid:
+            return      # retained ของ process เก่า / โหนดที่ไม่ได้ดูแล
+        self._set_ready(node, "signal")
+
+    def _ready_timeout(self, node: _Node, proc: subprocess.Popen):
+        if node.proc is proc and node.state == "starting":
+            print(f"[SUP] WARN: {node.spec.name} sent no ready signal in {SUP_READY_TIMEOUT:.0f}s → assume ready")
+            self._set_ready(node, "timeout")
+
+    def _on_exit(self, node: _Node, proc: subprocess.Popen, rc: int):
+        if node.proc is not proc or self._stopping:
+            return
+        uptime = time.time() - node.started_at
+        print(f"[SUP] WARN: {node.spec.name} pid={proc.pid} exited rc={rc} after {uptime:.1f}s")
+        self._schedule_restart(node, uptime)
+
+    def _schedule_restart(self, node: _Node, uptime: float):
+        if uptime >= SUP_STABLE_SECS:
+            node.streak = 0
+        delay = min(SUP_BACKOFF_MAX, SUP_BACKOFF_BASE * (2 ** node.streak))
+        node.streak += 1
+        node.state = "backoff"
+        print(f"[SUP] restart {node.spec.name} in {delay:.1f}s (restarts={node.restarts})")
+        self.sched.call_later(delay, lambda: self._restart(node), "restart")
+        self._publish_status()
+
+    def _restart(self, node: _Node):
+        if self._stopping or node.state != "backoff":
+            return
+        node.restarts += 1
+        self._spawn(node)
+
+    # ---------- report ----------
+    def status(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        return [{"name": n.spec.name, "pid": n.proc.pid if n.proc else None, "state": n.state,
+                 "uptime_s": round(now - n.started_at, 1) if n.state in ("starting", "ready") else 0.0,
+                 "ready_ms": round(n.ready_ms) if n.ready_ms is not None else None,
+                 "restarts": n.restarts} for n in self.nodes.values()]
+
+    def _publish_status(self):
+        try:
+            self.cli.publish(TOPIC_SUP_STATUS, json.dumps({"nodes": self.status(), "ts": time.time()}),
+                             qos=0, retain=True)
+        except Exception as e:
+            print(f"[SUP] publish status error: {e}")
+
+    def report(self):
+        print("[SUP] " + " ".join(f"{s['name']}:{s['state']} up={s['uptime_s']:.0f}s r={s['restarts']}"
+                                  for s in self.status()))
+        self._publish_status()
+
+    # ---------- stop (main thread) ----------
+    def stop(self, grace: float = 1.5):
+        self._stopping = True
+        procs = [n.proc for n in self.nodes.values() if n.proc is not None and n.proc.poll() is None]
+        for p in procs:
+            try: p.send_signal(signal.SIGINT)
+            except Exception: pass
+        deadline = time.time() + grace
+        for p in procs:
+            try: p.wait(timeout=max(0.0, deadline - time.time()))
+            except Exception:
+                try: p.terminate()
+                except Exception: pass
+        for n in self.nodes.values():
+            n.state = "stopped"
+        self._publish_status()
+        self.cli.loop_stop()
+        self.cli.disconnect()
@@ -4,6 +4,8 @@
 import os, json, asyncio, websockets, sys
 from typing import Set
 
+from ws_limits import WsLimits, serve_kwargs
+
 HOST = os.getenv("WS_HOST", "0.0.0.0")
 PORT = int(os.getenv("WS_PORT", "8765"))
 TARGET_PUSH_IP = os.getenv("TARGET_PUSH_IP", "192.168.1.100")  # ส่งเฉพาะไคลเอนต์ IP นี้
@@ -17,6 +19,7 @@ STATE_MAP = {
 }
 
 CONNECTED: Set[websockets.WebSocketServerProtocol] = set()
+LIMITS = WsLimits()
 
 def _pretty(obj):
     try:
@@ -32,7 +35,7 @@ async def broadcast_list_one(text: str):
     payload = json.dumps([text], ensure_ascii=False)
     dead = []
     sent = 0
-    for ws in list(CONNECTED):
+    for ws in LIMITS.evict_slow(list(CONNECTED)):
         try:
             peer = getattr(ws, "remote_address", None)
             if not peer:
@@ -53,6 +56,8 @@ async def broadcast_list_one(text: str):
 
 async def handle(ws):
     peer = getattr(ws, "remote_address", None)
+    if not await LIMITS.admit(ws):
+        return
     CONNECTED.add(ws)
     print(f"[WS] CONNECT from {peer} (tracked={len(CONNECTED)})")
     try:
@@ -85,10 +90,14 @@ async def handle(ws):
             }
             await ws.send(json.dumps(ack, ensure_ascii=False))
             print("[WS] -> ACK sent.")
+    except websockets.exceptions.ConnectionClosed as e:
+        LIMITS.note_closed(e)
+        print(f"[WS] CLOSED from {peer}: {e}")
     except Exception as e:
         print(f"[WS] EXCEPTION from {peer}: {e}")
     finally:
         CONNECTED.discard(ws)
+        LIMITS.release(ws)
         print(f"[WS] CLOSE {peer} (tracked={len(CONNECTED)})")
 
 async def stdin_key_loop():
@@ -135,8 +144,7 @@ def print_menu():
 async def main():
     print(f"[WS] Starting server on ws://{HOST}:{PORT} (TARGET_PUSH_IP={TARGET_PUSH_IP})")
     async with websockets.serve(
-        handle, HOST, PORT,
-        max_size=None, max_queue=None, ping_interval=20, ping_timeout=20
+        handle, HOST, PORT, **serve_kwargs()
     ):
         await stdin_key_loop()
 
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+TTL cache แบบมีขอบเขต (OrderedDict ตามลำดับการใส่)
+
+- จำกัดทั้งจำนวน (max_items) และอายุ (ttl วินาที ต่อ entry)
+- get() ตรวจอายุของ entry นั้นเสมอ / put() กวาด entry หมดอายุจากหัวคิว แล้วตัดตัวเก่าสุดถ้าเกินจำนวน
+- ไม่ thread-safe (ใช้ใน event loop หรือ thread เดียว)
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+class TTLCache:
+    def __init__(self, max_items: int = 4096, ttl: float = 60.0):
+        self.max_items = max(1, int(max_items))
+        self.ttl = float(ttl)
+        self._d: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        # stats
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0      # ถูกตัดเพราะเกิน max_items
+        self.expirations = 0    # หมดอายุ
+
+    def __len__(self):
+        return len(self._d)
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._d.get(key)
+        return item is not None and item[0] > time.monotonic()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._d.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        if item[0] <= time.monotonic():
+            del self._d[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self.hits += 1
+        return item[1]
+
+    def put(self, key: Hashable, value: Any = True, ttl: Optional[float] = None):
+        now = time.monotonic()
+        if key in self._d:
+            del self._d[key]          # ใส่ใหม่ = ไปท้ายคิว
+        self._d[key] = (now + (self.ttl if ttl is None else ttl), value)
+        self._sweep(now)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._d.pop(key, None)
+        return default if item is None else item[1]
+
+    def _sweep(self, now: float):
+        d = self._d
+        while d:
+            key, (exp, _) = next(iter(d.items()))
+            if exp > now:
+                break
+            del d[key]
+            self.expirations += 1
+        while len(d) > self.max_items:
+            d.popitem(last=False)
+            self.evictions += 1
+
+    def keys(self) -> List[Hashable]:
+        """key ที่ยังไม่หมดอายุ ตามลำดับการใส่"""
+        now = time.monotonic()
+        return [k for k, (exp, _) in self._d.items() if exp > now]
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._d), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "expirations": self.expirations}
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ขีดจำกัดของ WebSocket server (main_server / test_commu) ให้ memory บน Pi มีขอบเขตเสมอ
+
+- WS_MAX_SIZE      ขนาด frame สูงสุด (byte) เกิน -> websockets ปิด connection ด้วย 1009
+- WS_MAX_QUEUE     จำนวน frame ขาเข้าที่ค้างได้ต่อ client (เต็ม -> หยุดอ่าน socket = TCP back-pressure)
+- WS_WRITE_LIMIT   high-water ของ write buffer ต่อ client (send() จะรอ drain)
+- WS_MAX_CLIENTS   จำนวน connection พร้อมกัน เกิน -> ปิดด้วย 1013 (try again later)
+- WS_JOB_RATE / WS_JOB_BURST   token bucket ต่อ client สำหรับการส่งงาน (งาน/วินาที, burst >= WS_MAX_BATCH_JOBS)
+- WS_EVICT_BYTES   push stream: client ที่ write buffer ค้างเกินนี้ (อ่านไม่ทัน) ถูกตัดทิ้ง
+"""
+
+import os, time, asyncio
+from typing import Any, Dict, Iterable, List
+
+WS_MAX_SIZE    = int(os.getenv("WS_MAX_SIZE", str(256 * 1024)))
+WS_MAX_QUEUE   = int(os.getenv("WS_MAX_QUEUE", "16"))
+WS_WRITE_LIMIT = int(os.getenv("WS_WRITE_LIMIT", str(64 * 1024)))
+WS_MAX_CLIENTS = int(os.getenv("WS_MAX_CLIENTS", "64"))
+WS_JOB_RATE    = float(os.getenv("WS_JOB_RATE", "20"))
+WS_JOB_BURST   = float(os.getenv("WS_JOB_BURST", "200"))
+WS_EVICT_BYTES = int(os.getenv("WS_EVICT_BYTES", str(256 * 1024)))
+
+CLOSE_TOO_BIG  = 1009
+CLOSE_TRY_LATER = 1013
+
+def serve_kwargs() -> Dict[str, Any]:
+    """kwargs สำหรับ websockets.serve (แทน max_size=None, max_queue=None)"""
+    return {
+        "max_size": WS_MAX_SIZE,
+        "max_queue": WS_MAX_QUEUE,
+        "write_limit": WS_WRITE_LIMIT,
+        "ping_interval": 20,
+        "ping_timeout": 20,
+    }
+
+class TokenBucket:
+    def __init__(self, rate: float = WS_JOB_RATE, burst: float = WS_JOB_BURST):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self._t = time.monotonic()
+
+    def take(self, n: float = 1.0) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._t) * self.rate)
+        self._t = now
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    def retry_after(self, n: float = 1.0) -> float:
+        """วินาทีที่ต้องรอจน take(n) ผ่าน (n เกิน burst -> ไม่มีวันผ่าน)"""
+        if n > self.burst or self.rate <= 0:
+            return -1.0
+        return max(0.0, (n - self.tokens) / self.rate)
+
+def _buffered(ws) -> int:
+    tr = getattr(ws, "transport", None)
+    try:
+        return tr.get_write_buffer_size() if tr is not None else 0
+    except Exception:
+        return 0
+
+class WsLimits:
+    """สถานะ/ตัวนับของ server เดียว (ใช้ใน event loop เท่านั้น)"""
+    def __init__(self, max_clients: int = WS_MAX_CLIENTS, evict_bytes: int = WS_EVICT_BYTES):
+        self.max_clients = max_clients
+        self.evict_bytes = evict_bytes
+        self.clients = 0
+        self._throttled = set()
+        self._evicting = set()
+        # counters
+        self.frames_rejected = 0     # frame ใหญ่เกิน WS_MAX_SIZE
+        self.clients_rejected = 0    # เกิน WS_MAX_CLIENTS
+        self.jobs_throttled = 0      # งานที่ถูกปฏิเสธเพราะ rate limit
+        self.clients_throttled = 0   # จำนวน client (ไม่ซ้ำ) ที่เคยโดน rate limit
+        self.slow_evicted = 0        # client push stream ที่อ่านไม่ทัน
+
+    # ---------- connection ----------
+    async def admit(self, ws) -> bool:
+        if self.clients >= self.max_clients:
+            self.clients_rejected += 1
+            print(f"[WS] reject {getattr(ws, 'remote_address', None)}: too many clients ({self.clients})")
+            await ws.close(CLOSE_TRY_LATER, "too many clients")
+            return False
+        self.clients += 1
+        return True
+
+    def release(self, ws):
+        self.clients = max(0, self.clients - 1)
+        self._throttled.discard(id(ws))
+        self._evicting.discard(id(ws))
+
+    def note_closed(self, exc: BaseException):
+        """เรียกจาก except ConnectionClosed: นับ frame ที่ใหญ่เกิน"""
+        for frame in (getattr(exc, "sent", None), getattr(exc, "rcvd", None)):
+            if frame is not None and frame.code == CLOSE_TOO_BIG:
+                self.frames_rejected += 1
+                return
+
+    # ---------- rate limit ----------
+    def allow_jobs(self, ws, bucket: TokenBucket, n: int = 1) -> bool:
+        if bucket.take(n):
+            return True
+        self.jobs_throttled += n
+        if id(ws) not in self._throttled:
+            self._throttled.add(id(ws))
+            self.clients_throttled += 1
+        return False
+
+    # ---------- slow consumers ----------
+    def evict_slow(self, targets: Iterable[Any]) -> List[Any]:
+        """ตัด client ที่ write buffer ค้างเกิน evict_bytes คืน client ที่ยังส่งต่อได้"""
+        ok = []
+        for ws in targets:
+            if id(ws) in self._evicting:
+                continue
+            if _buffered(ws) > self.evict_bytes:
+                self._evicting.add(id(ws))
+                self.slow_evicted += 1
+                print(f"[WS] evict slow consumer {getattr(ws, 'remote_address', None)} (buffer={_buffered(ws)})")
+                asyncio.ensure_future(ws.close(CLOSE_TRY_LATER, "slow consumer"))
+            else:
+                ok.append(ws)
+        return ok
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "clients": self.clients,
+            "frames_rejected": self.frames_rejected,
+            "clients_rejected": self.clients_rejected,
+            "jobs_throttled": self.jobs_throttled,
+            "clients_throttled": self.clients_throttled,
+            "slow_evicted": self.slow_evicted,
+        }
@@ -1,5 +1,12 @@
 # send_list_once_fixed.py
-import os, json, websocket
+import os, sys, json, websocket
+
+# ใช้ validator ตัวเดียวกับ server ถ้ามี (intregration/job_schema.py) ไม่มีก็ใช้ตัวตรวจในไฟล์นี้
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "intregration"))
+try:
+    from job_schema import validate_job, to_list
+except ImportError:
+    validate_job = None
 
 # ---------- CONFIG ----------
 # DEFAULT_URL = "ws://192.168.1.102:8765"
@@ -35,6 +42,12 @@ def _canon_value(x):
 
 def _validate_and_prepare(p):
     
+    if validate_job is not None:
+        job, errs, _ = validate_job(p, default_op=DEFAULT_OP)
+        if errs:
+            return False, "; ".join(str(e) for e in errs)
+        return True, to_list(job)
+
     if not isinstance(p, list):
         return False, "payload must be list"
 
@@ -81,15 +94,37 @@ def _send_one(prepared):
     ws.close()
     print("👋 Done\n")
 
+def _send_batch(prepared_list):
+    """ส่งหลายงานใน frame เดียว: {"type":"batch","jobs":[...]} (1 connection)"""
+    print(f"→ Connecting to {URL}")
+    ws = websocket.create_connection(URL)
+    print("✅ Connected")
+    msg = json.dumps({"type": "batch", "jobs": prepared_list}, ensure_ascii=False)
+    ws.send(msg)
+    print(f"🛰️  Sent batch: {len(prepared_list)} jobs")
+    try:
+        ws.settimeout(5.0)
+        reply = json.loads(ws.recv())
+        print(f"📩 Recv: status={reply.get('status')} accepted={reply.get('accepted')} rejected={reply.get('rejected')}")
+        for r in reply.get("results", []):
+            print(f"   [{r.get('index')}] {r.get('status')} {r.get('job_id') or r.get('errors')}")
+    except Exception:
+        print("… no reply")
+    ws.close()
+    print("👋 Done\n")
+
 def main():
     if BATCH_SEND:
+        prepared = []
         for idx, p in enumerate(BATCH_LIST, 1):
             ok, out = _validate_and_prepare(p)
             if not ok:
                 print(f"[{idx}] ❌ ไม่ส่ง: {out} | payload={p}")
                 continue
             print(f"[{idx}] ✅ ส่ง: {out}")
-            _send_one(out)
+            prepared.append(out)
+        if prepared:
+            _send_batch(prepared)
     else:
         ok, out = _validate_and_prepare(payload)
         if not ok: